@@ -0,0 +1,175 @@
+"""
+Controle de admissão (load shedding) para as rotas que usam o banco.
+
+Cada classe de rota tem um número máximo de requisições simultâneas e um tempo
+máximo de espera na fila. Quem não consegue vaga dentro desse tempo recebe um
+503 rápido com ``Retry-After`` em vez de ficar preso no ``pool.acquire()`` até o
+worker estourar o timeout do gunicorn. Leituras baratas têm prioridade: enquanto
+houver leitura esperando, requisições de admin/bulk são recusadas na entrada.
+
+A middleware também publica o prazo da requisição em ``request_deadline``; o
+``Database`` usa esse prazo para definir o ``statement_timeout`` das consultas.
+"""
+
+import asyncio
+import math
+import os
+import time
+from contextvars import ContextVar
+from typing import NamedTuple
+
+from starlette.responses import JSONResponse
+
+from metrics import ADMISSION_REJECTED
+
+
+def _env_float(nome: str, padrao: float) -> float:
+    return float(os.getenv(nome, str(padrao)))
+
+
+class RouteClass(NamedTuple):
+    nome: str
+    prioridade: int  # 0 = mais prioritária
+    limite: int  # requisições simultâneas
+    espera_max: float  # segundos na fila antes do 503
+    orcamento: float  # prazo total da requisição (segundos)
+
+
+# A soma dos limites não deve passar do tamanho máximo do pool (10 por padrão);
+# os jobs em segundo plano usam um pool próprio (database.JOBS_POOL_MAX_SIZE)
+ROUTE_CLASSES: dict[str, RouteClass] = {
+    "leitura": RouteClass(
+        "leitura",
+        0,
+        int(os.getenv("ADMISSION_LEITURA_LIMITE", "5")),
+        _env_float("ADMISSION_LEITURA_ESPERA", 0.5),
+        _env_float("ADMISSION_LEITURA_ORCAMENTO", 3.0),
+    ),
+    "escrita": RouteClass(
+        "escrita",
+        1,
+        int(os.getenv("ADMISSION_ESCRITA_LIMITE", "3")),
+        _env_float("ADMISSION_ESCRITA_ESPERA", 0.3),
+        _env_float("ADMISSION_ESCRITA_ORCAMENTO", 5.0),
+    ),
+    "admin": RouteClass(
+        "admin",
+        2,
+        int(os.getenv("ADMISSION_ADMIN_LIMITE", "1")),
+        _env_float("ADMISSION_ADMIN_ESPERA", 0.1),
+        _env_float("ADMISSION_ADMIN_ORCAMENTO", 20.0),
+    ),
+    # Exports em streaming: seguram uma conexão durante todo o download
+    "export": RouteClass(
+        "export",
+        2,
+        int(os.getenv("ADMISSION_EXPORT_LIMITE", "1")),
+        _env_float("ADMISSION_EXPORT_ESPERA", 0.1),
+        _env_float("ADMISSION_EXPORT_ORCAMENTO", 600.0),
+    ),
+}
+
+# Rotas que não passam pela admissão (não usam o banco ou precisam responder sempre)
+# /eventos é um stream longo (SSE): ocuparia uma vaga de leitura enquanto a aba estiver aberta
+BYPASS_PREFIXES = ("/health", "/metrics", "/docs", "/redoc", "/openapi.json", "/eventos")
+
+# Agregados e operações em lote: menor prioridade
+ADMIN_PREFIXES = ("/dashboard", "/produtos/bulk")
+EXPORT_PREFIXES = ("/produtos/export",)
+
+# Instante (time.monotonic) em que a requisição atual estoura o orçamento
+request_deadline: ContextVar[float | None] = ContextVar("request_deadline", default=None)
+
+
+def remaining_budget() -> float | None:
+    """Segundos restantes do orçamento da requisição atual (None fora de requisição)."""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def classificar(method: str, path: str) -> str | None:
+    """Retorna o nome da classe da rota, ou None se a rota não passa pela admissão."""
+    if path.startswith(BYPASS_PREFIXES):
+        return None
+    if path.startswith(ADMIN_PREFIXES):
+        return "admin"
+    if path.startswith(EXPORT_PREFIXES):
+        return "export"
+    if method in ("GET", "HEAD"):
+        return "leitura"
+    if method == "OPTIONS":
+        return None
+    return "escrita"
+
+
+class AdmissionGate:
+    """Semáforo cuja fila é limitada pelo tempo de espera."""
+
+    def __init__(self, classe: RouteClass):
+        self.classe = classe
+        self._sem = asyncio.Semaphore(classe.limite)
+        self.na_fila = 0
+        self.rejeitadas = 0
+
+    async def entrar(self) -> bool:
+        if not self._sem.locked():
+            await self._sem.acquire()
+            return True
+        self.na_fila += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.classe.espera_max)
+            return True
+        except TimeoutError:
+            return False
+        finally:
+            self.na_fila -= 1
+
+    def sair(self):
+        self._sem.release()
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.classe.espera_max * 2 * (self.classe.prioridade + 1)))
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI pura: custo de um acquire de semáforo no caminho feliz."""
+
+    def __init__(self, app, classes: dict[str, RouteClass] | None = None):
+        self.app = app
+        classes = ROUTE_CLASSES if classes is None else classes
+        self.gates = {nome: AdmissionGate(c) for nome, c in classes.items()}
+
+    def _ha_prioritaria_esperando(self, gate: AdmissionGate) -> bool:
+        return any(
+            outro.na_fila
+            for outro in self.gates.values()
+            if outro.classe.prioridade < gate.classe.prioridade
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        nome = classificar(scope["method"], scope["path"])
+        if nome is None:
+            return await self.app(scope, receive, send)
+
+        gate = self.gates[nome]
+        if self._ha_prioritaria_esperando(gate) or not await gate.entrar():
+            gate.rejeitadas += 1
+            ADMISSION_REJECTED.inc(nome)
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Servidor sobrecarregado, tente novamente em instantes"},
+                headers={"Retry-After": str(gate.retry_after)},
+            )
+            return await response(scope, receive, send)
+
+        token = request_deadline.set(time.monotonic() + gate.classe.orcamento)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_deadline.reset(token)
+            gate.sair()
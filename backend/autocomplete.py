@@ -0,0 +1,207 @@
+"""
+Autocomplete de nomes de produto servido da memória do worker.
+
+Uma consulta por tecla digitada derrubaria o Postgres; aqui cada worker mantém
+um array ordenado de chaves e responde com busca binária (``bisect``), sem I/O.
+
+- Chaves: o nome normalizado (minúsculas, sem acento) a partir do início de
+  cada palavra, cortado em ``TAMANHO_CHAVE`` caracteres. "Notebook Gamer"
+  gera "notebook gamer" e "gamer": "gam" acha o produto pela segunda palavra.
+  A chave do começo do nome leva o prefixo ``MARCA_INICIO`` ("\\x00") e fica
+  numa faixa própria no início do array: a busca olha primeiro os nomes que
+  começam com o texto digitado e depois as demais palavras. ``ids`` é um
+  ``array('i')`` paralelo às chaves (4 bytes por entrada).
+- Carga: um warmer do startup lê (id, nome) de todo o catálogo.
+- Atualização incremental: os triggers da migração 4 mandam os itens alterados
+  (até 20 por comando) no ``NOTIFY eventos``; o índice insere/remove só as
+  chaves desses produtos. Comandos maiores, TRUNCATE e reconexões do LISTEN
+  disparam uma recarga completa em segundo plano.
+- Notificações que chegam durante uma recarga são guardadas e aplicadas depois,
+  na ordem; reaplicar o que a carga já viu não muda nada.
+- Memória: ``estatisticas()`` (e ``/metrics``) mostram entradas e bytes.
+"""
+
+import asyncio
+import bisect
+import sys
+import time
+import unicodedata
+from array import array
+
+import metrics
+from repositories import ProdutoRepository
+
+TAMANHO_CHAVE = 32
+LIMITE_PADRAO = 10
+# Entradas examinadas por busca: prefixos curtos ("a") casam milhares de chaves
+VARREDURA_MAX = 200
+MARCA_INICIO = "\x00"
+
+
+def normalizar(texto: str) -> str:
+    decomposto = unicodedata.normalize("NFKD", texto.casefold())
+    sem_acento = "".join(c for c in decomposto if not unicodedata.combining(c))
+    return " ".join(sem_acento.split())
+
+
+def _chaves(nome: str) -> list[str]:
+    normalizado = normalizar(nome)
+    return [
+        (MARCA_INICIO if i == 0 else "") + normalizado[i : i + TAMANHO_CHAVE]
+        for i, c in enumerate(normalizado)
+        if c.isalnum() and (i == 0 or not normalizado[i - 1].isalnum())
+    ]
+
+
+class IndiceAutocomplete:
+    def __init__(self):
+        self.chaves: list[str] = []
+        self.ids = array("i")
+        self.nomes: dict[int, str] = {}
+        self.pronto = False
+        self.carregado_em: float | None = None
+        self._pool = None
+        self._tarefa: asyncio.Task | None = None
+        self._pendentes: list[dict] | None = None
+        self._recarregar_de_novo = False
+
+    # ---------- busca ----------
+    def buscar(self, prefixo: str, limite: int = LIMITE_PADRAO) -> list[dict]:
+        """Produtos com alguma palavra começando por ``prefixo``; quem começa com ele vem antes."""
+        consulta = normalizar(prefixo)
+        if not consulta:
+            return []
+        chave = consulta[:TAMANHO_CHAVE]
+        cortada = len(consulta) > TAMANHO_CHAVE
+        # Em cada faixa as chaves vêm em ordem alfabética; o primeiro a entrar fica na frente
+        candidatos: dict[int, None] = {}
+        for alvo in (MARCA_INICIO + chave, chave):
+            i = bisect.bisect_left(self.chaves, alvo)
+            fim = bisect.bisect_left(
+                self.chaves, alvo + "\U0010ffff", i, min(i + VARREDURA_MAX, len(self.chaves))
+            )
+            for pid in self.ids[i:fim]:
+                if len(candidatos) >= limite and not cortada:
+                    break
+                candidatos.setdefault(pid)
+        melhores = list(candidatos)
+        if cortada:
+            # Chave cortada: confere o resto da consulta no nome inteiro
+            melhores = [pid for pid in melhores if consulta in normalizar(self.nomes[pid])]
+        melhores = melhores[:limite]
+        return [{"id": pid, "nome": self.nomes[pid]} for pid in melhores]
+
+    # ---------- carga e atualização ----------
+    def carregar(self, linhas):
+        """Reconstrói o índice a partir de registros com ``id`` e ``nome``."""
+        entradas = sorted((chave, r["id"]) for r in linhas for chave in _chaves(r["nome"]))
+        self.chaves = [chave for chave, _ in entradas]
+        self.ids = array("i", (pid for _, pid in entradas))
+        self.nomes = {r["id"]: r["nome"] for r in linhas}
+        self.pronto = True
+        self.carregado_em = time.time()
+
+    def inserir(self, pid: int, nome: str):
+        if self.nomes.get(pid) == nome:
+            return
+        self.remover(pid)
+        for chave in _chaves(nome):
+            # Mesma ordem de carregar(): (chave, id)
+            i = bisect.bisect_left(self.chaves, chave)
+            while i < len(self.chaves) and self.chaves[i] == chave and self.ids[i] < pid:
+                i += 1
+            self.chaves.insert(i, chave)
+            self.ids.insert(i, pid)
+        self.nomes[pid] = nome
+
+    def remover(self, pid: int):
+        nome = self.nomes.pop(pid, None)
+        if nome is None:
+            return
+        for chave in _chaves(nome):
+            i = bisect.bisect_left(self.chaves, chave)
+            while i < len(self.chaves) and self.chaves[i] == chave:
+                if self.ids[i] == pid:
+                    del self.chaves[i]
+                    del self.ids[i]
+                    break
+                i += 1
+
+    def aplicar(self, evento: dict):
+        """Callback do ``broker.ouvir``: aplica a notificação ou agenda uma recarga."""
+        tipo = evento.get("tipo")
+        if tipo == "conectado":
+            # Notificações podem ter se perdido enquanto o LISTEN estava fora
+            if self.pronto:
+                self.agendar_recarga()
+            return
+        if tipo != "produto":
+            return
+        if self._pendentes is not None:
+            self._pendentes.append(evento)
+            return
+        if not self.pronto:
+            return
+
+        op = evento.get("op")
+        if op in ("INSERT", "UPDATE") and evento.get("itens") is not None:
+            for item in evento["itens"]:
+                self.inserir(item["id"], item["nome"])
+        elif op == "DELETE" and evento.get("removidos") is not None:
+            for pid in evento["removidos"]:
+                self.remover(pid)
+        else:
+            # TRUNCATE ou comando grande demais para caber no payload
+            self.agendar_recarga()
+
+    async def recarregar(self, pool):
+        self._pool = pool
+        self._pendentes = []
+        try:
+            async with pool.acquire() as conn:
+                linhas = await ProdutoRepository(conn).list_names()
+            self.carregar(linhas)
+        finally:
+            pendentes, self._pendentes = self._pendentes, None
+        for evento in pendentes:
+            self.aplicar(evento)
+
+    def agendar_recarga(self):
+        if self._pool is None:
+            return
+        if self._tarefa is not None and not self._tarefa.done():
+            self._recarregar_de_novo = True
+            return
+        self._tarefa = asyncio.get_running_loop().create_task(self._recarregar_em_segundo_plano())
+
+    async def _recarregar_em_segundo_plano(self):
+        while True:
+            self._recarregar_de_novo = False
+            try:
+                await self.recarregar(self._pool)
+            except Exception as err:
+                print(f"⚠️ Recarga do autocomplete falhou: {err!r}")
+            if not self._recarregar_de_novo:
+                return
+
+    # ---------- memória ----------
+    def estatisticas(self) -> dict:
+        tamanho_chaves = sys.getsizeof(self.chaves) + sum(map(sys.getsizeof, self.chaves))
+        tamanho_nomes = sys.getsizeof(self.nomes) + sum(map(sys.getsizeof, self.nomes.values()))
+        return {
+            "produtos": len(self.nomes),
+            "entradas": len(self.chaves),
+            "bytes": tamanho_chaves + sys.getsizeof(self.ids) + tamanho_nomes,
+        }
+
+
+indice = IndiceAutocomplete()
+
+metrics.register(
+    metrics.Gauge(
+        "autocomplete_index",
+        "Índice de autocomplete do worker: produtos, entradas e bytes ocupados",
+        lambda: {(nome,): valor for nome, valor in indice.estatisticas().items()},
+        ("medida",),
+    )
+)
@@ -0,0 +1,293 @@
+"""
+Teste de carga HTTP ponta a ponta contra o ``main:app`` real e um Postgres local.
+
+Cada cenário simula um fluxo do frontend e roda com N clientes concorrentes por
+um tempo fixo. O relatório traz RPS e latências p50/p95/p99 por cenário; os
+resultados podem ser salvos como baseline (JSON versionado em
+``benchmarks/baselines``) e comparados nas execuções seguintes.
+
+Uso (a partir de ``backend/``):
+    python -m benchmarks.loadtest                          # app in-process + DATABASE_URL
+    python -m benchmarks.loadtest --url http://localhost:8000
+    python -m benchmarks.loadtest --cenarios catalogo login --duracao 20
+    python -m benchmarks.loadtest --salvar-baseline
+    python -m benchmarks.loadtest --limite-regressao 0.15  # sai com 1 se regredir
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import time
+from collections.abc import Awaitable, Callable
+from datetime import UTC, datetime
+from pathlib import Path
+
+import httpx
+
+BASELINE_PATH = Path(__file__).parent / "baselines" / "loadtest.json"
+
+BENCH_SENHA = "senha-benchmark"
+BENCH_CLIENTES = 20
+
+
+class Amostras:
+    """Latências e status de um cenário."""
+
+    def __init__(self):
+        self.latencias: list[float] = []
+        self.erros = 0
+        self.rejeitadas = 0  # 503 da admissão
+
+    def registrar(self, segundos: float, status: int):
+        self.latencias.append(segundos)
+        if status == 503:
+            self.rejeitadas += 1
+        elif status >= 400:
+            self.erros += 1
+
+
+def percentil(valores: list[float], p: float) -> float:
+    """Percentil pelo método nearest-rank (valores não precisam estar ordenados)."""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, math.ceil(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+def resumir(amostras: Amostras, duracao: float) -> dict:
+    lat = amostras.latencias
+    return {
+        "requisicoes": len(lat),
+        "rps": round(len(lat) / duracao, 1) if duracao else 0.0,
+        "p50_ms": round(percentil(lat, 50) * 1000, 2),
+        "p95_ms": round(percentil(lat, 95) * 1000, 2),
+        "p99_ms": round(percentil(lat, 99) * 1000, 2),
+        "erros": amostras.erros,
+        "rejeitadas": amostras.rejeitadas,
+    }
+
+
+def comparar_baseline(atual: dict, baseline: dict, limite: float) -> list[str]:
+    """
+    Lista as regressões de ``atual`` em relação a ``baseline``: p95 maior ou RPS
+    menor que o baseline além da fração ``limite``.
+    """
+    regressoes = []
+    for cenario, base in baseline.get("cenarios", {}).items():
+        agora = atual.get("cenarios", {}).get(cenario)
+        if agora is None:
+            continue
+        if base["p95_ms"] and agora["p95_ms"] > base["p95_ms"] * (1 + limite):
+            regressoes.append(f"{cenario}: p95 {base['p95_ms']} ms -> {agora['p95_ms']} ms")
+        if base["rps"] and agora["rps"] < base["rps"] * (1 - limite):
+            regressoes.append(f"{cenario}: RPS {base['rps']} -> {agora['rps']}")
+    return regressoes
+
+
+# ==================================================================
+# CENÁRIOS
+# ==================================================================
+class Contexto:
+    """Dados compartilhados pelos cenários (ids existentes, credenciais)."""
+
+    def __init__(self, produto_ids: list[int], categoria_id: int | None):
+        self.produto_ids = produto_ids
+        self.categoria_id = categoria_id
+        self.seq = 0
+
+    def produto_aleatorio(self) -> int:
+        return random.choice(self.produto_ids)
+
+
+Cenario = Callable[[httpx.AsyncClient, Contexto, Amostras], Awaitable[None]]
+
+
+async def _req(client: httpx.AsyncClient, amostras: Amostras, method: str, url: str, **kw):
+    inicio = time.perf_counter()
+    response = await client.request(method, url, **kw)
+    amostras.registrar(time.perf_counter() - inicio, response.status_code)
+    return response
+
+
+async def cenario_catalogo(client, ctx, amostras):
+    """Navegação: listagem de produtos e categorias (produtos.html / index.html)."""
+    await _req(client, amostras, "GET", "/produtos")
+    await _req(client, amostras, "GET", "/categorias")
+
+
+async def cenario_detalhe(client, ctx, amostras):
+    """Página de detalhe de um produto."""
+    await _req(client, amostras, "GET", f"/produtos/{ctx.produto_aleatorio()}")
+
+
+async def cenario_carrinho(client, ctx, amostras):
+    """carrinho.html busca cada item do carrinho em paralelo."""
+    ids = random.sample(ctx.produto_ids, min(5, len(ctx.produto_ids)))
+    await asyncio.gather(*(_req(client, amostras, "GET", f"/produtos/{pid}") for pid in ids))
+
+
+async def cenario_login(client, ctx, amostras):
+    """Rajada de logins (bcrypt domina o custo)."""
+    email = f"bench-{random.randrange(BENCH_CLIENTES)}@example.com"
+    await _req(client, amostras, "POST", "/login", json={"email": email, "password": BENCH_SENHA})
+
+
+async def cenario_admin(client, ctx, amostras):
+    """Painel admin: cria, edita e remove um produto."""
+    ctx.seq += 1
+    nome = f"bench-{time.time_ns()}-{ctx.seq}"
+    payload = {"nome": nome, "preco": 10.0, "unidade": "un", "categoria_id": ctx.categoria_id}
+    response = await _req(client, amostras, "POST", "/produtos", json=payload)
+    if response.status_code != 200:
+        return
+    pid = response.json()["id"]
+    await _req(client, amostras, "PUT", f"/produtos/{pid}", json={"preco": 12.5, "estoque": 3})
+    await _req(client, amostras, "DELETE", f"/produtos/{pid}")
+
+
+async def cenario_dashboard(client, ctx, amostras):
+    """admin_dashboard.html consultando as estatísticas."""
+    await _req(client, amostras, "GET", "/dashboard/stats")
+
+
+CENARIOS: dict[str, Cenario] = {
+    "catalogo": cenario_catalogo,
+    "detalhe": cenario_detalhe,
+    "carrinho": cenario_carrinho,
+    "login": cenario_login,
+    "admin": cenario_admin,
+    "dashboard": cenario_dashboard,
+}
+
+
+# ==================================================================
+# EXECUÇÃO
+# ==================================================================
+async def preparar(client: httpx.AsyncClient, produtos_minimos: int) -> Contexto:
+    """Garante produtos e clientes suficientes para os cenários."""
+    categorias = (await client.get("/categorias")).json()
+    categoria_id = categorias[0]["id"] if categorias else None
+
+    produtos = (await client.get("/produtos")).json()
+    for i in range(len(produtos), produtos_minimos):
+        await client.post(
+            "/produtos",
+            json={
+                "nome": f"Produto benchmark {i}",
+                "preco": round(random.uniform(5, 500), 2),
+                "unidade": "un",
+                "categoria_id": categoria_id,
+                "estoque": random.randrange(0, 100),
+            },
+        )
+    produtos = (await client.get("/produtos")).json()
+
+    for i in range(BENCH_CLIENTES):
+        # 400 = já cadastrado em uma execução anterior
+        await client.post(
+            "/clientes",
+            json={"nome": f"Bench {i}", "email": f"bench-{i}@example.com", "senha": BENCH_SENHA},
+        )
+    return Contexto([p["id"] for p in produtos], categoria_id)
+
+
+async def rodar_cenario(
+    client: httpx.AsyncClient,
+    ctx: Contexto,
+    cenario: Cenario,
+    concorrencia: int,
+    duracao: float,
+) -> dict:
+    amostras = Amostras()
+    fim = time.perf_counter() + duracao
+
+    async def usuario():
+        while time.perf_counter() < fim:
+            try:
+                await cenario(client, ctx, amostras)
+            except httpx.HTTPError:
+                amostras.erros += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(usuario() for _ in range(concorrencia)))
+    return resumir(amostras, time.perf_counter() - inicio)
+
+
+async def executar(args) -> dict:
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=30)
+        lifespan = None
+    else:
+        from main import app
+
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=30
+        )
+        lifespan = app.router.lifespan_context(app)
+        await lifespan.__aenter__()
+
+    try:
+        async with client:
+            ctx = await preparar(client, args.produtos)
+            resultado = {
+                "gerado_em": datetime.now(UTC).isoformat(timespec="seconds"),
+                "alvo": args.url or "in-process",
+                "maquina": f"{platform.system()} {platform.machine()} / Python {platform.python_version()}",
+                "concorrencia": args.concorrencia,
+                "duracao_s": args.duracao,
+                "cenarios": {},
+            }
+            for nome in args.cenarios:
+                resumo = await rodar_cenario(
+                    client, ctx, CENARIOS[nome], args.concorrencia, args.duracao
+                )
+                resultado["cenarios"][nome] = resumo
+                print(
+                    f"{nome:<10} {resumo['rps']:>8} req/s  p50 {resumo['p50_ms']:>8} ms  "
+                    f"p95 {resumo['p95_ms']:>8} ms  p99 {resumo['p99_ms']:>8} ms  "
+                    f"erros {resumo['erros']}  503 {resumo['rejeitadas']}"
+                )
+            return resultado
+    finally:
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Teste de carga HTTP com baseline.")
+    parser.add_argument("--url", help="servidor já em execução (padrão: main:app in-process)")
+    parser.add_argument("--cenarios", nargs="+", choices=list(CENARIOS), default=list(CENARIOS))
+    parser.add_argument("--concorrencia", type=int, default=16)
+    parser.add_argument("--duracao", type=float, default=10.0, help="segundos por cenário")
+    parser.add_argument("--produtos", type=int, default=200, help="produtos mínimos no catálogo")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--salvar-baseline", action="store_true")
+    parser.add_argument("--limite-regressao", type=float, default=0.20)
+    args = parser.parse_args(argv)
+
+    resultado = asyncio.run(executar(args))
+
+    if args.salvar_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(resultado, indent=2, ensure_ascii=False) + "\n")
+        print(f"Baseline salvo em {args.baseline}")
+        return 0
+
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        regressoes = comparar_baseline(resultado, baseline, args.limite_regressao)
+        if regressoes:
+            print(f"❌ Regressões acima de {args.limite_regressao:.0%}:")
+            for r in regressoes:
+                print(f"   {r}")
+            return 1
+        print(f"✅ Sem regressões acima de {args.limite_regressao:.0%} em relação ao baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
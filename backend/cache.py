@@ -0,0 +1,237 @@
+"""
+Cache em dois níveis: L1 em memória no worker e L2 compartilhado no Redis.
+
+Com 4 workers do gunicorn, cada um teria a sua cópia do catálogo e faria as
+suas próprias consultas para aquecê-la. O L2 no Redis é preenchido por quem
+consultar primeiro e servido a todos; o L1 evita a ida ao Redis nas chaves
+mais quentes por alguns segundos.
+
+Proteção contra estouro de manada (stampede):
+- dentro do worker, falhas simultâneas na mesma chave passam por um
+  ``SingleFlight`` (uma consulta só);
+- entre workers, expiração antecipada probabilística (XFetch): cada leitura
+  no L2 pode decidir recalcular um pouco antes do vencimento, com chance que
+  cresce perto do fim do TTL e com o custo do recálculo. Assim, normalmente
+  um único worker recalcula enquanto os outros seguem servindo o valor antigo.
+
+Invalidação em massa por namespace versionado: as chaves ficam em
+``<namespace>:v<N>:<chave>`` e ``invalidar()`` só incrementa ``N`` (um INCR).
+As chaves antigas expiram sozinhas pelo TTL.
+
+Os valores passam por ``jsonable_encoder`` e são gravados como JSON; o que sai
+do cache é sempre a forma JSON (ex.: ``Decimal`` vira ``float``).
+
+Se o Redis cair, o L2 fica desligado por ``PAUSA_FALHA`` segundos e o cache
+continua funcionando só com o L1. Nos testes usa-se ``MemoryBackend``
+(``CACHE_BACKEND=memory``).
+"""
+
+import json
+import math
+import os
+import random
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+
+import redis.asyncio as redis
+from fastapi.encoders import jsonable_encoder
+
+import redis_pool
+from metrics import CACHE_REQUESTS
+from singleflight import SingleFlight
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "redis")
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL", "5"))
+# Por quanto tempo o L2 fica desligado depois de uma falha do Redis
+PAUSA_FALHA = 5.0
+
+
+# ==================================================================
+# BACKENDS (L2)
+# ==================================================================
+class MemoryBackend:
+    """Substituto do Redis em memória (testes e desenvolvimento sem Redis)."""
+
+    def __init__(self):
+        self.dados: dict[str, tuple[float | None, bytes]] = {}
+
+    def _vivo(self, chave: str) -> bytes | None:
+        item = self.dados.get(chave)
+        if item is None:
+            return None
+        expira, valor = item
+        if expira is not None and expira <= time.monotonic():
+            del self.dados[chave]
+            return None
+        return valor
+
+    async def get(self, chave: str) -> bytes | None:
+        return self._vivo(chave)
+
+    async def set(self, chave: str, valor: bytes, ttl: float):
+        self.dados[chave] = (time.monotonic() + ttl, valor)
+
+    async def incr(self, chave: str) -> int:
+        atual = int(self._vivo(chave) or 0) + 1
+        self.dados[chave] = (None, str(atual).encode())
+        return atual
+
+    def clear(self):
+        self.dados.clear()
+
+
+class RedisBackend:
+    """L2 no Redis; qualquer erro desliga o L2 por ``PAUSA_FALHA`` segundos."""
+
+    def __init__(self, url: str | None = None):
+        # Por padrão, o pool do processo (o mesmo das sessões); uma URL própria só em testes
+        if url is None:
+            self.redis = redis_pool.cliente()
+        else:
+            self.redis = redis.from_url(url, socket_connect_timeout=0.2, socket_timeout=0.2)
+        self._pausado_ate = 0.0
+
+    def disponivel(self) -> bool:
+        return time.monotonic() >= self._pausado_ate
+
+    def _falhou(self, err: Exception):
+        if self.disponivel():
+            print(f"⚠️ Redis indisponível para o cache ({err}); usando só o L1 por {PAUSA_FALHA}s")
+        self._pausado_ate = time.monotonic() + PAUSA_FALHA
+
+    async def get(self, chave: str) -> bytes | None:
+        if not self.disponivel():
+            return None
+        try:
+            return await self.redis.get(chave)
+        except (redis.RedisError, OSError) as err:
+            self._falhou(err)
+            return None
+
+    async def set(self, chave: str, valor: bytes, ttl: float):
+        if not self.disponivel():
+            return
+        try:
+            await self.redis.set(chave, valor, px=int(ttl * 1000))
+        except (redis.RedisError, OSError) as err:
+            self._falhou(err)
+
+    async def incr(self, chave: str) -> int | None:
+        if not self.disponivel():
+            return None
+        try:
+            return await self.redis.incr(chave)
+        except (redis.RedisError, OSError) as err:
+            self._falhou(err)
+            return None
+
+
+def criar_backend():
+    return MemoryBackend() if CACHE_BACKEND == "memory" else RedisBackend()
+
+
+# ==================================================================
+# CACHE
+# ==================================================================
+def deve_recalcular(expira: float, delta: float, beta: float, agora: float | None = None) -> bool:
+    """
+    XFetch (Vattani et al.): recalcula antes do vencimento com probabilidade
+    que cresce com ``delta`` (custo do recálculo) e com a proximidade de ``expira``.
+    """
+    agora = time.time() if agora is None else agora
+    # 1 - random() está em (0, 1]: evita log(0)
+    return agora - delta * beta * math.log(1.0 - random.random()) >= expira
+
+
+class TwoLevelCache:
+    def __init__(
+        self,
+        namespace: str,
+        backend=None,
+        ttl: float = CACHE_TTL,
+        l1_ttl: float = CACHE_L1_TTL,
+        l1_max: int = 10_000,
+        beta: float = 1.0,
+        versao_ttl: float = 1.0,
+    ):
+        self.namespace = namespace
+        self.backend = backend if backend is not None else criar_backend()
+        self.ttl = ttl
+        self.l1_ttl = l1_ttl
+        self.l1_max = l1_max
+        self.beta = beta
+        # A versão do namespace também fica no L1 por ``versao_ttl`` segundos:
+        # uma invalidação feita em outro worker aparece aqui depois disso
+        self.versao_ttl = versao_ttl
+        self._l1: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._versao: tuple[float, int] | None = None
+        self._voos = SingleFlight()
+
+    def _chave_versao(self) -> str:
+        return f"{self.namespace}:versao"
+
+    async def versao(self) -> int:
+        agora = time.monotonic()
+        if self._versao is not None and self._versao[0] > agora:
+            return self._versao[1]
+        bruto = await self.backend.get(self._chave_versao())
+        if bruto is None and self._versao is not None:
+            # Redis fora: mantém a última versão conhecida
+            versao = self._versao[1]
+        else:
+            versao = int(bruto or 0)
+        self._versao = (agora + self.versao_ttl, versao)
+        return versao
+
+    async def invalidar(self):
+        """Invalida todas as chaves do namespace (em todos os workers)."""
+        nova = await self.backend.incr(self._chave_versao())
+        atual = self._versao[1] if self._versao is not None else 0
+        self._versao = (time.monotonic() + self.versao_ttl, nova if nova is not None else atual + 1)
+        self._l1.clear()
+
+    def clear_local(self):
+        self._l1.clear()
+        self._versao = None
+
+    def _guardar_l1(self, chave: str, valor, expira_l2: float):
+        restante = expira_l2 - time.time()
+        self._l1[chave] = (time.monotonic() + min(self.l1_ttl, max(restante, 0.0)), valor)
+        self._l1.move_to_end(chave)
+        while len(self._l1) > self.l1_max:
+            self._l1.popitem(last=False)
+
+    async def get_or_load(self, chave: str, carregar: Callable[[], Awaitable]):
+        """Valor de ``chave``; ``carregar()`` só roda em falha (ou recálculo antecipado)."""
+        completa = f"{self.namespace}:v{await self.versao()}:{chave}"
+
+        item = self._l1.get(completa)
+        if item is not None and item[0] > time.monotonic():
+            self._l1.move_to_end(completa)
+            CACHE_REQUESTS.inc(self.namespace, "l1")
+            return item[1]
+
+        return await self._voos.do(("cache", completa), lambda: self._l2(completa, carregar))
+
+    async def _l2(self, completa: str, carregar: Callable[[], Awaitable]):
+        bruto = await self.backend.get(completa)
+        if bruto is not None:
+            envelope = json.loads(bruto)
+            if not deve_recalcular(envelope["expira"], envelope["delta"], self.beta):
+                CACHE_REQUESTS.inc(self.namespace, "l2")
+                self._guardar_l1(completa, envelope["valor"], envelope["expira"])
+                return envelope["valor"]
+            CACHE_REQUESTS.inc(self.namespace, "antecipado")
+        else:
+            CACHE_REQUESTS.inc(self.namespace, "falha")
+
+        inicio = time.perf_counter()
+        valor = jsonable_encoder(await carregar())
+        delta = time.perf_counter() - inicio
+        expira = time.time() + self.ttl
+        envelope = {"valor": valor, "delta": delta, "expira": expira}
+        await self.backend.set(completa, json.dumps(envelope).encode(), self.ttl)
+        self._guardar_l1(completa, valor, expira)
+        return valor
@@ -1,22 +1,23 @@
 # main.py
 import json
-import os
 import secrets
 
-import redis.asyncio as redis
-from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request, Response
 from passlib.hash import bcrypt
 from pydantic import BaseModel, constr
 
+import redis_pool
+from timing import TimingRoute
+
 # ---------- Configurações ----------
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 SESSION_COOKIE = "session_id"
 SESSION_TTL = 60 * 60 * 24  # 1 dia
 
-# Cliente Redis assíncrono
-r = redis.from_url(REDIS_URL, decode_responses=True)
+# Cliente Redis assíncrono (pool compartilhado, ver redis_pool.py)
+r = redis_pool.cliente()
 
-app = FastAPI()
+# Rotas montadas no app principal (main.py); o ``app`` no fim do arquivo roda sozinho
+router = APIRouter(route_class=TimingRoute)
 
 
 # ---------- Schemas ----------
@@ -41,19 +42,15 @@ def session_key(session_id: str) -> str:
 
 
 # ---------- Registro (signup) ----------
-@app.post("/register", status_code=201)
+@router.post("/register", status_code=201)
 async def register(payload: RegisterIn):
     """
     Registra um novo usuário.
-    - Verifica se o username já existe.
     - Faz hash da senha com bcrypt.
-    - Armazena o usuário no Redis como JSON.
+    - Armazena o usuário no Redis como JSON, só se o username ainda não existe.
     Em produção, use um banco relacional e validações adicionais.
     """
     key = user_key(payload.username)
-    exists = await r.exists(key)
-    if exists:
-        raise HTTPException(status_code=400, detail="Usuário já existe")
 
     # Hash da senha (não armazene senhas em texto)
     hashed = bcrypt.hash(payload.password)
@@ -64,12 +61,15 @@ async def register(payload: RegisterIn):
         "password": hashed,
         "role": payload.role,
     }
-    await r.set(key, json.dumps(user_data))
+    # SET NX: verifica e grava num comando só; dois cadastros simultâneos do
+    # mesmo username não se sobrescrevem (EXISTS seguido de SET deixava)
+    if not await r.set(key, json.dumps(user_data), nx=True):
+        raise HTTPException(status_code=400, detail="Usuário já existe")
     return {"msg": "usuário criado", "username": payload.username}
 
 
 # ---------- Login (cria sessão) ----------
-@app.post("/login")
+@router.post("/login")
 async def login(payload: LoginIn, response: Response):
     """
     Autentica usuário e cria sessão no Redis.
@@ -89,8 +89,12 @@ async def login(payload: LoginIn, response: Response):
     session_id = secrets.token_urlsafe(32)
     session_data = {"user_id": user["id"], "username": user["username"], "role": user["role"]}
     await r.set(session_key(session_id), json.dumps(session_data), ex=SESSION_TTL)
+    set_session_cookie(response, session_id)
+    return {"msg": "logado"}
+
 
-    # Define cookie HttpOnly; em produção use secure=True e ajuste SameSite
+# Define cookie HttpOnly; em produção use secure=True e ajuste SameSite
+def set_session_cookie(response: Response, session_id: str):
     response.set_cookie(
         SESSION_COOKIE,
         session_id,
@@ -99,17 +103,21 @@ async def login(payload: LoginIn, response: Response):
         samesite="lax",
         # secure=True  # habilitar em produção com HTTPS
     )
-    return {"msg": "logado"}
 
 
 # ---------- Dependência: recupera usuário da sessão ----------
-async def get_current_user(request: Request):
+async def get_current_user(request: Request, response: Response):
+    """
+    Sessão deslizante: GETEX lê a sessão e renova o TTL no mesmo comando, e o
+    cookie é reenviado com o mesmo prazo. Uma ida ao Redis por requisição.
+    """
     session_id: str | None = request.cookies.get(SESSION_COOKIE)
     if not session_id:
         raise HTTPException(status_code=401, detail="Não autenticado")
-    raw = await r.get(session_key(session_id))
+    raw = await r.getex(session_key(session_id), ex=SESSION_TTL)
     if not raw:
         raise HTTPException(status_code=401, detail="Sessão inválida ou expirada")
+    set_session_cookie(response, session_id)
     session = json.loads(raw)
     return session
 
@@ -125,23 +133,33 @@ def require_role(role: str):
 
 
 # ---------- Rotas protegidas ----------
-@app.get("/profile")
+@router.get("/profile")
 async def profile(user=Depends(get_current_user)):
     """Retorna dados básicos do usuário logado."""
     return {"user": user}
 
 
-@app.get("/admin")
+@router.get("/admin")
 async def admin_area(user=Depends(require_role("admin"))):
     """Rota acessível apenas para admins."""
     return {"msg": f"Olá {user['username']}, você é admin"}
 
 
 # ---------- Logout ----------
-@app.post("/logout")
+@router.post("/logout")
 async def logout(request: Request, response: Response):
     session_id = request.cookies.get(SESSION_COOKIE)
     if session_id:
         await r.delete(session_key(session_id))
     response.delete_cookie(SESSION_COOKIE)
     return {"msg": "deslogado"}
+
+
+# App isolado (testes e desenvolvimento)
+app = FastAPI()
+app.include_router(router)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await redis_pool.fechar()
@@ -0,0 +1,239 @@
+"""
+Compressão negociada (brotli/gzip) e cache de respostas pré-comprimidas.
+
+``CompressionMiddleware`` comprime respostas comuns acima de ``MIN_BYTES`` de
+acordo com o ``Accept-Encoding``. Respostas em streaming (export, SSE) passam
+sem alteração.
+
+Para respostas grandes e muito requisitadas (a listagem do catálogo), o
+``PrecompressedCache`` guarda o JSON já serializado e cada codificação
+calculada, com a versão do catálogo na chave: a listagem é serializada e
+comprimida uma vez por alteração do catálogo, não uma vez por requisição. A
+middleware reconhece o ``Content-Encoding`` já definido e não comprime de novo.
+
+O brotli é opcional (``pip install brotli``); sem ele, só gzip é oferecido.
+"""
+
+import asyncio
+import gzip
+import os
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse, Response
+
+from singleflight import SingleFlight
+from timing import medir
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depende do ambiente
+    brotli = None
+
+MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+# Acima disto a compressão roda numa thread para não travar o event loop
+THREAD_BYTES = 256 * 1024
+
+TIPOS_COMPRIMIVEIS = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+
+def codificacoes_suportadas() -> tuple[str, ...]:
+    """Em ordem de preferência do servidor."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def escolher_codificacao(accept_encoding: str) -> str | None:
+    """
+    Escolhe a codificação pelo ``Accept-Encoding`` (respeitando ``q=0`` e
+    ``*``); em empate de qualidade vale a preferência do servidor.
+    """
+    qualidades: dict[str, float] = {}
+    for parte in accept_encoding.lower().split(","):
+        nome, _, params = parte.strip().partition(";")
+        if not nome:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        qualidades[nome.strip()] = q
+
+    melhor, melhor_q = None, 0.0
+    for codificacao in codificacoes_suportadas():
+        q = qualidades.get(codificacao, qualidades.get("*", 0.0))
+        if q > melhor_q:
+            melhor, melhor_q = codificacao, q
+    return melhor
+
+
+def comprimir(corpo: bytes, codificacao: str) -> bytes:
+    if codificacao == "br":
+        return brotli.compress(corpo, quality=BROTLI_QUALITY)
+    # mtime fixo: mesma entrada, mesmos bytes (ETag estável entre workers)
+    return gzip.compress(corpo, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+async def comprimir_async(corpo: bytes, codificacao: str) -> bytes:
+    if len(corpo) < THREAD_BYTES:
+        return comprimir(corpo, codificacao)
+    # zlib e brotli liberam o GIL durante a compressão
+    return await asyncio.to_thread(comprimir, corpo, codificacao)
+
+
+def _comprimivel(content_type: str) -> bool:
+    return content_type.startswith(TIPOS_COMPRIMIVEIS) and "event-stream" not in content_type
+
+
+# ==================================================================
+# MIDDLEWARE
+# ==================================================================
+class CompressionMiddleware:
+    """Middleware ASGI pura; só comprime respostas enviadas em um único corpo."""
+
+    def __init__(self, app, min_bytes: int = MIN_BYTES):
+        self.app = app
+        self.min_bytes = min_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        accept = ""
+        for nome, valor in scope.get("headers", []):
+            if nome == b"accept-encoding":
+                accept = valor.decode("latin-1")
+                break
+        codificacao = escolher_codificacao(accept)
+        if codificacao is None:
+            return await self.app(scope, receive, send)
+
+        inicio_resposta = None
+        repassar = False
+
+        async def send_comprimido(message):
+            nonlocal inicio_resposta, repassar
+            if repassar:
+                return await send(message)
+
+            if message["type"] == "http.response.start":
+                headers = {k.lower(): v for k, v in message.get("headers", [])}
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                if b"content-encoding" in headers or not _comprimivel(content_type):
+                    repassar = True
+                    return await send(message)
+                inicio_resposta = message
+                return
+
+            corpo = message.get("body", b"")
+            if message.get("more_body", False) or len(corpo) < self.min_bytes:
+                # Streaming ou resposta pequena: envia como veio
+                repassar = True
+                await send(inicio_resposta)
+                return await send(message)
+
+            with medir("compressao"):
+                comprimido = await comprimir_async(corpo, codificacao)
+            headers = [
+                (k, v)
+                for k, v in inicio_resposta.get("headers", [])
+                if k.lower() not in (b"content-length", b"vary")
+            ]
+            headers += [
+                (b"content-encoding", codificacao.encode()),
+                (b"content-length", str(len(comprimido)).encode()),
+                (b"vary", b"Accept-Encoding"),
+            ]
+            await send({**inicio_resposta, "headers": headers})
+            await send({**message, "body": comprimido})
+
+        await self.app(scope, receive, send_comprimido)
+
+
+# ==================================================================
+# CACHE DE RESPOSTAS PRÉ-COMPRIMIDAS
+# ==================================================================
+class _Entrada:
+    def __init__(self, versao: Hashable, corpo: bytes):
+        self.versao = versao
+        self.corpo = corpo
+        self.codificados: dict[str, bytes] = {}
+
+
+class PrecompressedCache:
+    """
+    Cache por worker de respostas JSON serializadas e comprimidas.
+
+    Cada ``chave`` (ex.: ``"produtos"``) guarda só a entrada da versão mais
+    recente; uma versão nova substitui a anterior. As codificações são
+    calculadas sob demanda, uma vez por versão.
+    """
+
+    def __init__(self, max_entradas: int = 32, min_bytes: int = MIN_BYTES):
+        self.max_entradas = max_entradas
+        self.min_bytes = min_bytes
+        self._entradas: OrderedDict[Hashable, _Entrada] = OrderedDict()
+        self._voos = SingleFlight()
+        self.acertos = 0
+        self.falhas = 0
+
+    async def _entrada(self, chave, versao, carregar: Callable[[], Awaitable]) -> _Entrada:
+        entrada = self._entradas.get(chave)
+        if entrada is not None and entrada.versao == versao:
+            self.acertos += 1
+            self._entradas.move_to_end(chave)
+            return entrada
+
+        self.falhas += 1
+        # Requisições simultâneas na mesma versão esperam uma única serialização
+        return await self._voos.do(
+            ("resposta_cache", chave, versao), lambda: self._montar(chave, versao, carregar)
+        )
+
+    async def _montar(self, chave, versao, carregar: Callable[[], Awaitable]) -> _Entrada:
+        dados = await carregar()
+        with medir("serializacao-cache"):
+            corpo = JSONResponse(jsonable_encoder(dados)).body
+        entrada = _Entrada(versao, corpo)
+        self._entradas[chave] = entrada
+        self._entradas.move_to_end(chave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+        return entrada
+
+    async def resposta(
+        self,
+        chave: Hashable,
+        versao: Hashable,
+        accept_encoding: str,
+        carregar: Callable[[], Awaitable],
+        if_none_match: str | None = None,
+    ) -> Response:
+        """
+        Monta a resposta de ``chave`` na ``versao`` informada; ``carregar`` só é
+        chamado quando a versão em cache é outra. Responde 304 se o ETag bater.
+        """
+        # Fraco: o mesmo ETag vale para todas as codificações da mesma versão
+        etag = f'W/"{chave}-{versao}"'
+        headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+        if if_none_match is not None and etag in if_none_match:
+            return Response(status_code=304, headers=headers)
+
+        entrada = await self._entrada(chave, versao, carregar)
+        codificacao = escolher_codificacao(accept_encoding)
+        if codificacao is None or len(entrada.corpo) < self.min_bytes:
+            return Response(entrada.corpo, media_type="application/json", headers=headers)
+
+        corpo = entrada.codificados.get(codificacao)
+        if corpo is None:
+            with medir("compressao"):
+                corpo = await comprimir_async(entrada.corpo, codificacao)
+            # Se a versão mudou enquanto comprimia, a entrada já foi trocada: não faz mal
+            entrada.codificados[codificacao] = corpo
+        headers["Content-Encoding"] = codificacao
+        return Response(corpo, media_type="application/json", headers=headers)
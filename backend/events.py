@@ -0,0 +1,157 @@
+"""
+Eventos em tempo real (estoque, preço e dashboard) via Server-Sent Events.
+
+Os triggers da migração 4 fazem ``NOTIFY eventos`` a cada comando que altera
+produto ou cliente, já com o delta dos números do dashboard. Cada worker
+mantém UMA conexão dedicada com ``LISTEN eventos`` (fora do pool) e repassa
+cada notificação para as filas de todos os assinantes. O evento é formatado
+uma vez só; cada aba aberta custa uma fila e um ``put_nowait``. Desde a
+migração 12 o mesmo trigger manda também ``estoque_alerta``, com os produtos
+que acabaram de ficar abaixo do estoque mínimo.
+
+Assinante lento: se a fila dele enche, ela é esvaziada e recebe um evento
+``recarregar``; o cliente busca o estado completo de novo em vez de receber
+uma sequência de deltas incompleta. O mesmo evento é enviado a todos depois
+de uma reconexão com o banco (notificações perdidas enquanto estava fora).
+
+Estruturas em memória do worker (ex.: o índice de autocomplete) usam
+``ouvir(callback)``: recebem o payload já decodificado e, a cada conexão do
+LISTEN, ``{"tipo": "conectado"}`` (o que veio antes dela pode ter se perdido).
+"""
+
+import asyncio
+import json
+from collections.abc import Callable
+
+import asyncpg
+
+from database import DATABASE_URL, backoff_delay
+
+CANAL = "eventos"
+FILA_MAX = 256
+# Comentário SSE periódico: mantém proxies abertos e detecta cliente desconectado
+KEEPALIVE_S = 15.0
+
+
+def formatar_sse(evento: str, dados) -> bytes:
+    return f"event: {evento}\ndata: {json.dumps(dados, separators=(',', ':'))}\n\n".encode()
+
+
+RECARREGAR = formatar_sse("recarregar", {})
+
+
+class EventBroker:
+    def __init__(self, database_url: str = DATABASE_URL):
+        self.database_url = database_url
+        self.assinantes: set[asyncio.Queue] = set()
+        self.ouvintes: list[Callable[[dict], None]] = []
+        self.conn: asyncpg.Connection | None = None
+        self._tarefa: asyncio.Task | None = None
+        self._conectado = asyncio.Event()
+        self._parar = False
+
+    # ---------- assinantes ----------
+    def assinar(self) -> asyncio.Queue:
+        fila: asyncio.Queue = asyncio.Queue(maxsize=FILA_MAX)
+        self.assinantes.add(fila)
+        self.iniciar()
+        return fila
+
+    def cancelar(self, fila: asyncio.Queue):
+        self.assinantes.discard(fila)
+
+    def ouvir(self, callback: Callable[[dict], None]):
+        """Registra um callback síncrono chamado com cada notificação decodificada."""
+        self.ouvintes.append(callback)
+
+    def _avisar_ouvintes(self, dados: dict):
+        for callback in self.ouvintes:
+            try:
+                callback(dados)
+            except Exception as err:  # um ouvinte com defeito não derruba o LISTEN
+                print(f"⚠️ Ouvinte de {CANAL} falhou: {err!r}")
+
+    def publicar(self, mensagem: bytes | None):
+        """Entrega para todos; ``None`` encerra os streams (shutdown)."""
+        for fila in self.assinantes:
+            try:
+                fila.put_nowait(mensagem)
+            except asyncio.QueueFull:
+                _esvaziar(fila)
+                fila.put_nowait(RECARREGAR if mensagem is not None else None)
+
+    # ---------- conexão LISTEN ----------
+    def _notificacao(self, conn, pid, canal, payload: str):
+        try:
+            dados = json.loads(payload)
+        except ValueError:
+            return
+        self._avisar_ouvintes(dados)
+        self.publicar(formatar_sse(dados.get("tipo", "mensagem"), dados))
+
+    def iniciar(self):
+        """Sobe a conexão LISTEN na primeira assinatura (idempotente)."""
+        if self._tarefa is None or self._tarefa.done():
+            self._parar = False
+            self._tarefa = asyncio.get_running_loop().create_task(self._manter_conexao())
+
+    async def _manter_conexao(self):
+        tentativa = 0
+        primeira = True
+        while not self._parar:
+            try:
+                self.conn = await asyncpg.connect(self.database_url)
+                perdida = asyncio.Event()
+                self.conn.add_termination_listener(lambda _conn, evento=perdida: evento.set())
+                await self.conn.add_listener(CANAL, self._notificacao)
+                self._conectado.set()
+                self._avisar_ouvintes({"tipo": "conectado"})
+                if not primeira:
+                    print("🔔 LISTEN reconectado; assinantes vão recarregar o estado")
+                    self.publicar(RECARREGAR)
+                primeira = False
+                tentativa = 0
+                while not perdida.is_set():
+                    try:
+                        await asyncio.wait_for(perdida.wait(), KEEPALIVE_S * 2)
+                    except TimeoutError:
+                        # Conexão ociosa: um SELECT 1 revela se ela morreu sem avisar
+                        await self.conn.execute("SELECT 1")
+                await self.conn.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                # Conexão morta (InterfaceError), timeout no connect...: tudo vira reconexão,
+                # senão os ouvintes (autocomplete, snapshot) param de receber notificações
+                if self.conn is not None and not self.conn.is_closed():
+                    self.conn.terminate()
+                tentativa += 1
+                espera = backoff_delay(min(tentativa, 6))
+                print(f"⚠️ LISTEN {CANAL} indisponível ({err!r}); nova tentativa em {espera:.1f}s")
+                await asyncio.sleep(espera)
+            finally:
+                self._conectado.clear()
+
+    async def parar(self):
+        self._parar = True
+        self.publicar(None)
+        if self.conn is not None and not self.conn.is_closed():
+            await self.conn.close()
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+            self._tarefa = None
+
+    async def aguardar_conexao(self, timeout: float = 5.0):
+        await asyncio.wait_for(self._conectado.wait(), timeout)
+
+
+def _esvaziar(fila: asyncio.Queue):
+    while not fila.empty():
+        fila.get_nowait()
+
+
+broker = EventBroker()
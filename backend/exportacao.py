@@ -0,0 +1,88 @@
+"""
+Export do catálogo completo em CSV ou NDJSON, em streaming.
+
+A listagem (``GET /produtos``) monta todas as linhas numa lista Python; para
+um dump de parceiro isso é memória proporcional ao catálogo. Aqui a mesma
+consulta roda num cursor do lado do servidor (``DECLARE ... CURSOR`` via
+asyncpg), buscando ``CURSOR_PREFETCH`` linhas por vez, e cada bloco vira bytes
+que vão direto para a resposta.
+
+- Memória constante: no máximo um bloco de linhas e um buffer de
+  ``TAMANHO_CHUNK`` bytes por export.
+- Backpressure: o gerador só é consumido quando o servidor consegue escrever
+  no socket; um cliente lento segura o cursor em vez de acumular dados aqui.
+- Consistência: o cursor roda numa transação ``REPEATABLE READ`` somente
+  leitura, então o arquivo inteiro vem de um único snapshot.
+- Cliente que desconecta cancela o gerador; a transação é desfeita e a
+  conexão volta ao pool.
+"""
+
+import csv
+import io
+import json
+from collections.abc import AsyncIterator
+
+from repositories import SQL_LISTAGEM, filtro_sql
+from schemas import ProdutoFiltro
+
+CURSOR_PREFETCH = 1000
+TAMANHO_CHUNK = 64 * 1024
+
+COLUNAS = ("id", "nome", "preco", "unidade", "estoque", "categoria_id", "categoria_nome")
+
+FORMATOS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+
+class _FormatoCSV:
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator="\n")
+
+    def cabecalho(self) -> str:
+        self.writer.writerow(COLUNAS)
+        return self._esvaziar()
+
+    def linha(self, row) -> str:
+        self.writer.writerow(row[c] for c in COLUNAS)
+        return self._esvaziar()
+
+    def _esvaziar(self) -> str:
+        texto = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return texto
+
+
+class _FormatoNDJSON:
+    def cabecalho(self) -> str:
+        return ""
+
+    def linha(self, row) -> str:
+        # preco já vem como texto da consulta (mesma forma da listagem)
+        return json.dumps(dict(row), ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+async def stream_produtos(
+    pool, formato: str, filtro: ProdutoFiltro | None = None
+) -> AsyncIterator[bytes]:
+    """Gera o export em blocos de ~``TAMANHO_CHUNK`` bytes."""
+    formatador = _FormatoCSV() if formato == "csv" else _FormatoNDJSON()
+    where, args = filtro_sql(filtro)
+    sql = SQL_LISTAGEM.format(where=where)
+
+    async with pool.acquire() as conn:
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            partes = [formatador.cabecalho()]
+            tamanho = len(partes[0])
+            async for row in conn.cursor(sql, *args, prefetch=CURSOR_PREFETCH):
+                texto = formatador.linha(row)
+                partes.append(texto)
+                tamanho += len(texto)
+                if tamanho >= TAMANHO_CHUNK:
+                    yield "".join(partes).encode()
+                    partes, tamanho = [], 0
+            if tamanho:
+                yield "".join(partes).encode()
@@ -0,0 +1,472 @@
+"""
+Jobs em segundo plano para operações longas do catálogo.
+
+Importações, reindexação, reprecificação e exports não cabem no tempo de uma
+requisição (timeout do gunicorn). A rota só enfileira um registro na tabela
+``job`` e responde com o id; cada worker roda um ``JobRunner`` que busca
+trabalho com ``SELECT ... FOR UPDATE SKIP LOCKED``: vários workers (e várias
+máquinas) disputam a mesma fila sem pegar o mesmo job e sem nada além do Postgres.
+
+- Concorrência limitada por worker (``JOBS_CONCURRENCY``), num pool próprio
+  (``db.jobs_pool``): os jobs não tomam as conexões que a admissão reparte
+  entre as requisições.
+- Progresso: o handler chama ``ctx.progresso(fração, mensagem)``, que também
+  é o ponto de cancelamento. O heartbeat roda à parte, a cada
+  ``JOBS_HEARTBEAT_S``, e mantém vivo um passo longo (REINDEX, um lote grande).
+- Falhas são retentadas com backoff até ``max_tentativas``; jobs de um worker
+  que morreu (heartbeat parado) voltam para a fila. Todas as escritas de uma
+  execução conferem o ``trabalhador``: se o job foi devolvido e pego por outro,
+  a execução antiga para no próximo ``ctx.progresso`` e não grava o resultado.
+- Cancelamento: um job pendente é cancelado na hora; um em execução para no
+  próximo ``ctx.progresso``.
+
+Handlers são registrados com ``@job_handler("tipo")`` e recebem
+``(ctx, params)``; o dicionário retornado vira o ``resultado`` do job.
+"""
+
+import asyncio
+import json
+import os
+import socket
+from collections.abc import Awaitable, Callable
+from datetime import date
+
+import asyncpg
+
+from repositories import (
+    RELACIONADOS_K,
+    RELACIONADOS_LOCK_ID,
+    RETENCAO_VENDAS_HORA_DIAS,
+    RelacionadosRepository,
+    VendasRepository,
+)
+
+JOBS_CONCURRENCY = int(os.getenv("JOBS_CONCURRENCY", "2"))
+JOBS_POLL_S = float(os.getenv("JOBS_POLL_S", "1.0"))
+# Sem heartbeat por este tempo, o job é considerado órfão e volta para a fila
+JOBS_HEARTBEAT_TIMEOUT_S = 60
+JOBS_HEARTBEAT_S = JOBS_HEARTBEAT_TIMEOUT_S / 4
+RETRY_BASE_S = 2.0
+# Fila indisponível: a espera entre as tentativas dobra até este teto
+JOBS_BACKOFF_MAX_S = 30.0
+
+Handler = Callable[["JobContext", dict], Awaitable[dict | None]]
+HANDLERS: dict[str, Handler] = {}
+
+
+def job_handler(tipo: str):
+    """Registra a corrotina que executa os jobs do ``tipo`` informado."""
+
+    def decorador(fn: Handler) -> Handler:
+        HANDLERS[tipo] = fn
+        return fn
+
+    return decorador
+
+
+class JobCancelado(Exception):
+    pass
+
+
+class JobPerdido(Exception):
+    """O job voltou para a fila (heartbeat atrasado) e outro trabalhador o pegou."""
+
+
+# ==================================================================
+# FILA (SQL)
+# ==================================================================
+SQL_CLAIM = """
+    UPDATE job
+    SET status = 'executando', tentativas = tentativas + 1, trabalhador = $1,
+        iniciado_em = now(), heartbeat_em = now(), atualizado_em = now()
+    WHERE id = (
+        SELECT id FROM job
+        WHERE status = 'pendente' AND executar_apos <= now()
+        ORDER BY executar_apos, id
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING id, tipo, params, tentativas, max_tentativas
+"""
+
+COLUNAS_PUBLICAS = """
+    id, tipo, params, status, progresso, mensagem, resultado, erro, tentativas,
+    max_tentativas, cancelar, criado_em, iniciado_em, concluido_em
+"""
+
+
+def _linha_para_dict(row) -> dict:
+    job = dict(row)
+    for campo in ("params", "resultado"):
+        if isinstance(job.get(campo), str):
+            job[campo] = json.loads(job[campo])
+    return job
+
+
+async def enfileirar(
+    conn: asyncpg.Connection, tipo: str, params: dict | None = None, max_tentativas: int = 3
+) -> int:
+    if tipo not in HANDLERS:
+        raise ValueError(f"Tipo de job desconhecido: {tipo}")
+    job_id = await conn.fetchval(
+        "INSERT INTO job (tipo, params, max_tentativas) VALUES ($1, $2::jsonb, $3) RETURNING id",
+        tipo,
+        json.dumps(params or {}),
+        max_tentativas,
+    )
+    runner.acordar()
+    return job_id
+
+
+async def obter(conn: asyncpg.Connection, job_id: int) -> dict | None:
+    row = await conn.fetchrow(f"SELECT {COLUNAS_PUBLICAS} FROM job WHERE id = $1", job_id)
+    return _linha_para_dict(row) if row else None
+
+
+async def cancelar(conn: asyncpg.Connection, job_id: int) -> dict | None:
+    """Pendente: cancela na hora. Em execução: pede o cancelamento ao handler."""
+    row = await conn.fetchrow(
+        f"""
+        UPDATE job
+        SET status = CASE WHEN status = 'pendente' THEN 'cancelado' ELSE status END,
+            concluido_em = CASE WHEN status = 'pendente' THEN now() ELSE concluido_em END,
+            cancelar = (status = 'executando'),
+            atualizado_em = now()
+        WHERE id = $1 AND status IN ('pendente', 'executando')
+        RETURNING {COLUNAS_PUBLICAS}
+        """,
+        job_id,
+    )
+    return _linha_para_dict(row) if row else None
+
+
+async def retentar(conn: asyncpg.Connection, job_id: int) -> dict | None:
+    """Volta um job que falhou ou foi cancelado para a fila, com as tentativas zeradas."""
+    row = await conn.fetchrow(
+        f"""
+        UPDATE job
+        SET status = 'pendente', tentativas = 0, cancelar = false, erro = NULL,
+            progresso = 0, executar_apos = now(), concluido_em = NULL, atualizado_em = now()
+        WHERE id = $1 AND status IN ('falhou', 'cancelado')
+        RETURNING {COLUNAS_PUBLICAS}
+        """,
+        job_id,
+    )
+    if row:
+        runner.acordar()
+    return _linha_para_dict(row) if row else None
+
+
+# ==================================================================
+# EXECUÇÃO
+# ==================================================================
+class JobContext:
+    def __init__(self, pool, job_id: int, params: dict, trabalhador: str):
+        self.pool = pool
+        self.id = job_id
+        self.params = params
+        self.trabalhador = trabalhador
+        # progresso e heartbeat nunca seguram duas conexões do pool ao mesmo tempo
+        self._lock = asyncio.Lock()
+
+    async def progresso(self, fracao: float, mensagem: str | None = None):
+        """Atualiza progresso/heartbeat; levanta ``JobCancelado`` se pediram o cancelamento."""
+        async with self._lock, self.pool.acquire() as conn:
+            cancelar = await conn.fetchval(
+                """
+                UPDATE job
+                SET progresso = $2, mensagem = COALESCE($3, mensagem),
+                    heartbeat_em = now(), atualizado_em = now()
+                WHERE id = $1 AND trabalhador = $4
+                RETURNING cancelar
+                """,
+                self.id,
+                min(max(fracao, 0.0), 1.0),
+                mensagem,
+                self.trabalhador,
+            )
+        if cancelar is None:
+            raise JobPerdido()
+        if cancelar:
+            raise JobCancelado()
+
+    async def heartbeat(self):
+        async with self._lock, self.pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE job SET heartbeat_em = now() "
+                "WHERE id = $1 AND trabalhador = $2 AND status = 'executando'",
+                self.id,
+                self.trabalhador,
+            )
+
+
+class JobRunner:
+    def __init__(self, concorrencia: int = JOBS_CONCURRENCY, intervalo: float = JOBS_POLL_S):
+        self.concorrencia = concorrencia
+        self.intervalo = intervalo
+        self.pool = None
+        self.trabalhador = f"{socket.gethostname()}:{os.getpid()}"
+        self._vagas: asyncio.Semaphore | None = None
+        self._acordar = asyncio.Event()
+        self._loop_task: asyncio.Task | None = None
+        self._em_execucao: set[asyncio.Task] = set()
+
+    def acordar(self):
+        self._acordar.set()
+
+    async def iniciar(self, pool):
+        self.pool = pool
+        self._vagas = asyncio.Semaphore(self.concorrencia)
+        self._loop_task = asyncio.create_task(self._loop())
+
+    async def parar(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        # Jobs interrompidos voltam para a fila (ver _executar)
+        for task in list(self._em_execucao):
+            task.cancel()
+        await asyncio.gather(*self._em_execucao, return_exceptions=True)
+
+    async def _loop(self):
+        falhas = 0
+        while True:
+            try:
+                await self._recuperar_orfaos()
+                while True:
+                    await self._vagas.acquire()
+                    try:
+                        job = await self._pegar_job()
+                    except BaseException:
+                        self._vagas.release()
+                        raise
+                    if job is None:
+                        self._vagas.release()
+                        break
+                    task = asyncio.create_task(self._executar(job))
+                    self._em_execucao.add(task)
+                    task.add_done_callback(self._finalizada)
+                falhas = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                # Qualquer erro (InterfaceError, timeout do acquire...) só adia a próxima
+                # volta: o laço nunca morre em silêncio
+                falhas += 1
+                print(f"⚠️ Fila de jobs indisponível ({falhas}ª falha): {err!r}")
+            self._acordar.clear()
+            if falhas:
+                await asyncio.sleep(min(self.intervalo * 2**falhas, JOBS_BACKOFF_MAX_S))
+                continue
+            try:
+                await asyncio.wait_for(self._acordar.wait(), self.intervalo)
+            except TimeoutError:
+                pass
+
+    def _finalizada(self, task: asyncio.Task):
+        self._em_execucao.discard(task)
+        self._vagas.release()
+
+    async def _pegar_job(self) -> dict | None:
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(SQL_CLAIM, self.trabalhador)
+        return _linha_para_dict(row) if row else None
+
+    async def _recuperar_orfaos(self):
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                f"""
+                UPDATE job SET status = 'pendente', trabalhador = NULL, atualizado_em = now()
+                WHERE status = 'executando'
+                  AND heartbeat_em < now() - interval '{JOBS_HEARTBEAT_TIMEOUT_S} seconds'
+                """
+            )
+
+    async def _finalizar(self, job_id: int, sql: str, *args):
+        # shield: mesmo cancelado (shutdown), o estado final chega ao banco.
+        # $2 é o trabalhador: uma execução que perdeu o job não sobrescreve a do dono.
+        async def gravar():
+            async with self.pool.acquire() as conn:
+                await conn.execute(sql, job_id, self.trabalhador, *args)
+
+        await asyncio.shield(gravar())
+
+    async def _manter_vivo(self, ctx: JobContext):
+        while True:
+            await asyncio.sleep(JOBS_HEARTBEAT_S)
+            try:
+                await ctx.heartbeat()
+            except Exception as err:
+                print(f"⚠️ Heartbeat do job {ctx.id} falhou: {err!r}")
+
+    async def _executar(self, job: dict):
+        job_id = job["id"]
+        handler = HANDLERS.get(job["tipo"])
+        ctx = JobContext(self.pool, job_id, job["params"], self.trabalhador)
+        batimento = asyncio.create_task(self._manter_vivo(ctx))
+        try:
+            if handler is None:
+                raise LookupError(f"Sem handler para o tipo {job['tipo']}")
+            resultado = await handler(ctx, job["params"])
+        except JobPerdido:
+            print(f"⚠️ Job {job_id} ({job['tipo']}) foi retomado por outro trabalhador")
+        except JobCancelado:
+            await self._finalizar(
+                job_id,
+                "UPDATE job SET status = 'cancelado', concluido_em = now(), atualizado_em = now() "
+                "WHERE id = $1 AND trabalhador = $2",
+            )
+            print(f"🛑 Job {job_id} ({job['tipo']}) cancelado")
+        except asyncio.CancelledError:
+            # Worker desligando: devolve o job sem gastar uma tentativa
+            await self._finalizar(
+                job_id,
+                "UPDATE job SET status = 'pendente', tentativas = tentativas - 1, "
+                "trabalhador = NULL, atualizado_em = now() WHERE id = $1 AND trabalhador = $2",
+            )
+            raise
+        except Exception as err:
+            erro = f"{type(err).__name__}: {err}"
+            if job["tentativas"] < job["max_tentativas"]:
+                atraso = RETRY_BASE_S * 2 ** (job["tentativas"] - 1)
+                await self._finalizar(
+                    job_id,
+                    "UPDATE job SET status = 'pendente', erro = $3, trabalhador = NULL, "
+                    "executar_apos = now() + make_interval(secs => $4), atualizado_em = now() "
+                    "WHERE id = $1 AND trabalhador = $2",
+                    erro,
+                    atraso,
+                )
+                print(f"⚠️ Job {job_id} falhou ({erro}); nova tentativa em {atraso:.0f}s")
+            else:
+                await self._finalizar(
+                    job_id,
+                    "UPDATE job SET status = 'falhou', erro = $3, concluido_em = now(), "
+                    "atualizado_em = now() WHERE id = $1 AND trabalhador = $2",
+                    erro,
+                )
+                print(f"❌ Job {job_id} falhou definitivamente: {erro}")
+        else:
+            await self._finalizar(
+                job_id,
+                "UPDATE job SET status = 'concluido', progresso = 1, resultado = $3::jsonb, "
+                "erro = NULL, concluido_em = now(), atualizado_em = now() "
+                "WHERE id = $1 AND trabalhador = $2",
+                json.dumps(resultado, default=str) if resultado is not None else None,
+            )
+        finally:
+            batimento.cancel()
+
+
+# Instância global (uma por worker)
+runner = JobRunner()
+
+
+# ==================================================================
+# HANDLERS
+# ==================================================================
+TABELAS_CATALOGO = ("categoria", "produto", "cliente")
+
+
+@job_handler("manutencao_catalogo")
+async def manutencao_catalogo(ctx: JobContext, params: dict) -> dict:
+    """ANALYZE (e, com ``reindex``, REINDEX CONCURRENTLY) das tabelas do catálogo."""
+    reindex = bool(params.get("reindex"))
+    for i, tabela in enumerate(TABELAS_CATALOGO):
+        await ctx.progresso(i / len(TABELAS_CATALOGO), f"{tabela}")
+        async with ctx.pool.acquire() as conn:
+            if reindex:
+                await conn.execute(f"REINDEX TABLE CONCURRENTLY {tabela}")
+            await conn.execute(f"ANALYZE {tabela}")
+    return {"tabelas": list(TABELAS_CATALOGO), "reindex": reindex}
+
+
+@job_handler("compactar_vendas")
+async def compactar_vendas(ctx: JobContext, params: dict) -> dict:
+    """
+    Junta as fatias dos rollups de vendas e apaga as linhas por hora antigas.
+    Com ``de``/``ate`` (datas ISO), confere esses dias contra os pedidos e
+    reconstrói os que divergirem. Feito para rodar de hora em hora (cron).
+    """
+    async with ctx.pool.acquire() as conn:
+        retencao = int(params.get("retencao_dias", RETENCAO_VENDAS_HORA_DIAS))
+        resultado = await VendasRepository(conn).compactar(retencao)
+    if "de" not in params:
+        return resultado
+
+    await ctx.progresso(0.5, "conferindo")
+    de = date.fromisoformat(params["de"])
+    ate = date.fromisoformat(params.get("ate", params["de"]))
+    async with ctx.pool.acquire() as conn:
+        repo = VendasRepository(conn)
+        divergentes = await repo.conferir(de, ate)
+        for dia in divergentes:
+            await repo.reconstruir(dia, dia)
+    resultado["reconstruidos"] = [dia.isoformat() for dia in divergentes]
+    return resultado
+
+
+# Pedidos por transação ao somar compras em comum; produtos por recálculo
+RELACIONADOS_LOTE_PEDIDOS = 20_000
+RELACIONADOS_LOTE_PRODUTOS = 2_000
+
+
+@job_handler("relacionados")
+async def relacionados(ctx: JobContext, params: dict) -> dict:
+    """
+    Atualiza os produtos relacionados com os pedidos novos desde a última
+    execução e recalcula só os produtos que apareceram neles. ``completo``
+    zera as contagens e recalcula o catálogo inteiro (corrige deriva, produtos
+    apagados, mudança de categoria). Feito para rodar de hora em hora (cron).
+    """
+    async with ctx.pool.acquire() as conn:
+        # Duas execuções ao mesmo tempo somariam os mesmos pedidos duas vezes
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", RELACIONADOS_LOCK_ID):
+            return {"ignorado": "outra execução em andamento"}
+        try:
+            return await _atualizar_relacionados(
+                ctx, RelacionadosRepository(conn), bool(params.get("completo"))
+            )
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", RELACIONADOS_LOCK_ID)
+
+
+async def _atualizar_relacionados(
+    ctx: JobContext, repo: RelacionadosRepository, completo: bool
+) -> dict:
+    inicio = await repo.conn.fetchval("SELECT now()")
+    if completo:
+        await repo.zerar()
+
+    ultimo, marca = await repo.marcas()
+    afetados: set[int] = set()
+    for de in range(ultimo, marca, RELACIONADOS_LOTE_PEDIDOS):
+        ate = min(de + RELACIONADOS_LOTE_PEDIDOS, marca)
+        afetados.update(await repo.contar_pedidos(de, ate))
+        await ctx.progresso(0.5 * (ate - ultimo) / (marca - ultimo), f"pedidos até {ate}")
+    await repo.atualizar_populares(RELACIONADOS_K)
+
+    recalculados = 0
+    if completo:
+        apos, total = 0, await repo.total_produtos()
+        while ids := await repo.ids_produtos(apos, RELACIONADOS_LOTE_PRODUTOS):
+            await repo.recalcular(ids, RELACIONADOS_K)
+            recalculados += len(ids)
+            apos = ids[-1]
+            await ctx.progresso(0.5 + 0.5 * recalculados / max(total, 1), f"produto {apos}")
+        removidos = await repo.remover_desatualizados(inicio)
+    else:
+        ordenados = sorted(afetados)
+        for i in range(0, len(ordenados), RELACIONADOS_LOTE_PRODUTOS):
+            lote = ordenados[i : i + RELACIONADOS_LOTE_PRODUTOS]
+            await repo.recalcular(lote, RELACIONADOS_K)
+            recalculados += len(lote)
+            await ctx.progresso(0.5 + 0.5 * recalculados / len(ordenados), "recalculando")
+        removidos = 0
+
+    return {
+        "ultimo_pedido": marca,
+        "produtos_recalculados": recalculados,
+        "removidos": removidos,
+    }
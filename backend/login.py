@@ -1,21 +1,24 @@
 # main.py
 import json
-import os
 import secrets
 
-import redis.asyncio as redis
-from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel
 
+import redis_pool
+from timing import TimingRoute
+
 # Config
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-SESSION_COOKIE = "session_id"
+# Nome próprio: no app principal o cadastro (/contas) usa "session_id" na mesma origem
+SESSION_COOKIE = "login_session_id"
 SESSION_TTL = 60 * 60 * 24  # 1 dia
 
-# Redis client (async)
-r = redis.from_url(REDIS_URL, decode_responses=True)
+# Redis client (async), no pool compartilhado com o cadastro
+r = redis_pool.cliente()
+
+# Rotas montadas no app principal (main.py); o ``app`` no fim do arquivo roda sozinho
+router = APIRouter(route_class=TimingRoute)
 
-app = FastAPI()
 
 # Simulação de "usuários" para exemplo (em produção use DB)
 USERS = {
@@ -29,8 +32,14 @@ class LoginIn(BaseModel):
     password: str
 
 
+# O cookie vem do cliente: a chave fica num prefixo só das sessões daqui, para que
+# um cookie forjado não leia nem renove/apague outras chaves do Redis compartilhado
+def session_key(session_id: str) -> str:
+    return f"login_session:{session_id}"
+
+
 # Cria sessão no Redis e seta cookie HttpOnly
-@app.post("/login")
+@router.post("/login")
 async def login(payload: LoginIn, response: Response):
     user = USERS.get(payload.username)
     if not user or user["password"] != payload.password:
@@ -39,23 +48,29 @@ async def login(payload: LoginIn, response: Response):
     session_data = {"user_id": user["id"], "username": payload.username, "role": user["role"]}
 
     # Armazena sessão como JSON com TTL
-    await r.set(session_id, json.dumps(session_data), ex=SESSION_TTL)
+    await r.set(session_key(session_id), json.dumps(session_data), ex=SESSION_TTL)
+
+    set_session_cookie(response, session_id)
+    return {"msg": "logado"}
 
-    # Cookie seguro; em produção use secure=True and samesite as needed
+
+# Cookie seguro; em produção use secure=True and samesite as needed
+def set_session_cookie(response: Response, session_id: str):
     response.set_cookie(
         SESSION_COOKIE, session_id, httponly=True, max_age=SESSION_TTL, samesite="lax"
     )
-    return {"msg": "logado"}
 
 
 # Dependência que recupera sessão do Redis
-async def get_current_user(request: Request):
+async def get_current_user(request: Request, response: Response):
     session_id: str | None = request.cookies.get(SESSION_COOKIE)
     if not session_id:
         raise HTTPException(status_code=401, detail="Não autenticado")
-    raw = await r.get(session_id)
+    # Sessão deslizante: GETEX lê e renova o TTL no mesmo comando (uma ida ao Redis)
+    raw = await r.getex(session_key(session_id), ex=SESSION_TTL)
     if not raw:
         raise HTTPException(status_code=401, detail="Sessão inválida ou expirada")
+    set_session_cookie(response, session_id)
     session = json.loads(raw)
     return session
 
@@ -71,22 +86,32 @@ def require_role(role: str):
 
 
 # Rota protegida para admins
-@app.get("/admin")
+@router.get("/admin")
 async def admin_area(user=Depends(require_role("admin"))):
     return {"msg": f"Olá {user['username']}, você é admin"}
 
 
 # Rota protegida para usuários autenticados
-@app.get("/profile")
+@router.get("/profile")
 async def profile(user=Depends(get_current_user)):
     return {"user": user}
 
 
 # Logout: remove sessão e expira cookie
-@app.post("/logout")
+@router.post("/logout")
 async def logout(request: Request, response: Response):
     session_id = request.cookies.get(SESSION_COOKIE)
     if session_id:
-        await r.delete(session_id)
+        await r.delete(session_key(session_id))
     response.delete_cookie(SESSION_COOKIE)
     return {"msg": "deslogado"}
+
+
+# App isolado (testes e desenvolvimento)
+app = FastAPI()
+app.include_router(router)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await redis_pool.fechar()
@@ -1,13 +1,56 @@
-from fastapi import Depends, FastAPI, HTTPException
+import asyncio
+import time
+from datetime import datetime
+
+import asyncpg
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
-from database import db, init_db
-from repositories import CategoriaRepository
-from schemas import CategoriaIn, ProdutoIn, ProdutoUpdate
-from services import ClienteService, ProdutoService
+import autocomplete
+import cadastro
+import items
+import jobs
+import login
+import metrics
+import redis_pool
+import snapshot
+from admission import AdmissionMiddleware
+from compression import CompressionMiddleware, PrecompressedCache
+from database import db
+from events import KEEPALIVE_S, broker, formatar_sse
+from exportacao import FORMATOS, stream_produtos
+from migrations import migrate_pool
+from repositories import (
+    RELACIONADOS_K,
+    CategoriaRepository,
+    DashboardRepository,
+    ProdutoRepository,
+)
+from schemas import (
+    AjusteProdutosIn,
+    CarrinhoItemIn,
+    CategoriaIn,
+    JobIn,
+    PedidoIn,
+    ProdutoFiltro,
+    ProdutoIn,
+    ProdutoUpdate,
+)
+from services import (
+    CarrinhoService,
+    ClienteService,
+    PedidoService,
+    ProdutoService,
+    VendasService,
+)
+from timing import ServerTimingMiddleware, TimingRoute
 
 app = FastAPI()
+# Separa o tempo de cada endpoint da serialização feita pelo FastAPI (Server-Timing)
+app.router.route_class = TimingRoute
 
 # ==================================================================
 # CONFIGURAÇÃO DE CORS
@@ -19,6 +62,8 @@ origins = [
     "http://127.0.0.1:5500",
 ]
 
+# Admissão fica por dentro do CORS para que os 503 também levem os headers de CORS
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -26,17 +71,106 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(ServerTimingMiddleware, on_complete=metrics.observar_fases)
+# Por fora de tudo: mede também as requisições recusadas pela admissão
+app.add_middleware(metrics.HTTPMetricsMiddleware)
+
+
+@app.exception_handler(asyncpg.QueryCanceledError)
+async def consulta_cancelada(request: Request, exc: asyncpg.QueryCanceledError):
+    """statement_timeout estourado: o orçamento da requisição acabou."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Tempo limite da consulta excedido"},
+        headers={"Retry-After": "1"},
+    )
+
+
+async def aquecer_catalogo():
+    """Warmer do startup: primeira leitura do catálogo fora do caminho de uma requisição."""
+    await ProdutoService(db.pool).listar_produtos()
+    async with db.pool.acquire() as conn:
+        await CategoriaRepository(conn).list_all()
+
+
+async def aquecer_autocomplete():
+    """Carrega o índice só com o LISTEN de pé: o que mudar durante a carga chega por ele."""
+    broker.iniciar()
+    try:
+        await broker.aguardar_conexao()
+    except TimeoutError:
+        print("⚠️ LISTEN indisponível; o autocomplete recarrega quando ele conectar")
+    await autocomplete.indice.recarregar(db.pool)
+
+
+async def aquecer_snapshot():
+    """Mapeia o snapshot do catálogo (ou constrói, se este worker pegar o lock)."""
+    await snapshot.catalogo.aquecer(db.pool)
+
+
+db.add_warmer(aquecer_catalogo)
+db.add_warmer(aquecer_autocomplete)
+db.add_warmer(aquecer_snapshot)
+broker.ouvir(autocomplete.indice.aplicar)
+broker.ouvir(snapshot.catalogo.aplicar)
 
 
 @app.on_event("startup")
 async def startup():
+    inicio = time.perf_counter()
     await db.connect()
-    await init_db()
+    conectado = time.perf_counter()
+    # Só um worker aplica DDL; os demais fazem uma consulta de versão e seguem
+    await migrate_pool(db.pool)
+    migrado = time.perf_counter()
+    await db.warm_up()
+    fim = time.perf_counter()
+
+    db.startup_timings = {
+        "connect": round(conectado - inicio, 4),
+        "migrations": round(migrado - conectado, 4),
+        "warmup": round(fim - migrado, 4),
+        "total": round(fim - inicio, 4),
+    }
+    await jobs.runner.iniciar(db.jobs_pool)
+    db.ready = True
+    print(f"🚀 Worker pronto em {fim - inicio:.3f}s {db.startup_timings}")
 
 
 @app.on_event("shutdown")
 async def shutdown():
+    await broker.parar()
+    await jobs.runner.parar()
     await db.disconnect()
+    await redis_pool.fechar()
+
+
+# ==================================================================
+# HEALTH CHECKS
+# ==================================================================
+@app.get("/health/live")
+async def health_live():
+    """O processo está de pé (não depende do banco)."""
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+async def health_ready():
+    """Só aceita tráfego depois que o pool foi aquecido no startup."""
+    if not db.ready:
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready", "startup": db.startup_timings}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def exportar_metricas():
+    """Métricas deste worker no formato texto do Prometheus."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# Listagens do catálogo já serializadas e comprimidas, por versão do catálogo
+catalogo_cache = PrecompressedCache()
 
 
 # ==================================================================
@@ -50,6 +184,18 @@ def get_cliente_service():
     return ClienteService(db.pool)
 
 
+def get_carrinho_service():
+    return CarrinhoService(db.pool)
+
+
+def get_pedido_service():
+    return PedidoService(db.pool)
+
+
+def get_vendas_service():
+    return VendasService(db.pool)
+
+
 # ==================================================================
 # MODELOS PYDANTIC (Para requisições que não estão no schemas.py)
 # ==================================================================
@@ -73,8 +219,70 @@ async def criar_produto(payload: ProdutoIn, service: ProdutoService = Depends(ge
 
 
 @app.get("/produtos")
-async def listar_produtos(service: ProdutoService = Depends(get_produto_service)):
-    return await service.listar_produtos()
+async def listar_produtos(
+    request: Request,
+    filtro: ProdutoFiltro = Depends(),
+    service: ProdutoService = Depends(get_produto_service),
+):
+    if not filtro.vazio():
+        return await service.filtrar_produtos(filtro)
+    # A versão é lida antes da listagem: o conteúdo em cache nunca é mais antigo que a chave
+    versao = await service.versao_catalogo()
+    return await catalogo_cache.resposta(
+        "produtos",
+        versao,
+        request.headers.get("accept-encoding", ""),
+        lambda: service.listar_produtos(versao),
+        if_none_match=request.headers.get("if-none-match"),
+    )
+
+
+# Rotas fixas declaradas antes de /produtos/{id}, senão "autocomplete"/"changes"/"export" seriam lidos como id
+@app.get("/produtos/autocomplete")
+async def autocompletar_produtos(
+    prefix: str = Query("", max_length=100),
+    limite: int = Query(autocomplete.LIMITE_PADRAO, ge=1, le=50),
+):
+    """Sugestões por prefixo de palavra, da memória do worker (sem consulta ao banco)."""
+    if not autocomplete.indice.pronto:
+        raise HTTPException(
+            status_code=503,
+            detail="Índice de autocomplete carregando",
+            headers={"Retry-After": "1"},
+        )
+    return autocomplete.indice.buscar(prefix, limite)
+
+
+@app.post("/produtos/bulk")
+async def ajustar_produtos(
+    payload: AjusteProdutosIn, service: ProdutoService = Depends(get_produto_service)
+):
+    """Reajuste de preço (% ou valor) ou de estoque de todos os produtos do filtro."""
+    return await service.ajustar_em_massa(payload)
+
+
+@app.get("/produtos/changes")
+async def alteracoes_produtos(
+    since: int = Query(0, ge=0),
+    limite: int = Query(1000, ge=1, le=10_000),
+    service: ProdutoService = Depends(get_produto_service),
+):
+    """Sincronização incremental: só o que mudou depois da versão ``since``."""
+    return await service.alteracoes(since, limite)
+
+
+@app.get("/produtos/export")
+async def exportar_produtos(
+    formato: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    filtro: ProdutoFiltro = Depends(),
+):
+    """Catálogo completo (com os mesmos filtros da listagem) em streaming."""
+    media_type, extensao = FORMATOS[formato]
+    return StreamingResponse(
+        stream_produtos(db.pool, formato, filtro),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="produtos.{extensao}"'},
+    )
 
 
 @app.get("/produtos/{id}")
@@ -85,6 +293,15 @@ async def obter_produto(id: int, service: ProdutoService = Depends(get_produto_s
     return prod
 
 
+@app.get("/produtos/{id}/relacionados")
+async def produtos_relacionados(
+    id: int,
+    limite: int = Query(8, ge=1, le=RELACIONADOS_K),
+    service: ProdutoService = Depends(get_produto_service),
+):
+    return await service.relacionados(id, limite)
+
+
 @app.put("/produtos/{id}")
 async def atualizar_produto(
     id: int, payload: ProdutoUpdate, service: ProdutoService = Depends(get_produto_service)
@@ -99,6 +316,9 @@ async def deletar_produto(id: int, service: ProdutoService = Depends(get_produto
 
 @app.get("/categorias")
 async def listar_categorias():
+    atual = await snapshot.catalogo.atual(db.pool)
+    if atual is not None:
+        return atual.categorias_por_nome()
     async with db.pool.acquire() as conn:
         repo = CategoriaRepository(conn)
         return await repo.list_all()
@@ -110,6 +330,7 @@ async def criar_categoria(payload: CategoriaIn):
         repo = CategoriaRepository(conn)
         try:
             cid = await repo.create(payload)
+            snapshot.catalogo.expirar()
             return {"id": cid}
         except Exception as err:
             raise HTTPException(status_code=400, detail="Erro ao criar categoria") from err
@@ -121,27 +342,116 @@ async def get_dashboard_stats():
     Retorna estatísticas gerais para o painel administrativo.
     """
     async with db.pool.acquire() as conn:
-        # 1. Total de Produtos
-        total_produtos = await conn.fetchval("SELECT COUNT(*) FROM produto")
+        return await DashboardRepository(conn).stats()
 
-        # 2. Produtos com Estoque Baixo (ex: menos de 10 unidades)
-        estoque_baixo = await conn.fetchval("SELECT COUNT(*) FROM produto WHERE estoque < 10")
 
-        # 3. Valor Total do Inventário (Soma de preço * estoque)
-        # O COALESCE garante que retorne 0 se a tabela estiver vazia
-        valor_inventario = await conn.fetchval(
-            "SELECT COALESCE(SUM(preco * estoque), 0) FROM produto"
-        )
+@app.get("/estoque/alertas")
+async def alertas_estoque(limite: int = Query(50, ge=1, le=500)):
+    """Produtos abaixo do estoque mínimo (pelo índice parcial, sem varrer o catálogo)."""
+    async with db.pool.acquire() as conn:
+        return await ProdutoRepository(conn).alertas_estoque(limite)
+
+
+@app.get("/dashboard/vendas")
+async def get_dashboard_vendas(
+    granularidade: str = Query("dia", pattern="^(hora|dia)$"),
+    inicio: datetime | None = None,
+    fim: datetime | None = None,
+    limite: int = Query(10, ge=1, le=100),
+    service: VendasService = Depends(get_vendas_service),
+):
+    """
+    Vendas de ``inicio`` a ``fim`` (inclusive; padrão: últimos 30 dias ou 48
+    horas) lidas dos rollups: série por período, totais, ``limite`` produtos
+    mais vendidos e receita por categoria.
+    """
+    return await service.relatorio(granularidade, inicio, fim, limite)
+
+
+# ==================================================================
+# EVENTOS EM TEMPO REAL (SSE)
+# ==================================================================
+@app.get("/eventos")
+async def eventos(request: Request, stats: bool = False):
+    """
+    Stream SSE com as alterações de produto (estoque, preço), os deltas do
+    dashboard e os alertas de estoque (``estoque_alerta``: produtos que acabaram
+    de ficar abaixo do mínimo, seja por PUT, checkout ou ajuste em massa). Com
+    ``?stats=true`` o primeiro evento traz os números completos, calculados
+    depois da assinatura (nenhum delta se perde entre os dois).
+    """
+    fila = broker.assinar()
+
+    async def stream():
+        try:
+            yield b"retry: 3000\n\n"
+            if stats:
+                async with db.pool.acquire() as conn:
+                    inicial = await DashboardRepository(conn).stats()
+                yield formatar_sse("stats", jsonable_encoder(inicial))
+            while True:
+                try:
+                    mensagem = await asyncio.wait_for(fila.get(), KEEPALIVE_S)
+                except TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield b": keepalive\n\n"
+                    continue
+                if mensagem is None:
+                    break
+                yield mensagem
+        finally:
+            broker.cancelar(fila)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ==================================================================
+# JOBS EM SEGUNDO PLANO
+# ==================================================================
+@app.post("/jobs", status_code=202)
+async def criar_job(payload: JobIn):
+    async with db.pool.acquire() as conn:
+        try:
+            job_id = await jobs.enfileirar(conn, payload.tipo, payload.params)
+        except ValueError as err:
+            raise HTTPException(status_code=400, detail=str(err)) from err
+        return await jobs.obter(conn, job_id)
+
+
+@app.get("/jobs/{id}")
+async def status_job(id: int):
+    async with db.pool.acquire() as conn:
+        job = await jobs.obter(conn, id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
+
 
-        # 4. Total de Clientes (Já que criamos a tabela)
-        total_clientes = await conn.fetchval("SELECT COUNT(*) FROM cliente")
+@app.post("/jobs/{id}/cancelar")
+async def cancelar_job(id: int):
+    async with db.pool.acquire() as conn:
+        job = await jobs.cancelar(conn, id)
+        if job is None:
+            if await jobs.obter(conn, id) is None:
+                raise HTTPException(status_code=404, detail="Job não encontrado")
+            raise HTTPException(status_code=409, detail="Job já foi finalizado")
+    return job
 
-        return {
-            "total_produtos": total_produtos,
-            "estoque_baixo": estoque_baixo,
-            "valor_inventario": valor_inventario,
-            "total_clientes": total_clientes,
-        }
+
+@app.post("/jobs/{id}/retentar")
+async def retentar_job(id: int):
+    async with db.pool.acquire() as conn:
+        job = await jobs.retentar(conn, id)
+        if job is None:
+            if await jobs.obter(conn, id) is None:
+                raise HTTPException(status_code=404, detail="Job não encontrado")
+            raise HTTPException(status_code=409, detail="Só jobs com falha ou cancelados")
+    return job
 
 
 # ==================================================================
@@ -162,6 +472,100 @@ async def login_usuario(dados: LoginDados, service: ClienteService = Depends(get
     return {"msg": "Login realizado", "usuario": user}
 
 
+# ==================================================================
+# ROTAS - CARRINHO E LISTA DE DESEJOS
+# ==================================================================
+@app.get("/clientes/{cliente_id}/carrinho")
+async def obter_carrinho(cliente_id: int, service: CarrinhoService = Depends(get_carrinho_service)):
+    return await service.obter_carrinho(cliente_id)
+
+
+@app.put("/clientes/{cliente_id}/carrinho/{produto_id}")
+async def definir_item_carrinho(
+    cliente_id: int,
+    produto_id: int,
+    payload: CarrinhoItemIn,
+    service: CarrinhoService = Depends(get_carrinho_service),
+):
+    """Define a quantidade do produto no carrinho (adiciona se ainda não estiver)."""
+    return await service.definir_item(cliente_id, produto_id, payload.quantidade)
+
+
+@app.delete("/clientes/{cliente_id}/carrinho/{produto_id}")
+async def remover_item_carrinho(
+    cliente_id: int, produto_id: int, service: CarrinhoService = Depends(get_carrinho_service)
+):
+    return await service.remover_item(cliente_id, produto_id)
+
+
+@app.delete("/clientes/{cliente_id}/carrinho")
+async def limpar_carrinho(
+    cliente_id: int, service: CarrinhoService = Depends(get_carrinho_service)
+):
+    return await service.limpar(cliente_id)
+
+
+@app.get("/clientes/{cliente_id}/lista-desejo")
+async def listar_desejos(cliente_id: int, service: CarrinhoService = Depends(get_carrinho_service)):
+    return await service.listar_desejos(cliente_id)
+
+
+@app.put("/clientes/{cliente_id}/lista-desejo/{produto_id}")
+async def adicionar_desejo(
+    cliente_id: int, produto_id: int, service: CarrinhoService = Depends(get_carrinho_service)
+):
+    return await service.adicionar_desejo(cliente_id, produto_id)
+
+
+@app.delete("/clientes/{cliente_id}/lista-desejo/{produto_id}")
+async def remover_desejo(
+    cliente_id: int, produto_id: int, service: CarrinhoService = Depends(get_carrinho_service)
+):
+    return await service.remover_desejo(cliente_id, produto_id)
+
+
+# ==================================================================
+# ROTAS - PEDIDOS
+# ==================================================================
+@app.post("/clientes/{cliente_id}/pedidos", status_code=201)
+async def finalizar_pedido(
+    cliente_id: int, payload: PedidoIn, service: PedidoService = Depends(get_pedido_service)
+):
+    """Fecha o pedido com os itens do carrinho do cliente."""
+    return await service.finalizar(cliente_id, payload)
+
+
+@app.get("/clientes/{cliente_id}/pedidos")
+async def listar_pedidos(
+    cliente_id: int,
+    limite: int = Query(20, ge=1, le=100),
+    cursor: str | None = None,
+    service: PedidoService = Depends(get_pedido_service),
+):
+    """Histórico paginado: passe ``cursor=proximo`` da resposta anterior."""
+    return await service.listar(cliente_id, limite, cursor)
+
+
+@app.get("/clientes/{cliente_id}/pedidos/{pedido_id}")
+async def obter_pedido(
+    cliente_id: int, pedido_id: int, service: PedidoService = Depends(get_pedido_service)
+):
+    return await service.obter(cliente_id, pedido_id)
+
+
+# ==================================================================
+# MÓDULOS MONTADOS (itens de exemplo e sessões em Redis)
+# ==================================================================
+# Mesmo processo, mesmo pool do Postgres (db) e do Redis (redis_pool) e o mesmo
+# startup/shutdown: escalam com os workers do gunicorn em vez de rodar à parte.
+# login e cadastro têm /login e /logout próprios; o prefixo evita o choque com
+# as rotas de clientes acima. Cada um tem o seu cookie e o seu prefixo de chave
+# no Redis, então a sessão de um nunca é lida (nem apagada) pelo outro.
+app.include_router(items.router, tags=["itens"])
+app.include_router(login.router, prefix="/sessao", tags=["sessao"])
+app.include_router(cadastro.router, prefix="/contas", tags=["contas"])
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,285 @@
+"""
+Métricas em memória no formato texto do Prometheus (sem dependências externas).
+
+- ``InstrumentedConnection``: subclasse de ``asyncpg.Connection`` usada como
+  ``connection_class`` do pool. Mede latência, linhas retornadas e erros de cada
+  consulta, nomeada pelo método que a chamou (ex.: ``repositories.ProdutoRepository.list_all``)
+  ou explicitamente via ``query_name=``. Consultas lentas vão para o log com os
+  parâmetros e, opcionalmente, uma amostra de ``EXPLAIN (ANALYZE, BUFFERS)``.
+- ``HTTPMetricsMiddleware``: latência por rota (template do path, não o path cru).
+- ``render()``: texto servido em ``/metrics``.
+
+Cada worker do gunicorn tem seu próprio registro; o scrape vê o worker que atendeu.
+"""
+
+import bisect
+import os
+import random
+import sys
+import time
+
+import asyncpg
+
+from timing import registrar
+
+# Consultas acima deste tempo vão para o log de consultas lentas
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# Fração das consultas lentas (só SELECT/WITH) que ganham um EXPLAIN ANALYZE no log
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0"))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(nomes: tuple[str, ...], valores: tuple) -> str:
+    if not nomes:
+        return ""
+    pares = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(nomes, valores, strict=True))
+    return "{" + pares + "}"
+
+
+class Counter:
+    def __init__(self, nome: str, ajuda: str, labels: tuple[str, ...] = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.labels = labels
+        self.valores: dict[tuple, float] = {}
+
+    def inc(self, *label_values, valor: float = 1.0):
+        self.valores[label_values] = self.valores.get(label_values, 0.0) + valor
+
+    def render(self) -> list[str]:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        for chave, valor in self.valores.items():
+            linhas.append(f"{self.nome}{_labels(self.labels, chave)} {valor}")
+        return linhas
+
+
+class Histogram:
+    def __init__(
+        self,
+        nome: str,
+        ajuda: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.labels = labels
+        self.buckets = buckets
+        # chave -> [contagens por bucket (não cumulativas, +Inf no fim), soma, total]
+        self.series: dict[tuple, list] = {}
+
+    def observe(self, valor: float, *label_values):
+        serie = self.series.get(label_values)
+        if serie is None:
+            serie = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        serie[0][bisect.bisect_left(self.buckets, valor)] += 1
+        serie[1] += valor
+        serie[2] += 1
+
+    def render(self) -> list[str]:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        nomes_le = (*self.labels, "le")
+        for chave, (contagens, soma, total) in self.series.items():
+            acumulado = 0
+            for limite, contagem in zip(self.buckets, contagens, strict=False):
+                acumulado += contagem
+                linhas.append(
+                    f"{self.nome}_bucket{_labels(nomes_le, (*chave, limite))} {acumulado}"
+                )
+            linhas.append(f"{self.nome}_bucket{_labels(nomes_le, (*chave, '+Inf'))} {total}")
+            linhas.append(f"{self.nome}_sum{_labels(self.labels, chave)} {soma}")
+            linhas.append(f"{self.nome}_count{_labels(self.labels, chave)} {total}")
+        return linhas
+
+
+class Gauge:
+    """Valor lido na hora do scrape (``funcao`` retorna {valores dos labels: valor})."""
+
+    def __init__(self, nome: str, ajuda: str, funcao, labels: tuple[str, ...] = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.funcao = funcao
+        self.labels = labels
+
+    def render(self) -> list[str]:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} gauge"]
+        for chave, valor in self.funcao().items():
+            linhas.append(f"{self.nome}{_labels(self.labels, chave)} {valor}")
+        return linhas
+
+
+REGISTRY: list[Counter | Histogram | Gauge] = []
+
+
+def register(metrica):
+    REGISTRY.append(metrica)
+    return metrica
+
+
+def render() -> str:
+    linhas = []
+    for metrica in REGISTRY:
+        linhas.extend(metrica.render())
+    return "\n".join(linhas) + "\n"
+
+
+DB_QUERY_SECONDS = register(
+    Histogram("db_query_duration_seconds", "Latência das consultas SQL", ("query",))
+)
+DB_QUERY_ROWS = register(Counter("db_query_rows_total", "Linhas retornadas/afetadas", ("query",)))
+DB_QUERY_ERRORS = register(
+    Counter("db_query_errors_total", "Consultas que falharam", ("query", "error"))
+)
+ADMISSION_REJECTED = register(
+    Counter("admission_rejected_total", "Requisições recusadas pela admissão", ("classe",))
+)
+SINGLEFLIGHT_REQUESTS = register(
+    Counter(
+        "singleflight_requests_total",
+        "Leituras por operação: lider (executou a consulta) ou compartilhada",
+        ("operacao", "resultado"),
+    )
+)
+CACHE_REQUESTS = register(
+    Counter(
+        "cache_requests_total",
+        "Leituras dos caches do catálogo por resultado (l1, l2, antecipado, falha; snapshot: hit, banco)",
+        ("cache", "resultado"),
+    )
+)
+HTTP_REQUEST_SECONDS = register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Latência das requisições HTTP por rota",
+        ("method", "route", "status"),
+    )
+)
+SERVER_TIMING_SECONDS = register(
+    Histogram(
+        "server_timing_phase_seconds",
+        "Tempo por fase da requisição (mesmas fases do header Server-Timing)",
+        ("route", "fase"),
+    )
+)
+
+
+def observar_fases(route: str, fases: dict[str, float]):
+    """Callback da ServerTimingMiddleware: agrega as fases de cada requisição."""
+    for fase, segundos in fases.items():
+        SERVER_TIMING_SECONDS.observe(segundos, route, fase)
+
+
+# ==================================================================
+# INSTRUMENTAÇÃO DAS CONSULTAS
+# ==================================================================
+def _nome_consulta() -> str:
+    # Dentro da corrotina, o frame de cima é quem fez o ``await conn.fetch(...)``
+    # (o proxy do pool só devolve a corrotina e já saiu da pilha).
+    frame = sys._getframe(2)
+    modulo = frame.f_globals.get("__name__", "")
+    if modulo.startswith("asyncpg"):
+        return "asyncpg.interno"
+    return f"{modulo}.{frame.f_code.co_qualname}"
+
+
+def _linhas_do_status(status: str) -> int:
+    # "UPDATE 3", "INSERT 0 1", "DELETE 0"...
+    ultimo = status.rsplit(" ", 1)[-1]
+    return int(ultimo) if ultimo.isdigit() else 0
+
+
+class InstrumentedConnection(asyncpg.Connection):
+    async def _medir(self, metodo, nome, query, args, kwargs):
+        inicio = time.perf_counter()
+        try:
+            resultado = await metodo(self, query, *args, **kwargs)
+        except Exception as exc:
+            DB_QUERY_ERRORS.inc(nome, type(exc).__name__)
+            raise
+        finally:
+            duracao = time.perf_counter() - inicio
+            DB_QUERY_SECONDS.observe(duracao, nome)
+            registrar("sql", duracao)
+
+        if duracao * 1000 >= SLOW_QUERY_MS:
+            await self._log_consulta_lenta(nome, query, args, duracao)
+        return resultado
+
+    async def _log_consulta_lenta(self, nome, query, args, duracao):
+        print(f"🐢 Consulta lenta ({duracao * 1000:.1f} ms) {nome}: {' '.join(query.split())}")
+        print(f"   parâmetros: {[repr(a)[:200] for a in args]}")
+        leitura = query.lstrip().upper().startswith(("SELECT", "WITH"))
+        if leitura and SLOW_QUERY_EXPLAIN_SAMPLE and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE:
+            # O ANALYZE executa a consulta de novo, e um WITH pode ter UPDATE/DELETE/INSERT:
+            # roda numa transação (ou savepoint) que é sempre desfeita.
+            transacao = self.transaction()
+            try:
+                await transacao.start()
+                try:
+                    plano = await super().fetch(f"EXPLAIN (ANALYZE, BUFFERS) {query}", *args)
+                finally:
+                    await transacao.rollback()
+                print("   " + "\n   ".join(r[0] for r in plano))
+            except Exception as exc:  # o EXPLAIN é só diagnóstico, nunca derruba a requisição
+                print(f"   (EXPLAIN falhou: {exc})")
+
+    async def fetch(self, query, *args, query_name: str | None = None, **kwargs):
+        nome = query_name or _nome_consulta()
+        rows = await self._medir(asyncpg.Connection.fetch, nome, query, args, kwargs)
+        DB_QUERY_ROWS.inc(nome, valor=len(rows))
+        return rows
+
+    async def fetchrow(self, query, *args, query_name: str | None = None, **kwargs):
+        nome = query_name or _nome_consulta()
+        row = await self._medir(asyncpg.Connection.fetchrow, nome, query, args, kwargs)
+        DB_QUERY_ROWS.inc(nome, valor=0 if row is None else 1)
+        return row
+
+    async def fetchval(self, query, *args, query_name: str | None = None, **kwargs):
+        nome = query_name or _nome_consulta()
+        valor = await self._medir(asyncpg.Connection.fetchval, nome, query, args, kwargs)
+        DB_QUERY_ROWS.inc(nome, valor=0 if valor is None else 1)
+        return valor
+
+    async def execute(self, query, *args, query_name: str | None = None, **kwargs):
+        nome = query_name or _nome_consulta()
+        status = await self._medir(asyncpg.Connection.execute, nome, query, args, kwargs)
+        DB_QUERY_ROWS.inc(nome, valor=_linhas_do_status(status))
+        return status
+
+
+# ==================================================================
+# LATÊNCIA HTTP POR ROTA
+# ==================================================================
+class HTTPMetricsMiddleware:
+    """Middleware ASGI pura; o label ``route`` é o template (ex.: /produtos/{id})."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        inicio = time.perf_counter()
+
+        async def send_com_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_com_status)
+        finally:
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "nao_roteada"
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - inicio, scope["method"], template, str(status)
+            )
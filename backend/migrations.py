@@ -0,0 +1,873 @@
+"""
+Migrações versionadas do schema.
+
+Cada migração é aplicada uma única vez e registrada na tabela ``schema_version``.
+No startup, cada worker faz apenas uma consulta para conferir a versão atual; se
+houver migrações pendentes, o processo segura um ``pg_advisory_lock`` para que
+somente um deles aplique o DDL enquanto os outros esperam.
+
+Uso standalone:
+    python migrations.py            # aplica as migrações pendentes
+    python migrations.py --status   # mostra a versão atual do banco
+"""
+
+import argparse
+import asyncio
+from typing import NamedTuple
+
+import asyncpg
+
+from database import DATABASE_URL
+
+# Chave arbitrária (bigint) usada no pg_advisory_lock das migrações
+MIGRATION_LOCK_ID = 726_340_126
+
+
+class Migration(NamedTuple):
+    version: int
+    descricao: str
+    sql: str
+
+
+MIGRATIONS: list[Migration] = [
+    # As tabelas usam IF NOT EXISTS para que bancos criados pelo antigo init_db
+    # sejam adotados sem erro na primeira execução.
+    Migration(
+        1,
+        "schema inicial (categoria, produto, cliente)",
+        """
+        CREATE TABLE IF NOT EXISTS categoria (
+            id SERIAL PRIMARY KEY,
+            nome TEXT NOT NULL UNIQUE
+        );
+
+        CREATE TABLE IF NOT EXISTS produto (
+            id SERIAL PRIMARY KEY,
+            nome TEXT NOT NULL,
+            preco NUMERIC NOT NULL,
+            unidade TEXT NOT NULL,
+            categoria_id INTEGER REFERENCES categoria(id),
+            estoque INTEGER NOT NULL DEFAULT 0,
+            UNIQUE(nome, categoria_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS cliente (
+            id SERIAL PRIMARY KEY,
+            nome TEXT NOT NULL,
+            email TEXT NOT NULL UNIQUE,
+            senha_hash TEXT NOT NULL
+        );
+        """,
+    ),
+    Migration(
+        2,
+        "categorias padrão",
+        """
+        INSERT INTO categoria (nome)
+        VALUES
+            ('Eletrônicos'),
+            ('Acessórios'),
+            ('Computadores'),
+            ('Smartphones'),
+            ('Games')
+        ON CONFLICT (nome) DO NOTHING;
+        """,
+    ),
+    # Qualquer escrita em produto ou categoria incrementa a versão do catálogo;
+    # os caches de resposta usam a versão como chave. Os triggers são por
+    # comando (não por linha), então um COPY de um milhão de linhas custa um UPDATE.
+    Migration(
+        3,
+        "versão do catálogo",
+        """
+        CREATE TABLE catalogo_versao (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            versao BIGINT NOT NULL
+        );
+        INSERT INTO catalogo_versao (versao) VALUES (1);
+
+        CREATE FUNCTION incrementar_versao_catalogo() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE catalogo_versao SET versao = versao + 1;
+            RETURN NULL;
+        END
+        $$;
+
+        CREATE TRIGGER produto_versao_catalogo
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON produto
+            FOR EACH STATEMENT EXECUTE FUNCTION incrementar_versao_catalogo();
+
+        CREATE TRIGGER categoria_versao_catalogo
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON categoria
+            FOR EACH STATEMENT EXECUTE FUNCTION incrementar_versao_catalogo();
+        """,
+    ),
+    # Eventos para o canal SSE (/eventos): um NOTIFY por comando, não por linha.
+    # As tabelas de transição dão o delta exato do dashboard mesmo num COPY
+    # gigante; a lista de itens só vai junto quando o comando mexeu em poucas
+    # linhas (o payload do NOTIFY tem limite de 8000 bytes).
+    Migration(
+        4,
+        "notificações de produto e cliente",
+        """
+        CREATE FUNCTION notificar_produtos() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            n_novos BIGINT := 0;  baixo_novos BIGINT := 0;  valor_novos NUMERIC := 0;
+            n_antigos BIGINT := 0;  baixo_antigos BIGINT := 0;  valor_antigos NUMERIC := 0;
+            itens JSONB;
+            removidos JSONB;
+            payload TEXT;
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                PERFORM pg_notify('eventos', '{"tipo": "produto", "op": "TRUNCATE"}');
+                RETURN NULL;
+            END IF;
+
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                SELECT count(*), count(*) FILTER (WHERE estoque < 10),
+                       COALESCE(sum(preco * estoque), 0)
+                INTO n_novos, baixo_novos, valor_novos FROM novos;
+                IF n_novos <= 20 THEN
+                    SELECT jsonb_agg(jsonb_build_object(
+                        'id', id, 'nome', nome, 'preco', preco::text,
+                        'unidade', unidade, 'estoque', estoque))
+                    INTO itens FROM novos;
+                END IF;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                SELECT count(*), count(*) FILTER (WHERE estoque < 10),
+                       COALESCE(sum(preco * estoque), 0)
+                INTO n_antigos, baixo_antigos, valor_antigos FROM antigos;
+                IF TG_OP = 'DELETE' AND n_antigos <= 20 THEN
+                    SELECT jsonb_agg(id) INTO removidos FROM antigos;
+                END IF;
+            END IF;
+
+            IF n_novos = 0 AND n_antigos = 0 THEN
+                RETURN NULL;
+            END IF;
+
+            payload := jsonb_build_object(
+                'tipo', 'produto',
+                'op', TG_OP,
+                'linhas', GREATEST(n_novos, n_antigos),
+                'delta', jsonb_build_object(
+                    'total_produtos', n_novos - n_antigos,
+                    'estoque_baixo', baixo_novos - baixo_antigos,
+                    'valor_inventario', valor_novos - valor_antigos),
+                'itens', itens,
+                'removidos', removidos)::text;
+            IF length(payload) > 7900 THEN
+                payload := (payload::jsonb || '{"itens": null}')::text;
+            END IF;
+            PERFORM pg_notify('eventos', payload);
+            RETURN NULL;
+        END
+        $$;
+
+        CREATE TRIGGER produto_eventos_insert AFTER INSERT ON produto
+            REFERENCING NEW TABLE AS novos
+            FOR EACH STATEMENT EXECUTE FUNCTION notificar_produtos();
+        CREATE TRIGGER produto_eventos_update AFTER UPDATE ON produto
+            REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+            FOR EACH STATEMENT EXECUTE FUNCTION notificar_produtos();
+        CREATE TRIGGER produto_eventos_delete AFTER DELETE ON produto
+            REFERENCING OLD TABLE AS antigos
+            FOR EACH STATEMENT EXECUTE FUNCTION notificar_produtos();
+        CREATE TRIGGER produto_eventos_truncate AFTER TRUNCATE ON produto
+            FOR EACH STATEMENT EXECUTE FUNCTION notificar_produtos();
+
+        CREATE FUNCTION notificar_clientes() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            delta BIGINT;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                SELECT count(*) INTO delta FROM novos;
+            ELSE
+                SELECT -count(*) INTO delta FROM antigos;
+            END IF;
+            IF delta <> 0 THEN
+                PERFORM pg_notify('eventos', jsonb_build_object(
+                    'tipo', 'cliente', 'op', TG_OP,
+                    'delta', jsonb_build_object('total_clientes', delta))::text);
+            END IF;
+            RETURN NULL;
+        END
+        $$;
+
+        CREATE TRIGGER cliente_eventos_insert AFTER INSERT ON cliente
+            REFERENCING NEW TABLE AS novos
+            FOR EACH STATEMENT EXECUTE FUNCTION notificar_clientes();
+        CREATE TRIGGER cliente_eventos_delete AFTER DELETE ON cliente
+            REFERENCING OLD TABLE AS antigos
+            FOR EACH STATEMENT EXECUTE FUNCTION notificar_clientes();
+        """,
+    ),
+    Migration(
+        5,
+        "fila de jobs",
+        """
+        CREATE TABLE job (
+            id BIGSERIAL PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            params JSONB NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL DEFAULT 'pendente'
+                CHECK (status IN ('pendente', 'executando', 'concluido', 'falhou', 'cancelado')),
+            progresso REAL NOT NULL DEFAULT 0,
+            mensagem TEXT,
+            resultado JSONB,
+            erro TEXT,
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            max_tentativas INTEGER NOT NULL DEFAULT 3,
+            cancelar BOOLEAN NOT NULL DEFAULT false,
+            trabalhador TEXT,
+            executar_apos TIMESTAMPTZ NOT NULL DEFAULT now(),
+            criado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+            iniciado_em TIMESTAMPTZ,
+            heartbeat_em TIMESTAMPTZ,
+            atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+            concluido_em TIMESTAMPTZ
+        );
+
+        -- Só os pendentes entram no índice: a busca do próximo job não passa
+        -- pelo histórico de jobs concluídos
+        CREATE INDEX job_fila_idx ON job (executar_apos, id) WHERE status = 'pendente';
+        CREATE INDEX job_executando_idx ON job (heartbeat_em) WHERE status = 'executando';
+        """,
+    ),
+    # Sincronização incremental (/produtos/changes): cada linha de produto e
+    # categoria guarda a versão da sua última alteração, e cada DELETE deixa uma
+    # lápide em produto_removido. A versão vem de uma sequence, mas só depois de
+    # travar a linha de catalogo_versao (que o trigger da migração 3 já travava
+    # no fim do comando): escritas concorrentes recebem versões na ordem de
+    # commit, e um cliente que já leu até N nunca perde uma versão menor que N.
+    # TRUNCATE não tem linhas para virar lápide; ele sobe sync_minimo, e quem
+    # estiver atrás disso precisa baixar o catálogo completo. As lápides não
+    # expiram (uma linha pequena por produto apagado): apagá-las exigiria subir
+    # sync_minimo e quebraria a carga inicial paginada a partir de since=0.
+    Migration(
+        6,
+        "versão por linha e lápides do catálogo",
+        """
+        CREATE SEQUENCE alteracao_seq;
+
+        ALTER TABLE catalogo_versao ADD COLUMN sync_minimo BIGINT NOT NULL DEFAULT 0;
+
+        ALTER TABLE produto ADD COLUMN versao BIGINT;
+        UPDATE produto SET versao = nextval('alteracao_seq');
+        ALTER TABLE produto
+            ALTER COLUMN versao SET DEFAULT nextval('alteracao_seq'),
+            ALTER COLUMN versao SET NOT NULL;
+
+        ALTER TABLE categoria ADD COLUMN versao BIGINT;
+        UPDATE categoria SET versao = nextval('alteracao_seq');
+        ALTER TABLE categoria
+            ALTER COLUMN versao SET DEFAULT nextval('alteracao_seq'),
+            ALTER COLUMN versao SET NOT NULL;
+
+        CREATE TABLE produto_removido (
+            id INTEGER PRIMARY KEY,
+            versao BIGINT NOT NULL DEFAULT nextval('alteracao_seq'),
+            removido_em TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        CREATE INDEX produto_versao_idx ON produto (versao);
+        CREATE INDEX categoria_versao_idx ON categoria (versao);
+        CREATE INDEX produto_removido_versao_idx ON produto_removido (versao);
+
+        CREATE FUNCTION travar_versao_catalogo() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM 1 FROM catalogo_versao FOR UPDATE;
+            RETURN NULL;
+        END
+        $$;
+
+        CREATE FUNCTION nova_versao_linha() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.versao := nextval('alteracao_seq');
+            RETURN NEW;
+        END
+        $$;
+
+        CREATE FUNCTION registrar_produtos_removidos() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO produto_removido (id)
+            SELECT id FROM antigos
+            ON CONFLICT (id) DO UPDATE
+                SET versao = nextval('alteracao_seq'), removido_em = now();
+            RETURN NULL;
+        END
+        $$;
+
+        CREATE FUNCTION reiniciar_sincronizacao() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE catalogo_versao SET sync_minimo = nextval('alteracao_seq');
+            DELETE FROM produto_removido;
+            RETURN NULL;
+        END
+        $$;
+
+        CREATE TRIGGER produto_travar_versao
+            BEFORE INSERT OR UPDATE OR DELETE ON produto
+            FOR EACH STATEMENT EXECUTE FUNCTION travar_versao_catalogo();
+        CREATE TRIGGER categoria_travar_versao
+            BEFORE INSERT OR UPDATE OR DELETE ON categoria
+            FOR EACH STATEMENT EXECUTE FUNCTION travar_versao_catalogo();
+
+        CREATE TRIGGER produto_versao_linha BEFORE UPDATE ON produto
+            FOR EACH ROW EXECUTE FUNCTION nova_versao_linha();
+        CREATE TRIGGER categoria_versao_linha BEFORE UPDATE ON categoria
+            FOR EACH ROW EXECUTE FUNCTION nova_versao_linha();
+
+        CREATE TRIGGER produto_lapides AFTER DELETE ON produto
+            REFERENCING OLD TABLE AS antigos
+            FOR EACH STATEMENT EXECUTE FUNCTION registrar_produtos_removidos();
+        CREATE TRIGGER produto_sync_truncate AFTER TRUNCATE ON produto
+            FOR EACH STATEMENT EXECUTE FUNCTION reiniciar_sincronizacao();
+        CREATE TRIGGER categoria_sync_truncate AFTER TRUNCATE ON categoria
+            FOR EACH STATEMENT EXECUTE FUNCTION reiniciar_sincronizacao();
+        """,
+    ),
+    # Carrinho e lista de desejos no servidor: uma linha estreita por item.
+    # carrinho.revisao muda a cada alteração nos itens do cliente e a cada
+    # UPDATE de nome/preço/estoque/unidade de um produto que está no carrinho;
+    # o total em cache usa a revisão como chave.
+    Migration(
+        7,
+        "carrinho e lista de desejos",
+        """
+        CREATE TABLE carrinho (
+            cliente_id INTEGER PRIMARY KEY REFERENCES cliente(id) ON DELETE CASCADE,
+            revisao BIGINT NOT NULL DEFAULT 1,
+            atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        CREATE TABLE carrinho_item (
+            cliente_id INTEGER NOT NULL REFERENCES cliente(id) ON DELETE CASCADE,
+            produto_id INTEGER NOT NULL REFERENCES produto(id) ON DELETE CASCADE,
+            quantidade INTEGER NOT NULL CHECK (quantidade > 0),
+            adicionado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (cliente_id, produto_id)
+        );
+        -- Invalidação por produto e ON DELETE CASCADE
+        CREATE INDEX carrinho_item_produto_idx ON carrinho_item (produto_id);
+
+        CREATE TABLE lista_desejo_item (
+            cliente_id INTEGER NOT NULL REFERENCES cliente(id) ON DELETE CASCADE,
+            produto_id INTEGER NOT NULL REFERENCES produto(id) ON DELETE CASCADE,
+            adicionado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (cliente_id, produto_id)
+        );
+        CREATE INDEX lista_desejo_item_produto_idx ON lista_desejo_item (produto_id);
+
+        CREATE FUNCTION revisar_carrinhos_itens() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO carrinho (cliente_id)
+                SELECT DISTINCT cliente_id FROM novos
+                ON CONFLICT (cliente_id) DO UPDATE
+                    SET revisao = carrinho.revisao + 1, atualizado_em = now();
+            ELSE
+                -- Sem upsert: no DELETE em cascata o cliente pode já não existir
+                UPDATE carrinho SET revisao = revisao + 1, atualizado_em = now()
+                WHERE cliente_id IN (SELECT cliente_id FROM antigos);
+            END IF;
+            RETURN NULL;
+        END
+        $$;
+
+        CREATE FUNCTION revisar_carrinhos_produtos() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE carrinho SET revisao = revisao + 1, atualizado_em = now()
+            WHERE cliente_id IN (
+                SELECT ci.cliente_id
+                FROM novos n
+                JOIN antigos a ON a.id = n.id
+                JOIN carrinho_item ci ON ci.produto_id = n.id
+                WHERE (n.nome, n.preco, n.estoque, n.unidade)
+                      IS DISTINCT FROM (a.nome, a.preco, a.estoque, a.unidade)
+            );
+            RETURN NULL;
+        END
+        $$;
+
+        CREATE TRIGGER carrinho_item_revisao_insert AFTER INSERT ON carrinho_item
+            REFERENCING NEW TABLE AS novos
+            FOR EACH STATEMENT EXECUTE FUNCTION revisar_carrinhos_itens();
+        CREATE TRIGGER carrinho_item_revisao_update AFTER UPDATE ON carrinho_item
+            REFERENCING NEW TABLE AS novos
+            FOR EACH STATEMENT EXECUTE FUNCTION revisar_carrinhos_itens();
+        CREATE TRIGGER carrinho_item_revisao_delete AFTER DELETE ON carrinho_item
+            REFERENCING OLD TABLE AS antigos
+            FOR EACH STATEMENT EXECUTE FUNCTION revisar_carrinhos_itens();
+
+        CREATE TRIGGER produto_revisao_carrinhos AFTER UPDATE ON produto
+            REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+            FOR EACH STATEMENT EXECUTE FUNCTION revisar_carrinhos_produtos();
+        """,
+    ),
+    # Histórico de pedidos paginado por keyset em (cliente_id, criado_em, id).
+    # O índice de histórico inclui as colunas da listagem: uma página inteira
+    # sai de um Index Only Scan, sem visitar a tabela, mesmo para clientes com
+    # milhares de pedidos. Os itens guardam nome e preço da época da compra.
+    Migration(
+        8,
+        "pedidos",
+        """
+        CREATE TABLE pedido (
+            id BIGSERIAL PRIMARY KEY,
+            cliente_id INTEGER NOT NULL REFERENCES cliente(id) ON DELETE CASCADE,
+            status TEXT NOT NULL DEFAULT 'Em Preparação'
+                CHECK (status IN ('Pendente', 'Em Preparação', 'Em Transporte',
+                                  'Entregue', 'Cancelado')),
+            subtotal NUMERIC NOT NULL,
+            frete NUMERIC NOT NULL DEFAULT 0,
+            total NUMERIC NOT NULL,
+            quantidade_itens INTEGER NOT NULL,
+            tipo_frete TEXT,
+            metodo_pagamento TEXT,
+            endereco JSONB,
+            criado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX pedido_cliente_historico_idx
+            ON pedido (cliente_id, criado_em DESC, id DESC)
+            INCLUDE (status, total, quantidade_itens);
+
+        CREATE TABLE pedido_item (
+            pedido_id BIGINT NOT NULL REFERENCES pedido(id) ON DELETE CASCADE,
+            linha SMALLINT NOT NULL,
+            produto_id INTEGER REFERENCES produto(id) ON DELETE SET NULL,
+            nome TEXT NOT NULL,
+            preco_unitario NUMERIC NOT NULL,
+            quantidade INTEGER NOT NULL CHECK (quantidade > 0),
+            PRIMARY KEY (pedido_id, linha)
+        );
+        CREATE INDEX pedido_item_produto_idx ON pedido_item (produto_id);
+        """,
+    ),
+    # Rollups de vendas (por hora e por dia; totais e por produto) para o
+    # dashboard, que passa a ler só estas tabelas em vez de agregar o histórico.
+    # - Mantidos pelos triggers de INSERT em pedido/pedido_item, na mesma
+    #   transação do checkout: nunca ficam atrás dos dados brutos.
+    # - Cada período tem até 16 linhas ("fatias", escolhidas pelo backend da
+    #   conexão): checkouts simultâneos não disputam o lock da mesma linha. A
+    #   leitura soma as fatias; o job compactar_vendas junta as de períodos
+    #   fechados e apaga as linhas por hora antigas.
+    # - Dias no fuso da loja (America/Sao_Paulo); horas inteiras, que valem
+    #   para qualquer fuso de sessão.
+    # - reconstruir_vendas(de, ate) refaz os rollups a partir dos pedidos
+    #   (carga inicial aqui e conferência/reparo pelo job).
+    Migration(
+        9,
+        "rollups de vendas",
+        """
+        CREATE FUNCTION hora_venda(TIMESTAMPTZ) RETURNS TIMESTAMPTZ
+        LANGUAGE sql IMMUTABLE AS $$ SELECT date_trunc('hour', $1, 'America/Sao_Paulo') $$;
+
+        CREATE FUNCTION dia_venda(TIMESTAMPTZ) RETURNS DATE
+        LANGUAGE sql IMMUTABLE AS $$ SELECT ($1 AT TIME ZONE 'America/Sao_Paulo')::date $$;
+
+        CREATE TABLE venda_hora (
+            hora TIMESTAMPTZ NOT NULL,
+            fatia SMALLINT NOT NULL,
+            pedidos INTEGER NOT NULL,
+            itens INTEGER NOT NULL,
+            receita NUMERIC NOT NULL,
+            frete NUMERIC NOT NULL,
+            PRIMARY KEY (hora, fatia)
+        );
+        CREATE TABLE venda_dia (
+            dia DATE NOT NULL,
+            fatia SMALLINT NOT NULL,
+            pedidos INTEGER NOT NULL,
+            itens INTEGER NOT NULL,
+            receita NUMERIC NOT NULL,
+            frete NUMERIC NOT NULL,
+            PRIMARY KEY (dia, fatia)
+        );
+        -- Sem FK para produto/categoria: o histórico sobrevive à remoção
+        CREATE TABLE venda_produto_hora (
+            hora TIMESTAMPTZ NOT NULL,
+            produto_id INTEGER NOT NULL,
+            fatia SMALLINT NOT NULL,
+            categoria_id INTEGER,
+            quantidade INTEGER NOT NULL,
+            receita NUMERIC NOT NULL,
+            PRIMARY KEY (hora, produto_id, fatia)
+        );
+        CREATE TABLE venda_produto_dia (
+            dia DATE NOT NULL,
+            produto_id INTEGER NOT NULL,
+            fatia SMALLINT NOT NULL,
+            categoria_id INTEGER,
+            quantidade INTEGER NOT NULL,
+            receita NUMERIC NOT NULL,
+            PRIMARY KEY (dia, produto_id, fatia)
+        );
+
+        CREATE FUNCTION acumular_vendas_pedidos() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            f SMALLINT := pg_backend_pid() % 16;
+        BEGIN
+            -- ORDER BY: linhas travadas sempre na mesma ordem (sem deadlock)
+            INSERT INTO venda_hora AS v (hora, fatia, pedidos, itens, receita, frete)
+            SELECT hora_venda(criado_em), f, count(*), sum(quantidade_itens), sum(total), sum(frete)
+            FROM novos GROUP BY 1 ORDER BY 1
+            ON CONFLICT (hora, fatia) DO UPDATE
+            SET pedidos = v.pedidos + excluded.pedidos, itens = v.itens + excluded.itens,
+                receita = v.receita + excluded.receita, frete = v.frete + excluded.frete;
+
+            INSERT INTO venda_dia AS v (dia, fatia, pedidos, itens, receita, frete)
+            SELECT dia_venda(criado_em), f, count(*), sum(quantidade_itens), sum(total), sum(frete)
+            FROM novos GROUP BY 1 ORDER BY 1
+            ON CONFLICT (dia, fatia) DO UPDATE
+            SET pedidos = v.pedidos + excluded.pedidos, itens = v.itens + excluded.itens,
+                receita = v.receita + excluded.receita, frete = v.frete + excluded.frete;
+            RETURN NULL;
+        END
+        $$;
+
+        CREATE FUNCTION acumular_vendas_itens() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            f SMALLINT := pg_backend_pid() % 16;
+        BEGIN
+            WITH itens AS (
+                SELECT p.criado_em, n.produto_id, pr.categoria_id, n.quantidade,
+                       n.preco_unitario * n.quantidade AS receita
+                FROM novos n
+                JOIN pedido p ON p.id = n.pedido_id
+                LEFT JOIN produto pr ON pr.id = n.produto_id
+                WHERE n.produto_id IS NOT NULL
+            ), por_hora AS (
+                INSERT INTO venda_produto_hora AS v
+                    (hora, produto_id, fatia, categoria_id, quantidade, receita)
+                SELECT hora_venda(criado_em), produto_id, f, max(categoria_id), sum(quantidade),
+                       sum(receita)
+                FROM itens GROUP BY 1, 2 ORDER BY 1, 2
+                ON CONFLICT (hora, produto_id, fatia) DO UPDATE
+                SET quantidade = v.quantidade + excluded.quantidade,
+                    receita = v.receita + excluded.receita,
+                    categoria_id = COALESCE(excluded.categoria_id, v.categoria_id)
+            )
+            INSERT INTO venda_produto_dia AS v
+                (dia, produto_id, fatia, categoria_id, quantidade, receita)
+            SELECT dia_venda(criado_em), produto_id, f, max(categoria_id), sum(quantidade),
+                   sum(receita)
+            FROM itens GROUP BY 1, 2 ORDER BY 1, 2
+            ON CONFLICT (dia, produto_id, fatia) DO UPDATE
+            SET quantidade = v.quantidade + excluded.quantidade,
+                receita = v.receita + excluded.receita,
+                categoria_id = COALESCE(excluded.categoria_id, v.categoria_id);
+            RETURN NULL;
+        END
+        $$;
+
+        CREATE FUNCTION zerar_vendas() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            TRUNCATE venda_hora, venda_dia, venda_produto_hora, venda_produto_dia;
+            RETURN NULL;
+        END
+        $$;
+
+        CREATE TRIGGER pedido_vendas AFTER INSERT ON pedido
+            REFERENCING NEW TABLE AS novos
+            FOR EACH STATEMENT EXECUTE FUNCTION acumular_vendas_pedidos();
+        CREATE TRIGGER pedido_item_vendas AFTER INSERT ON pedido_item
+            REFERENCING NEW TABLE AS novos
+            FOR EACH STATEMENT EXECUTE FUNCTION acumular_vendas_itens();
+        CREATE TRIGGER pedido_zerar_vendas AFTER TRUNCATE ON pedido
+            FOR EACH STATEMENT EXECUTE FUNCTION zerar_vendas();
+
+        CREATE FUNCTION reconstruir_vendas(de DATE, ate DATE) RETURNS void
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            -- Checkouts esperam: um pedido gravado entre o DELETE e o INSERT
+            -- abaixo seria contado duas vezes
+            LOCK TABLE pedido, pedido_item IN SHARE MODE;
+
+            DELETE FROM venda_hora WHERE dia_venda(hora) BETWEEN de AND ate;
+            DELETE FROM venda_dia WHERE dia BETWEEN de AND ate;
+            DELETE FROM venda_produto_hora WHERE dia_venda(hora) BETWEEN de AND ate;
+            DELETE FROM venda_produto_dia WHERE dia BETWEEN de AND ate;
+
+            INSERT INTO venda_hora (hora, fatia, pedidos, itens, receita, frete)
+            SELECT hora_venda(criado_em), 0, count(*), sum(quantidade_itens), sum(total), sum(frete)
+            FROM pedido WHERE dia_venda(criado_em) BETWEEN de AND ate GROUP BY 1;
+
+            INSERT INTO venda_dia (dia, fatia, pedidos, itens, receita, frete)
+            SELECT dia_venda(criado_em), 0, count(*), sum(quantidade_itens), sum(total), sum(frete)
+            FROM pedido WHERE dia_venda(criado_em) BETWEEN de AND ate GROUP BY 1;
+
+            -- Categoria atual do produto (a da época da venda não fica no pedido)
+            INSERT INTO venda_produto_hora (hora, produto_id, fatia, categoria_id, quantidade, receita)
+            SELECT hora_venda(p.criado_em), i.produto_id, 0, max(pr.categoria_id), sum(i.quantidade),
+                   sum(i.preco_unitario * i.quantidade)
+            FROM pedido p
+            JOIN pedido_item i ON i.pedido_id = p.id
+            LEFT JOIN produto pr ON pr.id = i.produto_id
+            WHERE dia_venda(p.criado_em) BETWEEN de AND ate AND i.produto_id IS NOT NULL
+            GROUP BY 1, 2;
+
+            INSERT INTO venda_produto_dia (dia, produto_id, fatia, categoria_id, quantidade, receita)
+            SELECT dia_venda(hora), produto_id, 0, max(categoria_id), sum(quantidade), sum(receita)
+            FROM venda_produto_hora WHERE dia_venda(hora) BETWEEN de AND ate
+            GROUP BY 1, 2;
+        END
+        $$;
+
+        SELECT reconstruir_vendas('-infinity', 'infinity');
+        """,
+    ),
+    # Produtos relacionados pré-calculados pelo job "relacionados":
+    # - produto_copedido conta, para cada par (a, b), os pedidos com os dois; a
+    #   diagonal (a, a) é o total de pedidos do produto (normalização).
+    # - produto_relacionado guarda os top-K vizinhos de cada produto num array
+    #   (uma linha pequena por produto, lida por chave primária).
+    # - categoria_popular tem os mais vendidos de cada categoria: completa quem
+    #   tem poucas compras em comum e atende produtos criados depois do job.
+    Migration(
+        10,
+        "produtos relacionados",
+        """
+        CREATE TABLE produto_copedido (
+            a INTEGER NOT NULL,
+            b INTEGER NOT NULL,
+            pedidos INTEGER NOT NULL,
+            PRIMARY KEY (a, b)
+        );
+
+        CREATE TABLE produto_relacionado (
+            produto_id INTEGER PRIMARY KEY REFERENCES produto(id) ON DELETE CASCADE,
+            vizinhos INTEGER[] NOT NULL,
+            atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        CREATE TABLE categoria_popular (
+            categoria_id INTEGER PRIMARY KEY REFERENCES categoria(id) ON DELETE CASCADE,
+            produtos INTEGER[] NOT NULL
+        );
+
+        -- Último pedido já contado em produto_copedido
+        CREATE TABLE relacionados_estado (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            ultimo_pedido BIGINT NOT NULL
+        );
+        INSERT INTO relacionados_estado (ultimo_pedido) VALUES (0);
+
+        -- Pedidos apagados em massa: recomeça a contagem do zero
+        CREATE FUNCTION zerar_relacionados() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            TRUNCATE produto_copedido;
+            UPDATE relacionados_estado SET ultimo_pedido = 0;
+            RETURN NULL;
+        END
+        $$;
+
+        CREATE TRIGGER zerar_relacionados AFTER TRUNCATE ON pedido
+            FOR EACH STATEMENT EXECUTE FUNCTION zerar_relacionados();
+        """,
+    ),
+    # Tabela das rotas /itens, antes criada no startup do items.py. IF NOT EXISTS:
+    # bancos que já rodaram aquele app têm a tabela.
+    Migration(
+        11,
+        "tabela exemplo dos itens",
+        """
+        CREATE TABLE IF NOT EXISTS exemplo (
+            id SERIAL PRIMARY KEY,
+            nome TEXT NOT NULL
+        );
+        """,
+    ),
+    # Estoque baixo passa a ser por produto (antes era estoque < 10 fixo). O índice
+    # parcial só tem as linhas em risco: a contagem do dashboard e /estoque/alertas
+    # não varrem o catálogo. O trigger de eventos da migração 4 passa a usar o
+    # mínimo de cada linha e avisa, num NOTIFY próprio, quais produtos acabaram de
+    # ficar abaixo dele (o que já estava abaixo não gera alerta de novo).
+    Migration(
+        12,
+        "estoque mínimo por produto",
+        """
+        ALTER TABLE produto
+            ADD COLUMN estoque_minimo INTEGER NOT NULL DEFAULT 10 CHECK (estoque_minimo >= 0);
+
+        CREATE INDEX produto_estoque_baixo_idx ON produto (estoque, id)
+            WHERE estoque < estoque_minimo;
+
+        CREATE OR REPLACE FUNCTION notificar_produtos() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            n_novos BIGINT := 0;  baixo_novos BIGINT := 0;  valor_novos NUMERIC := 0;
+            n_antigos BIGINT := 0;  baixo_antigos BIGINT := 0;  valor_antigos NUMERIC := 0;
+            itens JSONB;
+            removidos JSONB;
+            payload TEXT;
+            alertas INTEGER[];
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                PERFORM pg_notify('eventos', '{"tipo": "produto", "op": "TRUNCATE"}');
+                RETURN NULL;
+            END IF;
+
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                SELECT count(*), count(*) FILTER (WHERE estoque < estoque_minimo),
+                       COALESCE(sum(preco * estoque), 0)
+                INTO n_novos, baixo_novos, valor_novos FROM novos;
+                IF n_novos <= 20 THEN
+                    SELECT jsonb_agg(jsonb_build_object(
+                        'id', id, 'nome', nome, 'preco', preco::text,
+                        'unidade', unidade, 'estoque', estoque))
+                    INTO itens FROM novos;
+                END IF;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                SELECT count(*), count(*) FILTER (WHERE estoque < estoque_minimo),
+                       COALESCE(sum(preco * estoque), 0)
+                INTO n_antigos, baixo_antigos, valor_antigos FROM antigos;
+                IF TG_OP = 'DELETE' AND n_antigos <= 20 THEN
+                    SELECT jsonb_agg(id) INTO removidos FROM antigos;
+                END IF;
+            END IF;
+
+            IF n_novos = 0 AND n_antigos = 0 THEN
+                RETURN NULL;
+            END IF;
+
+            payload := jsonb_build_object(
+                'tipo', 'produto',
+                'op', TG_OP,
+                'linhas', GREATEST(n_novos, n_antigos),
+                'delta', jsonb_build_object(
+                    'total_produtos', n_novos - n_antigos,
+                    'estoque_baixo', baixo_novos - baixo_antigos,
+                    'valor_inventario', valor_novos - valor_antigos),
+                'itens', itens,
+                'removidos', removidos)::text;
+            IF length(payload) > 7900 THEN
+                payload := (payload::jsonb || '{"itens": null}')::text;
+            END IF;
+            PERFORM pg_notify('eventos', payload);
+
+            -- Alertas novos: linhas que passaram a ficar abaixo do mínimo neste comando
+            IF TG_OP = 'INSERT' AND baixo_novos > 0 THEN
+                SELECT array_agg(id ORDER BY id) INTO alertas
+                FROM novos WHERE estoque < estoque_minimo;
+            ELSIF TG_OP = 'UPDATE' AND baixo_novos > 0 THEN
+                SELECT array_agg(n.id ORDER BY n.id) INTO alertas
+                FROM novos n JOIN antigos a ON a.id = n.id
+                WHERE n.estoque < n.estoque_minimo AND a.estoque >= a.estoque_minimo;
+            END IF;
+            IF alertas IS NOT NULL THEN
+                SELECT jsonb_agg(jsonb_build_object(
+                    'id', id, 'nome', nome, 'estoque', estoque,
+                    'estoque_minimo', estoque_minimo) ORDER BY id)
+                INTO itens FROM novos WHERE id = ANY (alertas[1:20]);
+                payload := jsonb_build_object(
+                    'tipo', 'estoque_alerta',
+                    'total', cardinality(alertas),
+                    'itens', itens)::text;
+                IF length(payload) > 7900 THEN
+                    payload := (payload::jsonb || '{"itens": null}')::text;
+                END IF;
+                PERFORM pg_notify('eventos', payload);
+            END IF;
+            RETURN NULL;
+        END
+        $$;
+        """,
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def current_version(conn: asyncpg.Connection) -> int:
+    """Retorna a versão do schema (0 se a tabela schema_version ainda não existe)."""
+    try:
+        return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def migrate(conn: asyncpg.Connection, target: int | None = None) -> list[int]:
+    """
+    Aplica as migrações pendentes até ``target`` (por padrão, a mais recente).
+    Retorna a lista de versões aplicadas por este processo.
+    """
+    target = LATEST_VERSION if target is None else target
+
+    # Caminho rápido: banco já atualizado, uma única consulta
+    if await current_version(conn) >= target:
+        return []
+
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+    try:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                descricao TEXT NOT NULL,
+                aplicada_em TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """
+        )
+        # Outro processo pode ter migrado enquanto esperávamos o lock
+        atual = await current_version(conn)
+
+        aplicadas = []
+        for migration in MIGRATIONS:
+            if migration.version <= atual or migration.version > target:
+                continue
+            async with conn.transaction():
+                await conn.execute(migration.sql)
+                await conn.execute(
+                    "INSERT INTO schema_version (version, descricao) VALUES ($1, $2)",
+                    migration.version,
+                    migration.descricao,
+                )
+            print(f"Migração {migration.version} aplicada: {migration.descricao}")
+            aplicadas.append(migration.version)
+        return aplicadas
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+
+
+async def migrate_pool(pool: asyncpg.pool.Pool) -> list[int]:
+    """Atalho usado no startup da aplicação: migra usando uma conexão do pool."""
+    async with pool.acquire() as conn:
+        return await migrate(conn)
+
+
+async def _main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Aplica as migrações do banco de dados.")
+    parser.add_argument("--status", action="store_true", help="apenas mostra a versão atual")
+    parser.add_argument("--target", type=int, default=None, help="versão alvo (padrão: última)")
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    args = parser.parse_args(argv)
+
+    conn = await asyncpg.connect(args.database_url)
+    try:
+        if args.status:
+            print(f"Versão atual: {await current_version(conn)} (última: {LATEST_VERSION})")
+            return
+        aplicadas = await migrate(conn, args.target)
+        if not aplicadas:
+            print("Banco já está atualizado.")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,55 @@
+"""
+Pool de conexões Redis compartilhado pelo processo: sessões (login e cadastro)
+e o L2 do cache do catálogo.
+
+Cada ``redis.from_url`` criava um pool próprio, sem limite de conexões, sem
+timeouts e sem verificação de conexões ociosas. Aqui há um pool por processo:
+
+- ``BlockingConnectionPool`` com ``REDIS_MAX_CONNECTIONS``: num pico, a
+  requisição espera uma conexão livre (até ``REDIS_POOL_TIMEOUT_S``) em vez de
+  abrir conexões sem limite contra o Redis.
+- ``health_check_interval``: conexão parada há mais que isso recebe um PING
+  antes de ser usada (derrubada por NAT/firewall é detectada antes do comando).
+- Timeouts curtos e uma nova tentativa com backoff em erro de conexão. Os
+  comandos daqui levam menos de 1 ms; o timeout só precisa detectar um Redis
+  travado rápido (o cache desliga o L2 na primeira falha).
+
+Os clientes devolvidos por ``cliente()`` são leves e podem ficar em variáveis
+de módulo; todos usam o mesmo pool. As respostas vêm em ``bytes`` (o cache
+guarda binário; ``json.loads`` aceita bytes).
+"""
+
+import os
+
+import redis.asyncio as redis
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "20"))
+REDIS_POOL_TIMEOUT_S = float(os.getenv("REDIS_POOL_TIMEOUT_S", "2.0"))
+REDIS_SOCKET_TIMEOUT_S = float(os.getenv("REDIS_SOCKET_TIMEOUT_S", "0.25"))
+REDIS_HEALTH_CHECK_S = int(os.getenv("REDIS_HEALTH_CHECK_S", "30"))
+
+pool = redis.BlockingConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_POOL_TIMEOUT_S,
+    socket_timeout=REDIS_SOCKET_TIMEOUT_S,
+    socket_connect_timeout=REDIS_SOCKET_TIMEOUT_S,
+    socket_keepalive=True,
+    health_check_interval=REDIS_HEALTH_CHECK_S,
+    retry=Retry(ExponentialBackoff(cap=0.2, base=0.02), retries=1),
+    retry_on_error=[ConnectionError, TimeoutError],
+)
+
+
+def cliente() -> redis.Redis:
+    """Cliente sobre o pool compartilhado."""
+    return redis.Redis(connection_pool=pool)
+
+
+async def fechar():
+    """Fecha as conexões do pool (shutdown da aplicação)."""
+    await pool.disconnect()
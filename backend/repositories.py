@@ -1,6 +1,237 @@
+import json
+from datetime import date
+from decimal import Decimal
+from typing import NamedTuple
+
 import asyncpg
 
-from schemas import CategoriaIn, ProdutoIn, ProdutoUpdate
+from schemas import AjusteProdutosIn, CategoriaIn, ProdutoFiltro, ProdutoIn, ProdutoUpdate
+from timing import medir
+
+# Consultas pontuais mais frequentes. O texto precisa ser idêntico ao usado nos
+# repositórios para aproveitar o cache de prepared statements do asyncpg.
+SQL_CATEGORIA_EXISTE = "SELECT 1 FROM categoria WHERE id=$1"
+SQL_PRODUTO_POR_ID = "SELECT * FROM produto WHERE id=$1"
+SQL_CLIENTE_POR_EMAIL = "SELECT * FROM cliente WHERE email=$1"
+SQL_CATALOGO_VERSAO = "SELECT versao FROM catalogo_versao"
+SQL_CARRINHO_REVISAO = "SELECT revisao FROM carrinho WHERE cliente_id=$1"
+
+# Pré-preparadas em cada conexão do pool durante o warm-up (ver Database.warm_up).
+# Os argumentos não casam com nenhuma linha: só o plano fica em cache.
+HOT_STATEMENTS: list[tuple[str, tuple]] = [
+    (SQL_CATEGORIA_EXISTE, (0,)),
+    (SQL_PRODUTO_POR_ID, (0,)),
+    (SQL_CLIENTE_POR_EMAIL, ("",)),
+    (SQL_CATALOGO_VERSAO, ()),
+    (SQL_CARRINHO_REVISAO, (0,)),
+]
+
+
+# Listagem do catálogo; o export usa a mesma consulta num cursor
+SQL_LISTAGEM = """
+    SELECT p.id, p.nome, p.preco::text AS preco, p.unidade, p.estoque,
+           c.id AS categoria_id, c.nome AS categoria_nome
+    FROM produto p
+    LEFT JOIN categoria c ON p.categoria_id = c.id
+    {where}
+    ORDER BY p.id
+"""
+
+# Catálogo inteiro para o snapshot compartilhado (snapshot.py)
+SQL_SNAPSHOT_PRODUTOS = """
+    SELECT id, nome, preco::text AS preco, unidade, estoque, categoria_id, versao, estoque_minimo
+    FROM produto
+    ORDER BY id
+"""
+
+# Produtos abaixo do estoque mínimo, os mais críticos primeiro. Os dois filtros
+# repetem o predicado do índice parcial da migração 12: só as linhas em risco são lidas.
+SQL_ALERTAS_ESTOQUE = """
+    SELECT p.id, p.nome, p.estoque, p.estoque_minimo, p.unidade, c.nome AS categoria_nome
+    FROM produto p
+    LEFT JOIN categoria c ON p.categoria_id = c.id
+    WHERE p.estoque < p.estoque_minimo
+    ORDER BY p.estoque, p.id
+    LIMIT $1
+"""
+SQL_CONTAR_ESTOQUE_BAIXO = "SELECT count(*) FROM produto WHERE estoque < estoque_minimo"
+
+# Ajuste em massa (preço ou estoque): "ajuste" tem os valores antes e depois de
+# cada produto; o resumo é o mesmo na prévia e em cada lote aplicado
+SQL_AJUSTE_RESUMO = (
+    "SELECT count(*) AS produtos, max(id) AS ultimo_id, count(*) FILTER ("
+    "WHERE preco_antes <> preco_depois OR estoque_antes <> estoque_depois) AS alterados, "
+    + ", ".join(
+        f"sum(preco_{m}) AS preco_soma_{m}, min(preco_{m}) AS preco_min_{m}, "
+        f"max(preco_{m}) AS preco_max_{m}, sum(estoque_{m}) AS estoque_soma_{m}, "
+        f"count(*) FILTER (WHERE estoque_{m} = 0) AS sem_estoque_{m}"
+        for m in ("antes", "depois")
+    )
+    + " FROM ajuste"
+)
+
+SQL_AJUSTE_PREVIA = """
+    WITH ajuste AS (
+        SELECT p.id, p.preco AS preco_antes, {preco} AS preco_depois,
+               p.estoque AS estoque_antes, {estoque} AS estoque_depois
+        FROM produto p
+        {where}
+    )
+"""
+
+# Um lote por comando: os locks duram só o UPDATE dos ``limite`` produtos.
+# A ordem por id é a mesma em todos os lotes (sem deadlock entre dois ajustes).
+SQL_AJUSTE_LOTE = """
+    WITH alvo AS (
+        SELECT p.id, p.preco, p.estoque
+        FROM produto p
+        {where}
+        ORDER BY p.id
+        LIMIT {limite}
+        FOR UPDATE
+    ), ajuste AS (
+        UPDATE produto p SET {coluna} = {expressao}
+        FROM alvo
+        WHERE p.id = alvo.id
+        RETURNING p.id, alvo.preco AS preco_antes, p.preco AS preco_depois,
+                  alvo.estoque AS estoque_antes, p.estoque AS estoque_depois
+    )
+"""
+
+SQL_PRODUTOS_ALTERADOS = """
+    SELECT p.id, p.nome, p.preco::text AS preco, p.unidade, p.estoque,
+           c.id AS categoria_id, c.nome AS categoria_nome, p.versao
+    FROM produto p
+    LEFT JOIN categoria c ON p.categoria_id = c.id
+    WHERE p.versao > $1
+    ORDER BY p.versao
+    LIMIT $2
+"""
+SQL_CATEGORIAS_ALTERADAS = """
+    SELECT id, nome, versao FROM categoria WHERE versao > $1 ORDER BY versao LIMIT $2
+"""
+# Lápide de um id que voltou a existir (ids reaproveitados) não vale mais
+SQL_PRODUTOS_REMOVIDOS = """
+    SELECT r.id, r.versao FROM produto_removido r
+    WHERE r.versao > $1 AND NOT EXISTS (SELECT 1 FROM produto p WHERE p.id = r.id)
+    ORDER BY r.versao
+    LIMIT $2
+"""
+
+# Só colunas do índice pedido_cliente_historico_idx (Index Only Scan)
+_SQL_PEDIDOS = """
+    SELECT id, criado_em, status, total::text AS total, quantidade_itens
+    FROM pedido
+    WHERE cliente_id = $1 {apos}
+    ORDER BY criado_em DESC, id DESC
+    LIMIT $2
+"""
+SQL_PEDIDOS_PRIMEIRA_PAGINA = _SQL_PEDIDOS.format(apos="")
+SQL_PEDIDOS_PAGINA = _SQL_PEDIDOS.format(apos="AND (criado_em, id) < ($3, $4)")
+
+
+class RollupVendas(NamedTuple):
+    totais: str  # tabela de totais do período
+    produtos: str  # tabela por produto
+    periodo: str  # coluna do período
+    tipo: str
+    primeiro: str  # expressões SQL do primeiro e do último período da faixa
+    ultimo: str
+    passo: str
+
+
+ROLLUPS_VENDAS = {
+    "hora": RollupVendas(
+        "venda_hora",
+        "venda_produto_hora",
+        "hora",
+        "timestamptz",
+        "hora_venda($1)",
+        "hora_venda($2)",
+        "1 hour",
+    ),
+    "dia": RollupVendas(
+        "venda_dia", "venda_produto_dia", "dia", "date", "$1::date", "$2::date", "1 day"
+    ),
+}
+# Linhas por hora mais antigas que isso são apagadas pelo job compactar_vendas
+RETENCAO_VENDAS_HORA_DIAS = 90
+
+# Produtos relacionados: vizinhos guardados por produto e suavização do cosseno
+# (peso n / (n + SUAVIZACAO) para n compras em comum: um par visto uma vez só
+# não passa na frente dos frequentes)
+RELACIONADOS_K = 20
+RELACIONADOS_SUAVIZACAO = 5
+RELACIONADOS_LOCK_ID = 8_244_044
+
+# Junta as fatias de períodos fechados na fatia 0. DELETE ... RETURNING e INSERT
+# no mesmo comando: uma venda atrasada gravada durante a compactação cai numa
+# fatia nova e continua sendo somada na leitura. Uma hora de folga no corte: o
+# criado_em de um checkout é o início da transação dele.
+_SQL_JUNTAR_TOTAIS = """
+    WITH movidas AS (
+        DELETE FROM {tabela}
+        WHERE {periodo} < {periodo}_venda(now() - interval '1 hour') AND fatia <> 0
+        RETURNING {periodo}, pedidos, itens, receita, frete
+    )
+    INSERT INTO {tabela} AS v ({periodo}, fatia, pedidos, itens, receita, frete)
+    SELECT {periodo}, 0, sum(pedidos), sum(itens), sum(receita), sum(frete)
+    FROM movidas GROUP BY {periodo}
+    ON CONFLICT ({periodo}, fatia) DO UPDATE
+    SET pedidos = v.pedidos + excluded.pedidos, itens = v.itens + excluded.itens,
+        receita = v.receita + excluded.receita, frete = v.frete + excluded.frete
+"""
+_SQL_JUNTAR_PRODUTOS = """
+    WITH movidas AS (
+        DELETE FROM {tabela}
+        WHERE {periodo} < {periodo}_venda(now() - interval '1 hour') AND fatia <> 0
+        RETURNING {periodo}, produto_id, categoria_id, quantidade, receita
+    )
+    INSERT INTO {tabela} AS v ({periodo}, produto_id, fatia, categoria_id, quantidade, receita)
+    SELECT {periodo}, produto_id, 0, max(categoria_id), sum(quantidade), sum(receita)
+    FROM movidas GROUP BY {periodo}, produto_id
+    ON CONFLICT ({periodo}, produto_id, fatia) DO UPDATE
+    SET quantidade = v.quantidade + excluded.quantidade, receita = v.receita + excluded.receita,
+        categoria_id = COALESCE(v.categoria_id, excluded.categoria_id)
+"""
+
+
+def filtro_sql(filtro: ProdutoFiltro | None) -> tuple[str, list]:
+    """Cláusula WHERE (parametrizada) da listagem de produtos."""
+    if filtro is None:
+        return "", []
+    condicoes, args = [], []
+
+    def param(valor) -> str:
+        args.append(valor)
+        return f"${len(args)}"
+
+    if filtro.categoria_id is not None:
+        condicoes.append(f"p.categoria_id = {param(filtro.categoria_id)}")
+    if filtro.busca:
+        condicoes.append(f"p.nome ILIKE '%' || {param(filtro.busca)} || '%'")
+    if filtro.preco_min is not None:
+        condicoes.append(f"p.preco >= {param(filtro.preco_min)}")
+    if filtro.preco_max is not None:
+        condicoes.append(f"p.preco <= {param(filtro.preco_max)}")
+    if filtro.em_estoque is not None:
+        condicoes.append("p.estoque > 0" if filtro.em_estoque else "p.estoque = 0")
+    if not condicoes:
+        return "", []
+    return "WHERE " + " AND ".join(condicoes), args
+
+
+def ajuste_sql(ajuste: AjusteProdutosIn, args: list) -> tuple[str, str]:
+    """Coluna alterada e expressão do valor novo (sobre ``p``); o parâmetro vai para ``args``."""
+    # Decimal pelo texto: o float iria para o NUMERIC com a expansão binária inteira
+    if ajuste.preco_percentual is not None:
+        args.append(Decimal(str(ajuste.preco_percentual)))
+        return "preco", f"round(p.preco * (1 + ${len(args)}::numeric / 100), 2)"
+    if ajuste.preco_delta is not None:
+        args.append(Decimal(str(ajuste.preco_delta)))
+        return "preco", f"GREATEST(p.preco + ${len(args)}::numeric, 0)"
+    args.append(ajuste.estoque_delta)
+    return "estoque", f"GREATEST(p.estoque + ${len(args)}::int, 0)"
 
 
 class CategoriaRepository:
@@ -15,10 +246,11 @@ class CategoriaRepository:
 
     async def list_all(self):
         rows = await self.conn.fetch("SELECT id, nome FROM categoria ORDER BY nome")
-        return [dict(r) for r in rows]
+        with medir("conversao"):
+            return [dict(r) for r in rows]
 
     async def exists_by_id(self, cat_id: int) -> bool:
-        return await self.conn.fetchval("SELECT 1 FROM categoria WHERE id=$1", cat_id)
+        return await self.conn.fetchval(SQL_CATEGORIA_EXISTE, cat_id)
 
 
 class ProdutoRepository:
@@ -27,29 +259,77 @@ class ProdutoRepository:
 
     async def create(self, p: ProdutoIn) -> int:
         row = await self.conn.fetchrow(
-            "INSERT INTO produto (nome, preco, unidade, categoria_id, estoque) VALUES ($1, $2, $3, $4, $5) RETURNING id",
+            "INSERT INTO produto (nome, preco, unidade, categoria_id, estoque, estoque_minimo) VALUES ($1, $2, $3, $4, $5, $6) RETURNING id",
             p.nome,
             p.preco,
             p.unidade,
             p.categoria_id,
             p.estoque,
+            p.estoque_minimo,
         )
         return row["id"]
 
-    async def list_all(self):
-        rows = await self.conn.fetch(
-            """
-            SELECT p.id, p.nome, p.preco::text AS preco, p.unidade, p.estoque,
-                   c.id AS categoria_id, c.nome AS categoria_nome
-            FROM produto p
-            LEFT JOIN categoria c ON p.categoria_id = c.id
-            ORDER BY p.id
-        """
+    async def list_all(self, filtro: ProdutoFiltro | None = None):
+        where, args = filtro_sql(filtro)
+        rows = await self.conn.fetch(SQL_LISTAGEM.format(where=where), *args)
+        with medir("conversao"):
+            return [dict(r) for r in rows]
+
+    async def prever_ajuste(self, ajuste: AjusteProdutosIn) -> asyncpg.Record:
+        """Resumo do ajuste sem alterar nada (dry-run)."""
+        where, args = filtro_sql(ajuste.filtro)
+        coluna, expressao = ajuste_sql(ajuste, args)
+        valores = {"preco": "p.preco", "estoque": "p.estoque", coluna: expressao}
+        sql = SQL_AJUSTE_PREVIA.format(where=where, **valores) + SQL_AJUSTE_RESUMO
+        return await self.conn.fetchrow(sql, *args)
+
+    async def ajustar_lote(self, ajuste: AjusteProdutosIn, apos_id: int, limite: int):
+        """Aplica o ajuste aos próximos ``limite`` produtos do filtro com id > ``apos_id``."""
+        where, args = filtro_sql(ajuste.filtro)
+        args.append(apos_id)
+        depois_de = f"p.id > ${len(args)}"
+        where = f"{where} AND {depois_de}" if where else f"WHERE {depois_de}"
+        coluna, expressao = ajuste_sql(ajuste, args)
+        args.append(limite)
+        sql = SQL_AJUSTE_LOTE.format(
+            where=where, limite=f"${len(args)}", coluna=coluna, expressao=expressao
         )
-        return [dict(r) for r in rows]
+        return await self.conn.fetchrow(sql + SQL_AJUSTE_RESUMO, *args)
+
+    async def alertas_estoque(self, limite: int) -> dict:
+        """Quantos produtos estão abaixo do mínimo e os ``limite`` mais críticos."""
+        total = await self.conn.fetchval(SQL_CONTAR_ESTOQUE_BAIXO)
+        rows = await self.conn.fetch(SQL_ALERTAS_ESTOQUE, limite)
+        with medir("conversao"):
+            return {"total": total, "itens": [dict(r) for r in rows]}
+
+    async def list_snapshot(self):
+        """Produtos para o snapshot do catálogo (registros, sem conversão para dict)."""
+        return await self.conn.fetch(SQL_SNAPSHOT_PRODUTOS)
 
     async def get_by_id(self, pid: int):
-        return await self.conn.fetchrow("SELECT * FROM produto WHERE id=$1", pid)
+        return await self.conn.fetchrow(SQL_PRODUTO_POR_ID, pid)
+
+    async def list_names(self):
+        """Só (id, nome) de todo o catálogo, para índices em memória."""
+        return await self.conn.fetch("SELECT id, nome FROM produto")
+
+    async def catalog_version(self) -> int:
+        """Versão do catálogo, incrementada por trigger a cada escrita em produto/categoria."""
+        return await self.conn.fetchval(SQL_CATALOGO_VERSAO)
+
+    async def changes(self, since: int, limite: int) -> dict:
+        """
+        Alterações com versão maior que ``since`` (no máximo ``limite`` de cada
+        tipo), pelos índices em ``versao``. Chamar dentro de uma transação
+        REPEATABLE READ para que as três consultas vejam o mesmo snapshot.
+        """
+        return {
+            "sync_minimo": await self.conn.fetchval("SELECT sync_minimo FROM catalogo_versao"),
+            "produtos": await self.conn.fetch(SQL_PRODUTOS_ALTERADOS, since, limite),
+            "categorias": await self.conn.fetch(SQL_CATEGORIAS_ALTERADAS, since, limite),
+            "removidos": await self.conn.fetch(SQL_PRODUTOS_REMOVIDOS, since, limite),
+        }
 
     async def delete(self, pid: int) -> bool:
         res = await self.conn.execute("DELETE FROM produto WHERE id=$1", pid)
@@ -79,6 +359,10 @@ class ProdutoRepository:
             cols.append(f"estoque = ${idx}")
             vals.append(u.estoque)
             idx += 1
+        if u.estoque_minimo is not None:
+            cols.append(f"estoque_minimo = ${idx}")
+            vals.append(u.estoque_minimo)
+            idx += 1
 
         if not cols:
             return await self.get_by_id(pid)
@@ -102,4 +386,509 @@ class ClienteRepository:
         return row["id"]
 
     async def get_by_email(self, email: str):
-        return await self.conn.fetchrow("SELECT * FROM cliente WHERE email=$1", email)
+        return await self.conn.fetchrow(SQL_CLIENTE_POR_EMAIL, email)
+
+
+class CarrinhoRepository:
+    def __init__(self, conn: asyncpg.Connection):
+        self.conn = conn
+
+    async def revisao(self, cliente_id: int) -> int:
+        """Revisão do carrinho (0 se o cliente nunca usou o carrinho)."""
+        return await self.conn.fetchval(SQL_CARRINHO_REVISAO, cliente_id) or 0
+
+    async def itens_precificados(self, cliente_id: int):
+        # Uma consulta só: preço, estoque, subtotais e total do carrinho inteiro
+        return await self.conn.fetch(
+            """
+            SELECT p.id AS produto_id, p.nome, p.preco::text AS preco, p.unidade, p.estoque,
+                   ci.quantidade,
+                   (p.preco * ci.quantidade)::text AS subtotal,
+                   p.estoque >= ci.quantidade AS disponivel,
+                   (sum(p.preco * ci.quantidade) OVER ())::text AS total
+            FROM carrinho_item ci
+            JOIN produto p ON p.id = ci.produto_id
+            WHERE ci.cliente_id = $1
+            ORDER BY ci.adicionado_em, p.id
+        """,
+            cliente_id,
+        )
+
+    async def definir(self, cliente_id: int, produto_id: int, quantidade: int):
+        await self.conn.execute(
+            """
+            INSERT INTO carrinho_item (cliente_id, produto_id, quantidade) VALUES ($1, $2, $3)
+            ON CONFLICT (cliente_id, produto_id) DO UPDATE SET quantidade = EXCLUDED.quantidade
+        """,
+            cliente_id,
+            produto_id,
+            quantidade,
+        )
+
+    async def remover(self, cliente_id: int, produto_id: int) -> bool:
+        res = await self.conn.execute(
+            "DELETE FROM carrinho_item WHERE cliente_id=$1 AND produto_id=$2",
+            cliente_id,
+            produto_id,
+        )
+        return not res.endswith(" 0")
+
+    async def limpar(self, cliente_id: int):
+        await self.conn.execute("DELETE FROM carrinho_item WHERE cliente_id=$1", cliente_id)
+
+
+class ListaDesejoRepository:
+    def __init__(self, conn: asyncpg.Connection):
+        self.conn = conn
+
+    async def itens(self, cliente_id: int):
+        return await self.conn.fetch(
+            """
+            SELECT p.id AS produto_id, p.nome, p.preco::text AS preco, p.unidade, p.estoque,
+                   ld.adicionado_em
+            FROM lista_desejo_item ld
+            JOIN produto p ON p.id = ld.produto_id
+            WHERE ld.cliente_id = $1
+            ORDER BY ld.adicionado_em DESC, p.id
+        """,
+            cliente_id,
+        )
+
+    async def adicionar(self, cliente_id: int, produto_id: int):
+        await self.conn.execute(
+            """
+            INSERT INTO lista_desejo_item (cliente_id, produto_id) VALUES ($1, $2)
+            ON CONFLICT (cliente_id, produto_id) DO NOTHING
+        """,
+            cliente_id,
+            produto_id,
+        )
+
+    async def remover(self, cliente_id: int, produto_id: int) -> bool:
+        res = await self.conn.execute(
+            "DELETE FROM lista_desejo_item WHERE cliente_id=$1 AND produto_id=$2",
+            cliente_id,
+            produto_id,
+        )
+        return not res.endswith(" 0")
+
+
+class PedidoRepository:
+    def __init__(self, conn: asyncpg.Connection):
+        self.conn = conn
+
+    async def travar_carrinho(self, cliente_id: int):
+        """Itens do carrinho com as linhas de produto travadas (em ordem de id: sem deadlock)."""
+        return await self.conn.fetch(
+            """
+            SELECT p.id AS produto_id, p.nome, p.preco, p.estoque, ci.quantidade
+            FROM carrinho_item ci
+            JOIN produto p ON p.id = ci.produto_id
+            WHERE ci.cliente_id = $1
+            ORDER BY p.id
+            FOR UPDATE
+        """,
+            cliente_id,
+        )
+
+    async def baixar_estoque(self, produto_ids: list[int], quantidades: list[int]):
+        await self.conn.execute(
+            """
+            UPDATE produto p SET estoque = p.estoque - b.quantidade
+            FROM unnest($1::int[], $2::int[]) AS b (id, quantidade)
+            WHERE p.id = b.id
+        """,
+            produto_ids,
+            quantidades,
+        )
+
+    async def create(
+        self,
+        cliente_id: int,
+        itens: list,
+        subtotal,
+        frete,
+        tipo_frete: str,
+        metodo_pagamento: str,
+        endereco: dict,
+    ):
+        pedido = await self.conn.fetchrow(
+            """
+            INSERT INTO pedido (cliente_id, subtotal, frete, total, quantidade_itens,
+                                tipo_frete, metodo_pagamento, endereco)
+            VALUES ($1, $2, $3, $2::numeric + $3::numeric, $4, $5, $6, $7::jsonb)
+            RETURNING id, criado_em
+        """,
+            cliente_id,
+            subtotal,
+            frete,
+            sum(i["quantidade"] for i in itens),
+            tipo_frete,
+            metodo_pagamento,
+            json.dumps(endereco),
+        )
+        await self.conn.execute(
+            """
+            INSERT INTO pedido_item (pedido_id, linha, produto_id, nome, preco_unitario, quantidade)
+            SELECT $1, i.linha, i.produto_id, i.nome, i.preco, i.quantidade
+            FROM unnest($2::int[], $3::text[], $4::numeric[], $5::int[])
+                 WITH ORDINALITY AS i (produto_id, nome, preco, quantidade, linha)
+        """,
+            pedido["id"],
+            [i["produto_id"] for i in itens],
+            [i["nome"] for i in itens],
+            [i["preco"] for i in itens],
+            [i["quantidade"] for i in itens],
+        )
+        return pedido
+
+    async def list_by_cliente(self, cliente_id: int, limite: int, apos: tuple | None = None):
+        """
+        Página do histórico, do mais recente para o mais antigo. ``apos`` é o
+        (criado_em, id) do último pedido da página anterior (keyset).
+        """
+        if apos is None:
+            return await self.conn.fetch(SQL_PEDIDOS_PRIMEIRA_PAGINA, cliente_id, limite)
+        return await self.conn.fetch(SQL_PEDIDOS_PAGINA, cliente_id, limite, *apos)
+
+    async def get(self, cliente_id: int, pedido_id: int):
+        return await self.conn.fetchrow(
+            """
+            SELECT id, cliente_id, criado_em, status, subtotal::text AS subtotal,
+                   frete::text AS frete, total::text AS total, quantidade_itens,
+                   tipo_frete, metodo_pagamento, endereco
+            FROM pedido WHERE id = $1 AND cliente_id = $2
+        """,
+            pedido_id,
+            cliente_id,
+        )
+
+    async def itens_de(self, pedido_ids: list[int]):
+        """Itens de vários pedidos numa consulta só (uma por página)."""
+        return await self.conn.fetch(
+            """
+            SELECT pedido_id, produto_id, nome, preco_unitario::text AS preco_unitario,
+                   quantidade
+            FROM pedido_item
+            WHERE pedido_id = ANY($1::bigint[])
+            ORDER BY pedido_id, linha
+        """,
+            pedido_ids,
+        )
+
+
+class DashboardRepository:
+    def __init__(self, conn: asyncpg.Connection):
+        self.conn = conn
+
+    async def stats(self) -> dict:
+        # 1. Total de Produtos
+        total_produtos = await self.conn.fetchval("SELECT COUNT(*) FROM produto")
+
+        # 2. Produtos com Estoque Baixo (abaixo do estoque mínimo de cada um; índice parcial)
+        estoque_baixo = await self.conn.fetchval(SQL_CONTAR_ESTOQUE_BAIXO)
+
+        # 3. Valor Total do Inventário (Soma de preço * estoque)
+        # O COALESCE garante que retorne 0 se a tabela estiver vazia
+        valor_inventario = await self.conn.fetchval(
+            "SELECT COALESCE(SUM(preco * estoque), 0) FROM produto"
+        )
+
+        # 4. Total de Clientes
+        total_clientes = await self.conn.fetchval("SELECT COUNT(*) FROM cliente")
+
+        return {
+            "total_produtos": total_produtos,
+            "estoque_baixo": estoque_baixo,
+            "valor_inventario": valor_inventario,
+            "total_clientes": total_clientes,
+        }
+
+
+class VendasRepository:
+    """Leituras do dashboard de vendas: só rollups, nunca pedido/pedido_item."""
+
+    def __init__(self, conn: asyncpg.Connection):
+        self.conn = conn
+
+    async def periodo_atual(self, granularidade: str):
+        return await self.conn.fetchval(f"SELECT {granularidade}_venda(now())")
+
+    async def serie(self, granularidade: str, inicio, fim):
+        """Um ponto por período de ``inicio`` a ``fim`` (inclusive), com zeros nos vazios."""
+        r = ROLLUPS_VENDAS[granularidade]
+        return await self.conn.fetch(
+            f"""
+            SELECT s.periodo::{r.tipo} AS periodo,
+                   COALESCE(v.pedidos, 0) AS pedidos, COALESCE(v.itens, 0) AS itens,
+                   COALESCE(v.receita, 0)::text AS receita, COALESCE(v.frete, 0)::text AS frete
+            FROM generate_series({r.primeiro}, {r.ultimo}, interval '{r.passo}') AS s (periodo)
+            LEFT JOIN (
+                SELECT {r.periodo}, sum(pedidos) AS pedidos, sum(itens) AS itens,
+                       sum(receita) AS receita, sum(frete) AS frete
+                FROM {r.totais}
+                WHERE {r.periodo} BETWEEN {r.primeiro} AND {r.ultimo}
+                GROUP BY {r.periodo}
+            ) v ON v.{r.periodo} = s.periodo
+            ORDER BY s.periodo
+        """,
+            inicio,
+            fim,
+        )
+
+    async def top_produtos(self, granularidade: str, inicio, fim, limite: int):
+        r = ROLLUPS_VENDAS[granularidade]
+        return await self.conn.fetch(
+            f"""
+            SELECT t.produto_id, p.nome, t.quantidade, t.receita::text AS receita
+            FROM (
+                SELECT produto_id, sum(quantidade) AS quantidade, sum(receita) AS receita
+                FROM {r.produtos}
+                WHERE {r.periodo} BETWEEN {r.primeiro} AND {r.ultimo}
+                GROUP BY produto_id
+                ORDER BY receita DESC, produto_id
+                LIMIT $3
+            ) t
+            LEFT JOIN produto p ON p.id = t.produto_id
+            ORDER BY t.receita DESC, t.produto_id
+        """,
+            inicio,
+            fim,
+            limite,
+        )
+
+    async def por_categoria(self, granularidade: str, inicio, fim):
+        r = ROLLUPS_VENDAS[granularidade]
+        return await self.conn.fetch(
+            f"""
+            SELECT t.categoria_id, c.nome, t.quantidade, t.receita::text AS receita
+            FROM (
+                SELECT categoria_id, sum(quantidade) AS quantidade, sum(receita) AS receita
+                FROM {r.produtos}
+                WHERE {r.periodo} BETWEEN {r.primeiro} AND {r.ultimo}
+                GROUP BY categoria_id
+            ) t
+            LEFT JOIN categoria c ON c.id = t.categoria_id
+            ORDER BY t.receita DESC
+        """,
+            inicio,
+            fim,
+        )
+
+    async def compactar(self, retencao_dias: int = RETENCAO_VENDAS_HORA_DIAS) -> dict:
+        """Junta as fatias dos períodos fechados e apaga as linhas por hora antigas."""
+        linhas = {}
+        for tabela, sql in (
+            ("venda_hora", _SQL_JUNTAR_TOTAIS),
+            ("venda_dia", _SQL_JUNTAR_TOTAIS),
+            ("venda_produto_hora", _SQL_JUNTAR_PRODUTOS),
+            ("venda_produto_dia", _SQL_JUNTAR_PRODUTOS),
+        ):
+            periodo = tabela.rsplit("_", 1)[1]
+            status = await self.conn.execute(sql.format(tabela=tabela, periodo=periodo))
+            linhas[tabela] = int(status.split()[-1])
+
+        apagadas = 0
+        for tabela in ("venda_hora", "venda_produto_hora"):
+            status = await self.conn.execute(
+                f"DELETE FROM {tabela} WHERE hora < now() - make_interval(days => $1)",
+                retencao_dias,
+            )
+            apagadas += int(status.split()[-1])
+        return {"fatias_juntadas": linhas, "linhas_hora_apagadas": apagadas}
+
+    async def conferir(self, de: date, ate: date) -> list[date]:
+        """Dias em que o rollup diário diverge dos pedidos (sem índice por data: varre pedido)."""
+        rows = await self.conn.fetch(
+            """
+            SELECT COALESCE(b.dia, r.dia) AS dia
+            FROM (
+                SELECT dia_venda(criado_em) AS dia, count(*) AS pedidos, sum(total) AS receita,
+                       sum(quantidade_itens) AS itens
+                FROM pedido
+                WHERE criado_em >= $1::date - 1 AND criado_em < $2::date + 2
+                GROUP BY 1
+            ) b
+            FULL JOIN (
+                SELECT dia, sum(pedidos) AS pedidos, sum(receita) AS receita, sum(itens) AS itens
+                FROM venda_dia WHERE dia BETWEEN $1 AND $2 GROUP BY dia
+            ) r ON r.dia = b.dia
+            WHERE COALESCE(b.dia, r.dia) BETWEEN $1 AND $2
+              AND (b.pedidos, b.receita, b.itens) IS DISTINCT FROM (r.pedidos, r.receita, r.itens)
+            ORDER BY 1
+        """,
+            de,
+            ate,
+        )
+        return [row["dia"] for row in rows]
+
+    async def reconstruir(self, de: date, ate: date):
+        """Refaz os rollups dos dias ``de`` a ``ate`` a partir dos pedidos."""
+        await self.conn.execute("SELECT reconstruir_vendas($1, $2)", de, ate)
+
+
+class RelacionadosRepository:
+    """Índice de produtos relacionados (ver migração 10 e o job "relacionados")."""
+
+    def __init__(self, conn: asyncpg.Connection):
+        self.conn = conn
+
+    async def listar(self, produto_id: int, limite: int):
+        """
+        Vizinhos pré-calculados; sem eles (produto novo), os mais vendidos da
+        categoria. Uma consulta, só buscas por chave primária.
+        """
+        return await self.conn.fetch(
+            """
+            SELECT p.id, p.nome, p.preco::text AS preco, p.unidade, p.estoque, p.categoria_id
+            FROM produto alvo
+            LEFT JOIN produto_relacionado r ON r.produto_id = alvo.id
+            LEFT JOIN categoria_popular c ON c.categoria_id = alvo.categoria_id
+            CROSS JOIN LATERAL unnest(COALESCE(r.vizinhos, array_remove(c.produtos, alvo.id)))
+                 WITH ORDINALITY AS v (id, ordem)
+            JOIN produto p ON p.id = v.id
+            WHERE alvo.id = $1
+            ORDER BY v.ordem
+            LIMIT $2
+        """,
+            produto_id,
+            limite,
+        )
+
+    async def marcas(self) -> tuple[int, int]:
+        """
+        (último pedido já contado, último que pode ser contado agora). Pedidos
+        dos últimos minutos ficam para a próxima execução: um id menor ainda
+        pode estar numa transação aberta e seria pulado.
+        """
+        row = await self.conn.fetchrow(
+            """
+            SELECT e.ultimo_pedido,
+                   (SELECT max(id) FROM pedido
+                    WHERE id > e.ultimo_pedido AND criado_em < now() - interval '5 minutes') AS marca
+            FROM relacionados_estado e
+        """
+        )
+        return row["ultimo_pedido"], row["marca"] or row["ultimo_pedido"]
+
+    async def zerar(self):
+        async with self.conn.transaction():
+            await self.conn.execute("TRUNCATE produto_copedido")
+            await self.conn.execute("UPDATE relacionados_estado SET ultimo_pedido = 0")
+
+    async def contar_pedidos(self, de: int, ate: int) -> list[int]:
+        """Soma os pares dos pedidos em (de, ate] e avança a marca; retorna os produtos tocados."""
+        async with self.conn.transaction():
+            await self.conn.execute(
+                """
+                INSERT INTO produto_copedido AS c (a, b, pedidos)
+                SELECT x.produto_id, y.produto_id, count(DISTINCT x.pedido_id)
+                FROM pedido_item x
+                JOIN pedido_item y ON y.pedido_id = x.pedido_id
+                WHERE x.pedido_id > $1 AND x.pedido_id <= $2
+                  AND x.produto_id IS NOT NULL AND y.produto_id IS NOT NULL
+                GROUP BY 1, 2
+                ON CONFLICT (a, b) DO UPDATE SET pedidos = c.pedidos + excluded.pedidos
+            """,
+                de,
+                ate,
+            )
+            rows = await self.conn.fetch(
+                """
+                SELECT DISTINCT produto_id FROM pedido_item
+                WHERE pedido_id > $1 AND pedido_id <= $2 AND produto_id IS NOT NULL
+            """,
+                de,
+                ate,
+            )
+            await self.conn.execute("UPDATE relacionados_estado SET ultimo_pedido = $1", ate)
+        return [row["produto_id"] for row in rows]
+
+    async def atualizar_populares(self, k: int = RELACIONADOS_K):
+        """Os ``k`` mais vendidos de cada categoria (mais um, para excluir o próprio produto)."""
+        async with self.conn.transaction():
+            await self.conn.execute(
+                """
+                INSERT INTO categoria_popular AS cp (categoria_id, produtos)
+                SELECT categoria_id, array_agg(id ORDER BY posicao)
+                FROM (
+                    SELECT p.categoria_id, p.id,
+                           row_number() OVER (
+                               PARTITION BY p.categoria_id ORDER BY f.pedidos DESC NULLS LAST, p.id
+                           ) AS posicao
+                    FROM produto p
+                    LEFT JOIN produto_copedido f ON f.a = p.id AND f.b = p.id
+                    WHERE p.categoria_id IS NOT NULL
+                ) t
+                WHERE posicao <= $1 + 1
+                GROUP BY categoria_id
+                ON CONFLICT (categoria_id) DO UPDATE SET produtos = excluded.produtos
+            """,
+                k,
+            )
+            await self.conn.execute(
+                """
+                DELETE FROM categoria_popular cp
+                WHERE NOT EXISTS (SELECT 1 FROM produto p WHERE p.categoria_id = cp.categoria_id)
+            """
+            )
+
+    async def recalcular(self, ids: list[int], k: int = RELACIONADOS_K):
+        """
+        Top-``k`` de cada produto em ``ids``: compras em comum (cosseno suavizado)
+        e, completando, os mais vendidos da mesma categoria.
+        """
+        await self.conn.execute(
+            """
+            INSERT INTO produto_relacionado AS r (produto_id, vizinhos, atualizado_em)
+            SELECT a, array_agg(b ORDER BY posicao), now()
+            FROM (
+                SELECT a, b, row_number() OVER (PARTITION BY a ORDER BY prioridade, ordem, b)
+                       AS posicao
+                FROM (
+                    SELECT DISTINCT ON (a, b) a, b, prioridade, ordem
+                    FROM (
+                        SELECT c.a, c.b, 0 AS prioridade,
+                               -c.pedidos / sqrt(fa.pedidos::float8 * fb.pedidos)
+                               * c.pedidos / (c.pedidos + $3) AS ordem
+                        FROM produto_copedido c
+                        JOIN produto_copedido fa ON fa.a = c.a AND fa.b = c.a
+                        JOIN produto_copedido fb ON fb.a = c.b AND fb.b = c.b
+                        JOIN produto p ON p.id = c.b
+                        WHERE c.a = ANY($1::int[]) AND c.b <> c.a
+                        UNION ALL
+                        SELECT p.id, u.id, 1, u.ordem
+                        FROM produto p
+                        JOIN categoria_popular cp ON cp.categoria_id = p.categoria_id
+                        CROSS JOIN LATERAL unnest(cp.produtos) WITH ORDINALITY AS u (id, ordem)
+                        WHERE p.id = ANY($1::int[]) AND u.id <> p.id
+                    ) candidatos
+                    ORDER BY a, b, prioridade
+                ) unicos
+            ) ranqueados
+            JOIN produto alvo ON alvo.id = ranqueados.a
+            WHERE posicao <= $2
+            GROUP BY a
+            ON CONFLICT (produto_id) DO UPDATE
+            SET vizinhos = excluded.vizinhos, atualizado_em = excluded.atualizado_em
+        """,
+            ids,
+            k,
+            float(RELACIONADOS_SUAVIZACAO),
+        )
+
+    async def ids_produtos(self, apos: int, limite: int) -> list[int]:
+        rows = await self.conn.fetch(
+            "SELECT id FROM produto WHERE id > $1 ORDER BY id LIMIT $2", apos, limite
+        )
+        return [row["id"] for row in rows]
+
+    async def total_produtos(self) -> int:
+        return await self.conn.fetchval("SELECT count(*) FROM produto")
+
+    async def remover_desatualizados(self, antes) -> int:
+        """Linhas que a reconstrução completa não regravou (produto sem candidatos)."""
+        status = await self.conn.execute(
+            "DELETE FROM produto_relacionado WHERE atualizado_em < $1", antes
+        )
+        return int(status.split()[-1])
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import Literal
+
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
 
 class CategoriaIn(BaseModel):
@@ -11,6 +13,7 @@ class ProdutoIn(BaseModel):
     unidade: str  # e.g., "kg", "un", "g", "l"
     categoria_id: int | None = None
     estoque: int = 0  # quantidade em estoque
+    estoque_minimo: int = Field(default=10, ge=0)  # abaixo disso, alerta de estoque
 
 
 class ProdutoUpdate(BaseModel):
@@ -19,3 +22,51 @@ class ProdutoUpdate(BaseModel):
     unidade: str | None = None
     categoria_id: int | None = None
     estoque: int | None = None
+    estoque_minimo: int | None = Field(default=None, ge=0)
+
+
+class ProdutoFiltro(BaseModel):
+    """Filtros da listagem e do export (query string). Imutável: serve de chave."""
+
+    model_config = ConfigDict(frozen=True)
+
+    categoria_id: int | None = None
+    busca: str | None = None  # trecho do nome, sem diferenciar maiúsculas
+    preco_min: float | None = None
+    preco_max: float | None = None
+    em_estoque: bool | None = None
+
+    def vazio(self) -> bool:
+        return all(v is None for v in self.model_dump().values())
+
+
+class AjusteProdutosIn(BaseModel):
+    """Ajuste em massa: uma única operação aplicada a todos os produtos do filtro."""
+
+    filtro: ProdutoFiltro  # obrigatório: {} (catálogo inteiro) precisa ser explícito
+    preco_percentual: float | None = Field(default=None, gt=-100)  # 8 = 8% mais caro
+    preco_delta: float | None = None  # somado ao preço (o resultado não fica negativo)
+    estoque_delta: int | None = None  # somado ao estoque (o resultado não fica negativo)
+    dry_run: bool = False
+
+    @model_validator(mode="after")
+    def uma_operacao(self):
+        operacoes = (self.preco_percentual, self.preco_delta, self.estoque_delta)
+        if sum(op is not None for op in operacoes) != 1:
+            raise ValueError("Informe uma operação: preco_percentual, preco_delta ou estoque_delta")
+        return self
+
+
+class CarrinhoItemIn(BaseModel):
+    quantidade: int = Field(gt=0)
+
+
+class PedidoIn(BaseModel):
+    tipo_frete: Literal["pac", "sedex"] = "pac"
+    metodo_pagamento: Literal["cartao", "pix", "boleto"] = "cartao"
+    endereco: dict = {}
+
+
+class JobIn(BaseModel):
+    tipo: str
+    params: dict = {}
@@ -1,9 +1,43 @@
+import base64
+import json
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+
 import asyncpg
 from fastapi import HTTPException
 from passlib.hash import bcrypt
 
-from repositories import CategoriaRepository, ClienteRepository, ProdutoRepository
-from schemas import ProdutoIn, ProdutoUpdate
+from cache import TwoLevelCache
+from repositories import (
+    RETENCAO_VENDAS_HORA_DIAS,
+    CarrinhoRepository,
+    CategoriaRepository,
+    ClienteRepository,
+    ListaDesejoRepository,
+    PedidoRepository,
+    ProdutoRepository,
+    RelacionadosRepository,
+    VendasRepository,
+)
+from schemas import AjusteProdutosIn, PedidoIn, ProdutoFiltro, ProdutoIn, ProdutoUpdate
+from singleflight import SingleFlight
+from snapshot import catalogo as catalogo_snapshot
+from timing import medir
+
+# Leituras idênticas e simultâneas dentro do worker compartilham uma única consulta
+leituras = SingleFlight()
+# Catálogo compartilhado entre os workers (L1 local + L2 no Redis)
+catalogo_cache = TwoLevelCache("catalogo")
+# Carrinho precificado por (cliente, revisão); a revisão muda por trigger
+carrinho_cache = TwoLevelCache("carrinho", ttl=300)
+
+# Relatório de vendas: tamanho de um período, faixa padrão e faixa máxima (em períodos)
+PASSOS_VENDAS = {"hora": timedelta(hours=1), "dia": timedelta(days=1)}
+PERIODOS_PADRAO_VENDAS = {"hora": 48, "dia": 30}
+MAX_PERIODOS_VENDAS = {"hora": 24 * 31, "dia": 366 * 3}
+
+# Produtos por comando no ajuste em massa
+AJUSTE_LOTE = 1000
 
 
 class ProdutoService:
@@ -25,24 +59,114 @@ class ProdutoService:
                 # Transação para garantir integridade
                 async with conn.transaction():
                     pid = await prod_repo.create(produto)
-                    return {"id": pid}
             except asyncpg.UniqueViolationError as err:
                 raise HTTPException(
                     status_code=400, detail="Produto já cadastrado na mesma categoria"
                 ) from err
+        # Só depois do commit: invalidar antes deixaria outro worker cachear o valor antigo
+        await catalogo_cache.invalidar()
+        catalogo_snapshot.expirar()
+        return {"id": pid}
+
+    async def listar_produtos(self, versao: int | None = None):
+        """
+        Com a ``versao`` do catálogo, a listagem sai do snapshot mapeado ou é
+        compartilhada entre workers pelo L2.
+        """
+        if versao is None:
+            return await leituras.do(("produtos",), self._listar_produtos)
+        snapshot = await catalogo_snapshot.atual(self.pool, versao)
+        if snapshot is not None:
+            return snapshot.listar()
+        return await catalogo_cache.get_or_load(f"produtos:{versao}", self._listar_produtos)
 
-    async def listar_produtos(self):
+    async def _listar_produtos(self, filtro: ProdutoFiltro | None = None):
         async with self.pool.acquire() as conn:
             repo = ProdutoRepository(conn)
-            return await repo.list_all()
+            return await repo.list_all(filtro)
+
+    async def filtrar_produtos(self, filtro: ProdutoFiltro):
+        """Listagem filtrada: do snapshot quando possível; no banco, sem cache (chaves ilimitadas)."""
+        snapshot = await catalogo_snapshot.atual(self.pool)
+        if snapshot is not None:
+            produtos = snapshot.filtrar(filtro)
+            if produtos is not None:
+                return produtos
+        return await leituras.do(("produtos_filtro", filtro), lambda: self._listar_produtos(filtro))
+
+    async def versao_catalogo(self) -> int:
+        return await leituras.do(("versao_catalogo",), self._versao_catalogo)
+
+    async def _versao_catalogo(self) -> int:
+        async with self.pool.acquire() as conn:
+            return await ProdutoRepository(conn).catalog_version()
 
     async def obter_produto(self, pid: int):
+        # O 404 é levantado por chamador; o cache (e a consulta compartilhada) só devolve None
+        snapshot = await catalogo_snapshot.atual(self.pool)
+        if snapshot is not None:
+            produto = snapshot.obter(pid)
+        else:
+            produto = await catalogo_cache.get_or_load(
+                f"produto:{pid}", lambda: self._buscar_produto(pid)
+            )
+        if produto is None:
+            raise HTTPException(status_code=404, detail="Produto não encontrado")
+        return produto
+
+    async def _buscar_produto(self, pid: int):
         async with self.pool.acquire() as conn:
             repo = ProdutoRepository(conn)
             row = await repo.get_by_id(pid)
             if not row:
-                raise HTTPException(status_code=404, detail="Produto não encontrado")
-            return dict(row)
+                return None
+            with medir("conversao"):
+                return dict(row)
+
+    async def relacionados(self, pid: int, limite: int) -> list[dict]:
+        """Vizinhos pré-calculados pelo job "relacionados" (404 se o produto não existe)."""
+        await self.obter_produto(pid)
+        async with self.pool.acquire() as conn:
+            rows = await RelacionadosRepository(conn).listar(pid, limite)
+        with medir("conversao"):
+            return [dict(r) for r in rows]
+
+    async def alteracoes(self, since: int, limite: int) -> dict:
+        """
+        Delta do catálogo desde a versão ``since``, em ordem de versão e paginado:
+        o cliente aplica ``produtos``/``categorias`` (upsert) e ``removidos``
+        (delete) e chama de novo com ``since=versao`` enquanto ``mais`` for true.
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                # Uma linha a mais por tipo: se um tipo sozinho enche a página, a sobra
+                # dele é que indica ``mais`` (sem ela o cliente pararia antes do fim)
+                dados = await ProdutoRepository(conn).changes(since, limite + 1)
+
+        if 0 < since < dados["sync_minimo"]:
+            raise HTTPException(
+                status_code=410,
+                detail="Histórico de alterações reiniciado; baixe o catálogo completo",
+            )
+
+        with medir("conversao"):
+            itens = sorted(
+                [(r["versao"], "produtos", dict(r)) for r in dados["produtos"]]
+                + [(r["versao"], "categorias", dict(r)) for r in dados["categorias"]]
+                + [(r["versao"], "removidos", r["id"]) for r in dados["removidos"]],
+                key=lambda item: item[0],
+            )
+            pagina = itens[:limite]
+            resposta = {
+                "versao": pagina[-1][0] if pagina else since,
+                "mais": len(itens) > limite,
+                "produtos": [],
+                "categorias": [],
+                "removidos": [],
+            }
+            for _, tipo, valor in pagina:
+                resposta[tipo].append(valor)
+        return resposta
 
     async def atualizar_produto(self, pid: int, dados: "ProdutoUpdate"):
         async with self.pool.acquire() as conn:
@@ -53,7 +177,36 @@ class ProdutoService:
             if not atualizado:
                 raise HTTPException(status_code=404, detail="Produto não encontrado")
 
-            return dict(atualizado)
+            with medir("conversao"):
+                resultado = dict(atualizado)
+        await catalogo_cache.invalidar()
+        catalogo_snapshot.expirar()
+        return resultado
+
+    async def ajustar_em_massa(self, ajuste: AjusteProdutosIn) -> dict:
+        """
+        Aplica o ajuste a todos os produtos do filtro em lotes de ``AJUSTE_LOTE``,
+        um comando (e uma transação) por lote: numa categoria enorme os locks não
+        ficam presos até o fim. Se um lote falhar, os anteriores já estão gravados.
+        ``dry_run`` só calcula o resumo.
+        """
+        async with self.pool.acquire() as conn:
+            repo = ProdutoRepository(conn)
+            if ajuste.dry_run:
+                return _resumir_ajuste([await repo.prever_ajuste(ajuste)], dry_run=True)
+            resumos, ultimo = [], 0
+            while True:
+                resumo = await repo.ajustar_lote(ajuste, ultimo, AJUSTE_LOTE)
+                if not resumo["produtos"]:
+                    break
+                resumos.append(resumo)
+                ultimo = resumo["ultimo_id"]
+                if resumo["produtos"] < AJUSTE_LOTE:
+                    break
+        if resumos:
+            await catalogo_cache.invalidar()
+            catalogo_snapshot.expirar()
+        return _resumir_ajuste(resumos, dry_run=False)
 
     async def deletar_produto(self, pid: int):
         async with self.pool.acquire() as conn:
@@ -63,7 +216,283 @@ class ProdutoService:
             if not sucesso:
                 raise HTTPException(status_code=404, detail="Produto não encontrado")
 
-            return {"msg": "Produto removido com sucesso"}
+        await catalogo_cache.invalidar()
+        catalogo_snapshot.expirar()
+        return {"msg": "Produto removido com sucesso"}
+
+
+def _resumir_ajuste(resumos, dry_run: bool) -> dict:
+    """Soma os resumos dos lotes: contagens, preço médio/mínimo/máximo e estoque, antes e depois."""
+    # Sem produtos, somas/mínimos do lote vêm NULL
+    resumos = [r for r in resumos if r["produtos"]]
+    produtos = sum(r["produtos"] for r in resumos)
+    resposta = {
+        "dry_run": dry_run,
+        "produtos": produtos,
+        "alterados": sum(r["alterados"] for r in resumos),
+        "lotes": 0 if dry_run else len(resumos),
+    }
+    for m in ("antes", "depois"):
+        resposta[m] = {
+            "preco_medio": (
+                round(sum(r[f"preco_soma_{m}"] for r in resumos) / produtos, 2)
+                if produtos
+                else None
+            ),
+            "preco_min": min((r[f"preco_min_{m}"] for r in resumos), default=None),
+            "preco_max": max((r[f"preco_max_{m}"] for r in resumos), default=None),
+            "estoque_total": sum(r[f"estoque_soma_{m}"] for r in resumos),
+            "sem_estoque": sum(r[f"sem_estoque_{m}"] for r in resumos),
+        }
+    return resposta
+
+
+def _erro_referencia(err: asyncpg.ForeignKeyViolationError) -> HTTPException:
+    """Item apontando para produto ou cliente inexistente vira 404."""
+    if "produto" in (err.constraint_name or ""):
+        return HTTPException(status_code=404, detail="Produto não encontrado")
+    return HTTPException(status_code=404, detail="Cliente não encontrado")
+
+
+class CarrinhoService:
+    def __init__(self, db_pool: asyncpg.pool.Pool):
+        self.pool = db_pool
+
+    async def obter_carrinho(self, cliente_id: int) -> dict:
+        """
+        Carrinho com preços e estoque atuais. Visualizações repetidas saem do
+        cache enquanto a revisão (itens do carrinho e produtos dele) não mudar.
+        """
+        async with self.pool.acquire() as conn:
+            revisao = await CarrinhoRepository(conn).revisao(cliente_id)
+        return await carrinho_cache.get_or_load(
+            f"{cliente_id}:{revisao}", lambda: self._precificar(cliente_id, revisao)
+        )
+
+    async def _precificar(self, cliente_id: int, revisao: int) -> dict:
+        async with self.pool.acquire() as conn:
+            rows = await CarrinhoRepository(conn).itens_precificados(cliente_id)
+        with medir("conversao"):
+            itens = [dict(r) for r in rows]
+            for item in itens:
+                del item["total"]
+            return {
+                "revisao": revisao,
+                "itens": itens,
+                "quantidade_total": sum(i["quantidade"] for i in itens),
+                "subtotal": rows[0]["total"] if rows else "0",
+                "disponivel": all(i["disponivel"] for i in itens),
+            }
+
+    async def definir_item(self, cliente_id: int, produto_id: int, quantidade: int) -> dict:
+        async with self.pool.acquire() as conn:
+            try:
+                await CarrinhoRepository(conn).definir(cliente_id, produto_id, quantidade)
+            except asyncpg.ForeignKeyViolationError as err:
+                raise _erro_referencia(err) from err
+        return await self.obter_carrinho(cliente_id)
+
+    async def remover_item(self, cliente_id: int, produto_id: int) -> dict:
+        async with self.pool.acquire() as conn:
+            if not await CarrinhoRepository(conn).remover(cliente_id, produto_id):
+                raise HTTPException(status_code=404, detail="Produto não está no carrinho")
+        return await self.obter_carrinho(cliente_id)
+
+    async def limpar(self, cliente_id: int) -> dict:
+        async with self.pool.acquire() as conn:
+            await CarrinhoRepository(conn).limpar(cliente_id)
+        return await self.obter_carrinho(cliente_id)
+
+    async def listar_desejos(self, cliente_id: int) -> list[dict]:
+        async with self.pool.acquire() as conn:
+            rows = await ListaDesejoRepository(conn).itens(cliente_id)
+        with medir("conversao"):
+            return [dict(r) for r in rows]
+
+    async def adicionar_desejo(self, cliente_id: int, produto_id: int) -> list[dict]:
+        async with self.pool.acquire() as conn:
+            try:
+                await ListaDesejoRepository(conn).adicionar(cliente_id, produto_id)
+            except asyncpg.ForeignKeyViolationError as err:
+                raise _erro_referencia(err) from err
+        return await self.listar_desejos(cliente_id)
+
+    async def remover_desejo(self, cliente_id: int, produto_id: int) -> list[dict]:
+        async with self.pool.acquire() as conn:
+            if not await ListaDesejoRepository(conn).remover(cliente_id, produto_id):
+                raise HTTPException(status_code=404, detail="Produto não está na lista de desejos")
+        return await self.listar_desejos(cliente_id)
+
+
+# Mesmos valores exibidos em finalizar_pedido.html
+FRETES = {"pac": Decimal("25.00"), "sedex": Decimal("45.00")}
+
+
+def _codificar_cursor(criado_em: datetime, pedido_id: int) -> str:
+    bruto = f"{criado_em.isoformat()}|{pedido_id}".encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip("=")
+
+
+def _decodificar_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        criado_em, pedido_id = bruto.decode().split("|")
+        return datetime.fromisoformat(criado_em), int(pedido_id)
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail="Cursor inválido") from err
+
+
+class PedidoService:
+    def __init__(self, db_pool: asyncpg.pool.Pool):
+        self.pool = db_pool
+
+    async def finalizar(self, cliente_id: int, dados: PedidoIn) -> dict:
+        """Transforma o carrinho do cliente em pedido, baixando o estoque na mesma transação."""
+        async with self.pool.acquire() as conn:
+            repo = PedidoRepository(conn)
+            async with conn.transaction():
+                itens = await repo.travar_carrinho(cliente_id)
+                if not itens:
+                    raise HTTPException(status_code=400, detail="Carrinho vazio")
+                sem_estoque = [i["produto_id"] for i in itens if i["estoque"] < i["quantidade"]]
+                if sem_estoque:
+                    raise HTTPException(
+                        status_code=409,
+                        detail={"msg": "Estoque insuficiente", "produtos": sem_estoque},
+                    )
+
+                await repo.baixar_estoque(
+                    [i["produto_id"] for i in itens], [i["quantidade"] for i in itens]
+                )
+                subtotal = sum(i["preco"] * i["quantidade"] for i in itens)
+                pedido = await repo.create(
+                    cliente_id,
+                    itens,
+                    subtotal,
+                    FRETES[dados.tipo_frete],
+                    dados.tipo_frete,
+                    dados.metodo_pagamento,
+                    dados.endereco,
+                )
+                await CarrinhoRepository(conn).limpar(cliente_id)
+        # Estoque mudou: o catálogo em cache também
+        await catalogo_cache.invalidar()
+        catalogo_snapshot.expirar()
+        return await self.obter(cliente_id, pedido["id"])
+
+    async def listar(self, cliente_id: int, limite: int, cursor: str | None = None) -> dict:
+        """Uma página do histórico (keyset) com os itens de todos os pedidos dela."""
+        apos = _decodificar_cursor(cursor) if cursor else None
+        async with self.pool.acquire() as conn:
+            repo = PedidoRepository(conn)
+            rows = await repo.list_by_cliente(cliente_id, limite + 1, apos)
+            pagina = rows[:limite]
+            itens = await repo.itens_de([r["id"] for r in pagina]) if pagina else []
+
+        with medir("conversao"):
+            pedidos = [dict(r, itens=[]) for r in pagina]
+            por_id = {p["id"]: p for p in pedidos}
+            for item in itens:
+                item = dict(item)
+                por_id[item.pop("pedido_id")]["itens"].append(item)
+        ultimo = pagina[-1] if pagina else None
+        return {
+            "pedidos": pedidos,
+            "proximo": (
+                _codificar_cursor(ultimo["criado_em"], ultimo["id"]) if len(rows) > limite else None
+            ),
+        }
+
+    async def obter(self, cliente_id: int, pedido_id: int) -> dict:
+        async with self.pool.acquire() as conn:
+            repo = PedidoRepository(conn)
+            row = await repo.get(cliente_id, pedido_id)
+            if not row:
+                raise HTTPException(status_code=404, detail="Pedido não encontrado")
+            itens = await repo.itens_de([pedido_id])
+        with medir("conversao"):
+            pedido = dict(row)
+            if isinstance(pedido["endereco"], str):
+                pedido["endereco"] = json.loads(pedido["endereco"])
+            pedido["itens"] = [dict(i) for i in itens]
+            for item in pedido["itens"]:
+                del item["pedido_id"]
+            return pedido
+
+
+class VendasService:
+    def __init__(self, db_pool: asyncpg.pool.Pool):
+        self.pool = db_pool
+
+    def _validar_faixa(self, granularidade: str, inicio, fim):
+        passo = PASSOS_VENDAS[granularidade]
+        if inicio > fim:
+            raise HTTPException(status_code=400, detail="inicio depois de fim")
+        if (fim - inicio) // passo >= MAX_PERIODOS_VENDAS[granularidade]:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Faixa maior que {MAX_PERIODOS_VENDAS[granularidade]} períodos",
+            )
+        retencao = timedelta(days=RETENCAO_VENDAS_HORA_DIAS)
+        if granularidade == "hora" and inicio < datetime.now(UTC) - retencao:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Vendas por hora só dos últimos {RETENCAO_VENDAS_HORA_DIAS} dias",
+            )
+
+    async def relatorio(
+        self,
+        granularidade: str,
+        inicio: datetime | None = None,
+        fim: datetime | None = None,
+        limite: int = 10,
+    ) -> dict:
+        """Série, totais, produtos mais vendidos e categorias de ``inicio`` a ``fim``."""
+        if granularidade == "dia":
+            inicio, fim = (v.date() if isinstance(v, datetime) else v for v in (inicio, fim))
+        else:
+            # Sem fuso na query string: UTC (o mesmo que o asyncpg assume)
+            inicio, fim = (
+                v.replace(tzinfo=UTC) if v is not None and v.tzinfo is None else v
+                for v in (inicio, fim)
+            )
+
+        async with self.pool.acquire() as conn:
+            repo = VendasRepository(conn)
+            # Um snapshot só: os totais e o ranking batem com a série
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                if fim is None:
+                    fim = await repo.periodo_atual(granularidade)
+                if inicio is None:
+                    passos = PERIODOS_PADRAO_VENDAS[granularidade] - 1
+                    inicio = fim - PASSOS_VENDAS[granularidade] * passos
+                self._validar_faixa(granularidade, inicio, fim)
+
+                serie = await repo.serie(granularidade, inicio, fim)
+                top = await repo.top_produtos(granularidade, inicio, fim, limite)
+                categorias = await repo.por_categoria(granularidade, inicio, fim)
+
+        with medir("conversao"):
+            serie = [dict(r) for r in serie]
+            pedidos = sum(p["pedidos"] for p in serie)
+            receita = sum((Decimal(p["receita"]) for p in serie), Decimal(0))
+            return {
+                "granularidade": granularidade,
+                "inicio": inicio,
+                "fim": fim,
+                "totais": {
+                    "pedidos": pedidos,
+                    "itens": sum(p["itens"] for p in serie),
+                    "receita": str(receita),
+                    "frete": str(sum((Decimal(p["frete"]) for p in serie), Decimal(0))),
+                    "ticket_medio": (
+                        str((receita / pedidos).quantize(Decimal("0.01"))) if pedidos else "0.00"
+                    ),
+                },
+                "serie": serie,
+                "top_produtos": [dict(r) for r in top],
+                "categorias": [dict(r) for r in categorias],
+            }
 
 
 class ClienteService:
@@ -79,7 +508,8 @@ class ClienteService:
                 raise HTTPException(status_code=400, detail="E-mail já cadastrado.")
 
             # Hash da senha
-            senha_hash = bcrypt.hash(senha)
+            with medir("bcrypt"):
+                senha_hash = bcrypt.hash(senha)
 
             # Salva
             cliente_id = await repo.create(nome, email, senha_hash)
@@ -93,7 +523,9 @@ class ClienteService:
             if not user:
                 raise HTTPException(status_code=401, detail="E-mail ou senha inválidos")
 
-            if not bcrypt.verify(senha, user["senha_hash"]):
+            with medir("bcrypt"):
+                senha_ok = bcrypt.verify(senha, user["senha_hash"])
+            if not senha_ok:
                 raise HTTPException(status_code=401, detail="E-mail ou senha inválidos")
 
             return {"id": user["id"], "nome": user["nome"], "email": user["email"]}
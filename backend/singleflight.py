@@ -0,0 +1,66 @@
+"""
+Coalescência de leituras idênticas simultâneas (single-flight).
+
+Quando muitas requisições pedem a mesma chave ao mesmo tempo (cache frio,
+invalidação, pico de tráfego), só a primeira executa a consulta; as demais
+aguardam a mesma task e recebem o mesmo resultado, ou a mesma exceção.
+
+- A consulta roda numa task própria: se o cliente que a iniciou desistir
+  (cancelamento ou timeout), as outras requisições continuam esperando por ela.
+- Cada chamador espera no máximo o próprio prazo (``remaining_budget`` da
+  admissão, ou o ``timeout`` explícito) e recebe ``asyncio.TimeoutError``.
+- A chave sai do mapa assim que a task termina: não há cache de resultado aqui,
+  apenas de consultas em andamento.
+
+O resultado é compartilhado entre os chamadores e não deve ser modificado.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import TypeVar
+
+from admission import remaining_budget
+from metrics import SINGLEFLIGHT_REQUESTS
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self):
+        self._em_andamento: dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._em_andamento)
+
+    def _finalizar(self, chave: Hashable, task: asyncio.Task):
+        if self._em_andamento.get(chave) is task:
+            del self._em_andamento[chave]
+        # Marca a exceção como lida mesmo que todos os chamadores tenham desistido
+        if not task.cancelled():
+            task.exception()
+
+    async def do(
+        self,
+        chave: tuple,
+        fn: Callable[[], Awaitable[T]],
+        timeout: float | None = None,
+    ) -> T:
+        """
+        Executa ``fn()`` uma única vez por ``chave`` entre chamadas simultâneas.
+        ``chave[0]`` identifica a operação nas métricas.
+        """
+        task = self._em_andamento.get(chave)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._em_andamento[chave] = task
+            task.add_done_callback(lambda t: self._finalizar(chave, t))
+            SINGLEFLIGHT_REQUESTS.inc(chave[0], "lider")
+        else:
+            SINGLEFLIGHT_REQUESTS.inc(chave[0], "compartilhada")
+
+        if timeout is None:
+            timeout = remaining_budget()
+        if timeout is not None:
+            timeout = max(timeout, 0.0)
+        # shield: o timeout/cancelamento de um chamador não cancela a consulta dos outros
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
@@ -0,0 +1,371 @@
+"""
+Snapshot somente leitura do catálogo, compartilhado entre os workers por mmap.
+
+Com 4 workers do gunicorn, cada um guardava a sua cópia do catálogo em
+memória. Aqui um worker serializa produtos e categorias num arquivo compacto
+(colunas em arrays + tabelas de strings) e todos mapeiam o mesmo arquivo com
+``mmap``: as páginas ficam uma vez só no page cache do sistema, e as leituras
+são feitas direto delas (``memoryview.cast``), sem desserializar o arquivo.
+
+- Arquivo: ``CATALOGO_SNAPSHOT_DIR`` (``/dev/shm`` quando existe, senão o
+  diretório temporário) / ``catalogo.snap``. Cabeçalho com a versão do
+  catálogo (``catalogo_versao``), contagens e a posição de cada seção.
+- Construção: quando a versão do banco muda, um worker lê o catálogo numa
+  transação REPEATABLE READ, grava um arquivo temporário e faz ``os.replace``.
+  Como cada checkout muda a versão, o worker constrói no máximo uma vez a cada
+  ``CONSTRUCAO_INTERVALO_S``; as mudanças da espera entram na mesma construção.
+  Um ``flock`` evita que os workers construam ao mesmo tempo; quem não pegou o
+  lock usa o banco até o arquivo novo aparecer. Quem ainda lê o mapeamento
+  antigo continua lendo o arquivo antigo (o inode só some quando ninguém usa).
+- Frescor: a versão do banco é conferida no máximo a cada ``CONFERENCIA_S``
+  (a listagem já traz a sua); notificações de produto e escritas do próprio
+  worker (``expirar()``) forçam a conferência na leitura seguinte.
+- Fallback: sem snapshot da versão atual, ``atual()`` devolve ``None`` e o
+  serviço consulta o banco como antes. O mesmo vale para buscas com ``%``,
+  ``_`` ou ``\\``, que no ILIKE são curingas. A busca usa ``str.lower()``,
+  como o ILIKE de um banco UTF-8 (num banco em locale C, só letras ASCII).
+"""
+
+import asyncio
+import bisect
+import contextvars
+import mmap
+import os
+import struct
+import tempfile
+import time
+from array import array
+
+import metrics
+from metrics import CACHE_REQUESTS
+from repositories import CategoriaRepository, ProdutoRepository
+from schemas import ProdutoFiltro
+from singleflight import SingleFlight
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem lock entre processos (o os.replace continua atômico)
+    fcntl = None
+
+CATALOGO_SNAPSHOT = os.getenv("CATALOGO_SNAPSHOT", "1") != "0"
+CATALOGO_SNAPSHOT_DIR = os.getenv(
+    "CATALOGO_SNAPSHOT_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+)
+CONFERENCIA_S = float(os.getenv("CATALOGO_SNAPSHOT_CONFERENCIA_S", "1.0"))
+CONSTRUCAO_INTERVALO_S = float(os.getenv("CATALOGO_SNAPSHOT_INTERVALO_S", "5.0"))
+
+MAGICO = b"CATSNAP\x00"
+FORMATO = 2
+SEM_CATEGORIA = -(2**31)
+# Caracteres que o ILIKE trata de forma especial: essas buscas vão para o banco
+CURINGAS = ("%", "_", "\\", "\x00")
+
+# (nome, typecode) na ordem em que ficam no arquivo; textos são (offsets "I", bytes "B")
+SECOES = (
+    ("ids", "i"),
+    ("versoes", "q"),
+    ("precos", "d"),
+    ("estoques", "i"),
+    ("estoques_minimos", "i"),
+    ("categorias", "i"),
+    ("nome_off", "I"),
+    ("nome", "B"),
+    ("unidade_off", "I"),
+    ("unidade", "B"),
+    ("preco_off", "I"),
+    ("preco", "B"),
+    ("busca_off", "I"),
+    ("busca", "B"),
+    ("cat_ids", "i"),
+    ("cat_nome_off", "I"),
+    ("cat_nome", "B"),
+)
+CABECALHO = struct.Struct(f"=8sIqII{2 * len(SECOES)}Q")
+
+
+def _alinhar(pos: int) -> int:
+    return (pos + 7) & ~7
+
+
+def _textos(valores, separador: bytes = b"") -> tuple[array, bytes]:
+    """Tabela de strings: ``offsets[i]:offsets[i + 1]`` é o texto ``i`` (com o separador)."""
+    offsets, partes, pos = array("I", [0]), [], 0
+    for valor in valores:
+        dado = valor.encode() + separador
+        partes.append(dado)
+        pos += len(dado)
+        offsets.append(pos)
+    return offsets, b"".join(partes)
+
+
+def serializar(versao: int, produtos, categorias) -> bytes:
+    """Conteúdo do arquivo; ``produtos`` em ordem de id, ``categorias`` em ordem de nome."""
+    colunas = {
+        "ids": array("i", (p["id"] for p in produtos)),
+        "versoes": array("q", (p["versao"] for p in produtos)),
+        "precos": array("d", (float(p["preco"]) for p in produtos)),
+        "estoques": array("i", (p["estoque"] for p in produtos)),
+        "estoques_minimos": array("i", (p["estoque_minimo"] for p in produtos)),
+        "categorias": array(
+            "i",
+            (SEM_CATEGORIA if p["categoria_id"] is None else p["categoria_id"] for p in produtos),
+        ),
+        "cat_ids": array("i", (c["id"] for c in categorias)),
+    }
+    for nome, valores, separador in (
+        ("nome", (p["nome"] for p in produtos), b""),
+        ("unidade", (p["unidade"] for p in produtos), b""),
+        ("preco", (str(p["preco"]) for p in produtos), b""),
+        # Nomes em minúsculas separados por \x00: um trecho nunca casa entre dois nomes
+        ("busca", (p["nome"].lower() for p in produtos), b"\x00"),
+        ("cat_nome", (c["nome"] for c in categorias), b""),
+    ):
+        colunas[f"{nome}_off"], colunas[nome] = _textos(valores, separador)
+
+    partes, posicoes, pos = [], [], _alinhar(CABECALHO.size)
+    for nome, _ in SECOES:
+        dado = bytes(colunas[nome])
+        posicoes += [pos, len(dado)]
+        partes.append(dado + b"\x00" * (_alinhar(len(dado)) - len(dado)))
+        pos += _alinhar(len(dado))
+    cabecalho = CABECALHO.pack(MAGICO, FORMATO, versao, len(produtos), len(categorias), *posicoes)
+    return cabecalho.ljust(_alinhar(CABECALHO.size), b"\x00") + b"".join(partes)
+
+
+def gravar(caminho: str, versao: int, produtos, categorias):
+    """Grava num temporário e troca de uma vez: quem abrir o arquivo vê o antigo ou o novo."""
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(serializar(versao, produtos, categorias))
+    os.replace(temporario, caminho)
+
+
+def _texto(dados: memoryview, offsets: memoryview, i: int) -> str:
+    return str(dados[offsets[i] : offsets[i + 1]], "utf-8")
+
+
+class Snapshot:
+    """Leitura de um arquivo mapeado; nada é copiado além das linhas devolvidas."""
+
+    def __init__(self, mm: mmap.mmap):
+        if len(mm) < CABECALHO.size:
+            raise ValueError("snapshot truncado")
+        magico, formato, self.versao, self.n, self.m, *posicoes = CABECALHO.unpack_from(mm)
+        if magico != MAGICO or formato != FORMATO:
+            raise ValueError("snapshot em formato desconhecido")
+        self.mm = mm
+        self.tamanho = len(mm)
+        visao = memoryview(mm)
+        self.inicio: dict[str, int] = {}
+        for (nome, tipo), inicio, tamanho in zip(
+            SECOES, posicoes[::2], posicoes[1::2], strict=True
+        ):
+            if inicio + tamanho > len(mm):
+                raise ValueError("snapshot truncado")
+            self.inicio[nome] = inicio
+            setattr(self, nome, visao[inicio : inicio + tamanho].cast(tipo))
+        # Poucas categorias: os nomes ficam decodificados no worker
+        self._nomes_categoria = {
+            cid: _texto(self.cat_nome, self.cat_nome_off, j) for j, cid in enumerate(self.cat_ids)
+        }
+
+    def _linha(self, i: int) -> dict:
+        """Mesmas colunas (e ordem) de ``SQL_LISTAGEM``."""
+        cid = self.categorias[i]
+        categoria_nome = self._nomes_categoria.get(cid)
+        return {
+            "id": self.ids[i],
+            "nome": _texto(self.nome, self.nome_off, i),
+            "preco": _texto(self.preco, self.preco_off, i),
+            "unidade": _texto(self.unidade, self.unidade_off, i),
+            "estoque": self.estoques[i],
+            "categoria_id": None if categoria_nome is None else cid,
+            "categoria_nome": categoria_nome,
+        }
+
+    def listar(self) -> list[dict]:
+        return [self._linha(i) for i in range(self.n)]
+
+    def obter(self, pid: int) -> dict | None:
+        """Mesma forma do ``SELECT * FROM produto`` depois do cache (preço em float)."""
+        i = bisect.bisect_left(self.ids, pid)
+        if i == self.n or self.ids[i] != pid:
+            return None
+        cid = self.categorias[i]
+        return {
+            "id": pid,
+            "nome": _texto(self.nome, self.nome_off, i),
+            "preco": self.precos[i],
+            "unidade": _texto(self.unidade, self.unidade_off, i),
+            "categoria_id": None if cid == SEM_CATEGORIA else cid,
+            "estoque": self.estoques[i],
+            "versao": self.versoes[i],
+            "estoque_minimo": self.estoques_minimos[i],
+        }
+
+    def categorias_por_nome(self) -> list[dict]:
+        return [{"id": cid, "nome": self._nomes_categoria[cid]} for cid in self.cat_ids]
+
+    def _linhas_com_trecho(self, trecho: str):
+        """Linhas cujo nome contém ``trecho``: um ``find`` no bloco de nomes em minúsculas."""
+        agulha = trecho.lower().encode()
+        base = self.inicio["busca"]
+        fim = base + len(self.busca)
+        pos = self.mm.find(agulha, base, fim)
+        while pos != -1:
+            i = bisect.bisect_right(self.busca_off, pos - base) - 1
+            yield i
+            pos = self.mm.find(agulha, base + self.busca_off[i + 1], fim)
+
+    def filtrar(self, filtro: ProdutoFiltro) -> list[dict] | None:
+        """Mesmo resultado de ``filtro_sql``; ``None`` quando só o banco responde igual."""
+        if filtro.busca and any(c in filtro.busca for c in CURINGAS):
+            return None
+        linhas = self._linhas_com_trecho(filtro.busca) if filtro.busca else range(self.n)
+        resultado = []
+        for i in linhas:
+            if filtro.categoria_id is not None and self.categorias[i] != filtro.categoria_id:
+                continue
+            if filtro.preco_min is not None and self.precos[i] < filtro.preco_min:
+                continue
+            if filtro.preco_max is not None and self.precos[i] > filtro.preco_max:
+                continue
+            if filtro.em_estoque is not None and (self.estoques[i] > 0) != filtro.em_estoque:
+                continue
+            resultado.append(self._linha(i))
+        return resultado
+
+
+class SnapshotCatalogo:
+    """O snapshot mapeado pelo worker e a conferência dele contra a versão do banco."""
+
+    def __init__(self, diretorio: str = CATALOGO_SNAPSHOT_DIR, ativo: bool = CATALOGO_SNAPSHOT):
+        self.ativo = ativo
+        self.caminho = os.path.join(diretorio, "catalogo.snap")
+        self.snapshot: Snapshot | None = None
+        self._identidade: tuple | None = None
+        self._versao_banco: int | None = None
+        self._conferido_em = 0.0
+        self._conferencia = SingleFlight()
+        self._tarefa: asyncio.Task | None = None
+        self._construido_em = float("-inf")
+
+    async def atual(self, pool, versao: int | None = None) -> Snapshot | None:
+        """Snapshot da versão atual do catálogo ou ``None`` (usar o banco)."""
+        if not self.ativo:
+            return None
+        agora = time.monotonic()
+        if versao is None and agora - self._conferido_em >= CONFERENCIA_S:
+            versao = await self._conferencia.do(("versao",), lambda: self._ler_versao(pool))
+        if versao is not None:
+            self._versao_banco, self._conferido_em = versao, agora
+        versao = self._versao_banco
+        if versao is None:
+            return None
+
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.versao != versao:
+            # Outro worker pode já ter gravado a versão nova
+            snapshot = self.abrir()
+        if snapshot is not None and snapshot.versao == versao:
+            CACHE_REQUESTS.inc("snapshot", "hit")
+            return snapshot
+        if snapshot is None or snapshot.versao < versao:
+            self.agendar_construcao(pool)
+        CACHE_REQUESTS.inc("snapshot", "banco")
+        return None
+
+    async def aquecer(self, pool):
+        """Startup: espera a construção, se foi este worker que a começou."""
+        if await self.atual(pool) is None and self._tarefa is not None:
+            await self._tarefa
+
+    async def _ler_versao(self, pool) -> int:
+        async with pool.acquire() as conn:
+            return await ProdutoRepository(conn).catalog_version()
+
+    def expirar(self):
+        """O catálogo mudou: a próxima leitura confere a versão no banco."""
+        self._conferido_em = 0.0
+
+    def aplicar(self, evento: dict):
+        """Callback do ``broker.ouvir``: qualquer notificação de produto expira a conferência."""
+        if evento.get("tipo") in ("produto", "conectado"):
+            self.expirar()
+
+    # ---------- arquivo ----------
+    def abrir(self) -> Snapshot | None:
+        """Mapeia o arquivo do disco, se ele mudou desde o último mapeamento."""
+        try:
+            st = os.stat(self.caminho)
+        except FileNotFoundError:
+            return self.snapshot
+        identidade = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if identidade == self._identidade:
+            return self.snapshot
+        try:
+            with open(self.caminho, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            snapshot = Snapshot(mm)
+        except (OSError, ValueError) as err:
+            print(f"⚠️ Snapshot do catálogo ilegível: {err!r}")
+            return self.snapshot
+        # O mapeamento antigo é liberado quando a última requisição que o usa terminar
+        self.snapshot, self._identidade = snapshot, identidade
+        return snapshot
+
+    def agendar_construcao(self, pool):
+        if self._tarefa is not None and not self._tarefa.done():
+            return
+        espera = max(0.0, self._construido_em + CONSTRUCAO_INTERVALO_S - time.monotonic())
+        # Contexto vazio: a tarefa nasce numa requisição e herdaria o request_deadline,
+        # que vira o statement_timeout da leitura do catálogo inteiro (admission.py)
+        self._tarefa = asyncio.get_running_loop().create_task(
+            self._construir_depois(pool, espera), context=contextvars.Context()
+        )
+
+    async def _construir_depois(self, pool, espera: float):
+        if espera:
+            await asyncio.sleep(espera)
+        self._construido_em = time.monotonic()
+        await self.construir(pool)
+
+    async def construir(self, pool):
+        """Grava o snapshot da versão atual; só um worker por vez (os outros desistem)."""
+        os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+        with open(f"{self.caminho}.lock", "w") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return
+            try:
+                async with pool.acquire() as conn:
+                    async with conn.transaction(isolation="repeatable_read", readonly=True):
+                        versao = await ProdutoRepository(conn).catalog_version()
+                        produtos = await ProdutoRepository(conn).list_snapshot()
+                        categorias = await CategoriaRepository(conn).list_all()
+                atual = self.abrir()
+                if atual is None or atual.versao < versao:
+                    await asyncio.to_thread(gravar, self.caminho, versao, produtos, categorias)
+                self.abrir()
+            except Exception as err:
+                print(f"⚠️ Construção do snapshot do catálogo falhou: {err!r}")
+
+    def estatisticas(self) -> dict:
+        snapshot = self.snapshot
+        if snapshot is None:
+            return {"versao": 0, "produtos": 0, "bytes": 0}
+        return {"versao": snapshot.versao, "produtos": snapshot.n, "bytes": snapshot.tamanho}
+
+
+catalogo = SnapshotCatalogo()
+
+metrics.register(
+    metrics.Gauge(
+        "catalogo_snapshot",
+        "Snapshot do catálogo mapeado pelo worker: versão, produtos e bytes do arquivo",
+        lambda: {(nome,): valor for nome, valor in catalogo.estatisticas().items()},
+        ("medida",),
+    )
+)
@@ -5,6 +5,20 @@ from unittest.mock import AsyncMock, MagicMock
 import pytest
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Cache em memória no lugar do Redis (precisa valer antes de importar os módulos)
+os.environ.setdefault("CACHE_BACKEND", "memory")
+# Sem snapshot em disco: os testes do serviço exercitam o caminho do banco
+os.environ.setdefault("CATALOGO_SNAPSHOT", "0")
+
+
+@pytest.fixture(autouse=True)
+def limpar_cache_catalogo():
+    """Cada teste começa com os caches do catálogo e dos carrinhos vazios."""
+    from services import carrinho_cache, catalogo_cache
+
+    for cache in (catalogo_cache, carrinho_cache):
+        cache.backend.clear()
+        cache.clear_local()
 
 
 @pytest.fixture
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from admission import AdmissionMiddleware, RouteClass, classificar, remaining_budget
+
+pytestmark = pytest.mark.asyncio
+
+
+def _app_lento(liberar: asyncio.Event, classes: dict[str, RouteClass]):
+    """App mínima cujas rotas ficam presas até o evento ser liberado."""
+
+    async def lenta(request):
+        orcamento = remaining_budget()
+        await liberar.wait()
+        return JSONResponse({"orcamento": orcamento})
+
+    app = Starlette(routes=[Route("/produtos", lenta), Route("/dashboard/stats", lenta)])
+    return AdmissionMiddleware(app, classes)
+
+
+async def test_classificar_rotas():
+    """Leituras, escritas, admin e rotas isentas caem na classe certa"""
+    assert classificar("GET", "/produtos") == "leitura"
+    assert classificar("POST", "/produtos") == "escrita"
+    assert classificar("DELETE", "/produtos/1") == "escrita"
+    assert classificar("GET", "/dashboard/stats") == "admin"
+    assert classificar("POST", "/produtos/bulk") == "admin"
+    assert classificar("GET", "/health/ready") is None
+    assert classificar("OPTIONS", "/produtos") is None
+
+
+async def test_requisicao_admitida_recebe_orcamento():
+    """Dentro da requisição o prazo fica disponível para o statement_timeout"""
+    liberar = asyncio.Event()
+    liberar.set()
+    app = _app_lento(liberar, {"leitura": RouteClass("leitura", 0, 2, 0.1, 3.0)})
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.get("/produtos")
+
+    assert response.status_code == 200
+    assert 0 < response.json()["orcamento"] <= 3.0
+    assert remaining_budget() is None
+
+
+async def test_excesso_recebe_503_com_retry_after():
+    """Com a classe saturada, quem espera além do limite recebe 503 rápido"""
+    liberar = asyncio.Event()
+    app = _app_lento(liberar, {"leitura": RouteClass("leitura", 0, 1, 0.05, 3.0)})
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        ocupando = asyncio.create_task(ac.get("/produtos"))
+        await asyncio.sleep(0.01)
+        rejeitada = await ac.get("/produtos")
+        liberar.set()
+        admitida = await ocupando
+
+    assert admitida.status_code == 200
+    assert rejeitada.status_code == 503
+    assert int(rejeitada.headers["Retry-After"]) >= 1
+
+
+async def test_admin_recusado_enquanto_leituras_esperam():
+    """Leituras na fila têm prioridade: admin é recusado na entrada"""
+    liberar = asyncio.Event()
+    classes = {
+        "leitura": RouteClass("leitura", 0, 1, 1.0, 3.0),
+        "admin": RouteClass("admin", 2, 1, 1.0, 3.0),
+    }
+    app = _app_lento(liberar, classes)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        ocupando = asyncio.create_task(ac.get("/produtos"))
+        await asyncio.sleep(0.01)
+        na_fila = asyncio.create_task(ac.get("/produtos"))
+        await asyncio.sleep(0.01)
+        admin = await ac.get("/dashboard/stats")
+        liberar.set()
+        await asyncio.gather(ocupando, na_fila)
+
+    assert admin.status_code == 503
+    assert na_fila.result().status_code == 200
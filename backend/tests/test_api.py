@@ -3,6 +3,7 @@ from unittest.mock import AsyncMock
 import pytest
 from httpx import ASGITransport, AsyncClient
 
+from compression import PrecompressedCache
 from main import app, get_produto_service
 
 pytestmark = pytest.mark.asyncio
@@ -30,6 +31,8 @@ async def test_rota_listar_produtos(mocker):
     mock_service = mocker.Mock()
     # Simula retorno de lista vazia
     mock_service.listar_produtos = AsyncMock(return_value=[])
+    mock_service.versao_catalogo = AsyncMock(return_value=1)
+    mocker.patch("main.catalogo_cache", PrecompressedCache())
 
     app.dependency_overrides[get_produto_service] = lambda: mock_service
 
@@ -0,0 +1,105 @@
+from unittest.mock import MagicMock
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import autocomplete
+from autocomplete import IndiceAutocomplete
+from main import app
+
+pytestmark = pytest.mark.asyncio
+
+PRODUTOS = [
+    {"id": 1, "nome": "Notebook Gamer"},
+    {"id": 2, "nome": "Café Especial"},
+    {"id": 3, "nome": "Gamepad Sem Fio"},
+    {"id": 4, "nome": "Cafeteira Elétrica"},
+]
+
+
+def _indice() -> IndiceAutocomplete:
+    indice = IndiceAutocomplete()
+    indice.carregar(PRODUTOS)
+    return indice
+
+
+async def test_busca_por_palavra_sem_acento_com_inicio_do_nome_primeiro():
+    indice = _indice()
+
+    # "Gamepad" começa com "gam" e vem antes de "Notebook Gamer"
+    assert [p["id"] for p in indice.buscar("GAM")] == [3, 1]
+    assert [p["id"] for p in indice.buscar("cafe")] == [2, 4]
+    assert [p["id"] for p in indice.buscar("eletr")] == [4]
+    assert indice.buscar("cafe esp") == [{"id": 2, "nome": "Café Especial"}]
+    assert indice.buscar("cafe", limite=1) == [{"id": 2, "nome": "Café Especial"}]
+    assert indice.buscar("  ") == []
+    assert indice.buscar("xyz") == []
+
+
+async def test_consulta_maior_que_a_chave_confere_o_nome_inteiro(monkeypatch):
+    monkeypatch.setattr(autocomplete, "TAMANHO_CHAVE", 4)
+    indice = _indice()
+
+    assert [p["id"] for p in indice.buscar("cafe")] == [2, 4]
+    assert [p["id"] for p in indice.buscar("cafeteira")] == [4]
+
+
+async def test_notificacoes_atualizam_o_indice_sem_recarga(mocker):
+    indice = _indice()
+    recarga = mocker.patch.object(indice, "agendar_recarga")
+
+    indice.aplicar({"tipo": "produto", "op": "INSERT", "itens": [{"id": 5, "nome": "Mouse"}]})
+    indice.aplicar(
+        {"tipo": "produto", "op": "UPDATE", "itens": [{"id": 1, "nome": "Notebook Ultra"}]}
+    )
+    indice.aplicar({"tipo": "produto", "op": "DELETE", "removidos": [3]})
+    indice.aplicar({"tipo": "cliente", "op": "INSERT"})
+
+    assert [p["id"] for p in indice.buscar("mou")] == [5]
+    assert indice.buscar("gam") == []
+    assert [p["id"] for p in indice.buscar("ultra")] == [1]
+    recarga.assert_not_called()
+    # Mesmas entradas de uma carga do zero com o estado final
+    novo = IndiceAutocomplete()
+    novo.carregar([{"id": pid, "nome": nome} for pid, nome in indice.nomes.items()])
+    assert (indice.chaves, list(indice.ids)) == (novo.chaves, list(novo.ids))
+
+    # Comando grande (sem itens no payload) e reconexão do LISTEN pedem recarga completa
+    indice.aplicar({"tipo": "produto", "op": "UPDATE", "itens": None})
+    indice.aplicar({"tipo": "conectado"})
+    assert recarga.call_count == 2
+
+
+async def test_notificacao_durante_a_carga_e_aplicada_depois():
+    indice = IndiceAutocomplete()
+    conn = MagicMock()
+
+    async def list_names():
+        # Chega enquanto a consulta da carga ainda não voltou
+        indice.aplicar({"tipo": "produto", "op": "DELETE", "removidos": [2]})
+        return PRODUTOS
+
+    repo = MagicMock(list_names=list_names)
+    pool = MagicMock()
+    pool.acquire.return_value.__aenter__.return_value = conn
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(autocomplete, "ProdutoRepository", lambda _conn: repo)
+        await indice.recarregar(pool)
+
+    assert indice.pronto
+    assert [p["id"] for p in indice.buscar("cafe")] == [4]
+
+
+async def test_rota_autocomplete(mocker):
+    indice = IndiceAutocomplete()
+    mocker.patch("autocomplete.indice", indice)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        carregando = await ac.get("/produtos/autocomplete?prefix=cafe")
+        indice.carregar(PRODUTOS)
+        response = await ac.get("/produtos/autocomplete?prefix=cafe&limite=1")
+
+    assert carregando.status_code == 503
+    assert carregando.headers["retry-after"] == "1"
+    assert response.status_code == 200
+    assert response.json() == [{"id": 2, "nome": "Café Especial"}]
@@ -0,0 +1,90 @@
+import json
+import time
+from decimal import Decimal
+from unittest.mock import AsyncMock
+
+import pytest
+import redis.asyncio as redis
+
+from cache import MemoryBackend, RedisBackend, TwoLevelCache, deve_recalcular
+
+pytestmark = pytest.mark.asyncio
+
+
+def _workers(n: int = 2, **kwargs) -> list[TwoLevelCache]:
+    """Vários caches (um por "worker") sobre o mesmo L2."""
+    l2 = MemoryBackend()
+    return [TwoLevelCache("catalogo", backend=l2, versao_ttl=0, **kwargs) for _ in range(n)]
+
+
+async def test_l2_compartilhado_entre_workers():
+    a, b = _workers()
+    carregar = AsyncMock(return_value={"id": 1, "preco": Decimal("10.50")})
+
+    primeiro = await a.get_or_load("produto:1", carregar)
+    segundo = await b.get_or_load("produto:1", carregar)
+    terceiro = await b.get_or_load("produto:1", carregar)  # L1
+
+    assert carregar.await_count == 1
+    assert primeiro == segundo == terceiro == {"id": 1, "preco": 10.5}
+
+
+async def test_invalidar_vale_para_todos_os_workers():
+    a, b = _workers()
+    carregar = AsyncMock(side_effect=[{"v": 1}, {"v": 2}])
+
+    await a.get_or_load("produto:1", carregar)
+    await b.invalidar()
+
+    assert await a.get_or_load("produto:1", carregar) == {"v": 2}
+    assert carregar.await_count == 2
+
+
+async def test_none_tambem_fica_em_cache():
+    (a,) = _workers(1)
+    carregar = AsyncMock(return_value=None)
+
+    assert await a.get_or_load("produto:404", carregar) is None
+    assert await a.get_or_load("produto:404", carregar) is None
+    assert carregar.await_count == 1
+
+
+async def test_deve_recalcular_xfetch():
+    agora = 1000.0
+    # Longe do vencimento e recálculo barato: nunca
+    assert not any(deve_recalcular(agora + 60, 0.001, 1.0, agora) for _ in range(1000))
+    # Já vencido: sempre
+    assert all(deve_recalcular(agora - 1, 0.001, 1.0, agora) for _ in range(1000))
+    # Perto do vencimento com recálculo caro: às vezes
+    perto = [deve_recalcular(agora + 1, 1.0, 1.0, agora) for _ in range(1000)]
+    assert 0 < sum(perto) < 1000
+
+
+async def test_recalculo_antecipado_no_l2():
+    (a,) = _workers(1, l1_ttl=0)
+    carregar = AsyncMock(side_effect=[{"v": 1}, {"v": 2}])
+    await a.get_or_load("lista", carregar)
+
+    # Envelope prestes a vencer e caro de recalcular: o XFetch dispara
+    chave = "catalogo:v0:lista"
+    bruto = json.loads(await a.backend.get(chave))
+    bruto.update(expira=time.time(), delta=1e6)
+    await a.backend.set(chave, json.dumps(bruto).encode(), 60)
+
+    assert await a.get_or_load("lista", carregar) == {"v": 2}
+
+
+async def test_redis_fora_usa_so_l1():
+    backend = RedisBackend("redis://localhost:1/0")
+    backend.redis = AsyncMock()
+    backend.redis.get.side_effect = redis.ConnectionError("recusado")
+    cache = TwoLevelCache("catalogo", backend=backend)
+    carregar = AsyncMock(return_value=[1, 2])
+
+    assert await cache.get_or_load("lista", carregar) == [1, 2]
+    assert await cache.get_or_load("lista", carregar) == [1, 2]
+
+    assert carregar.await_count == 1
+    assert not backend.disponivel()
+    # Desligado: nem tenta o Redis de novo
+    assert backend.redis.get.await_count == 1
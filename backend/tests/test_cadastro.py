@@ -17,8 +17,7 @@ def mock_redis():
 
 async def test_register_sucesso(mock_redis):
     """Testa registro de novo usuário com sucesso"""
-    mock_redis.exists.return_value = False  # Usuário não existe
-    mock_redis.set = AsyncMock()
+    mock_redis.set = AsyncMock(return_value=True)  # SET NX gravou: usuário não existia
 
     # Mock do bcrypt.hash para evitar problemas na inicialização
     with patch("cadastro.bcrypt.hash", return_value="$2b$12$hashed_password"):
@@ -30,15 +29,19 @@ async def test_register_sucesso(mock_redis):
     assert response.json()["msg"] == "usuário criado"
     assert response.json()["username"] == "testuser"
     mock_redis.set.assert_called_once()
+    # Verificação e gravação no mesmo comando
+    assert mock_redis.set.await_args.kwargs == {"nx": True}
+    mock_redis.exists.assert_not_called()
 
 
 async def test_register_usuario_existente(mock_redis):
     """Testa registro de usuário que já existe"""
-    mock_redis.exists.return_value = True  # Usuário já existe
+    mock_redis.set.return_value = None  # SET NX não gravou: usuário já existe
 
-    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
-        payload = {"username": "testuser", "password": "senha123"}
-        response = await ac.post("/register", json=payload)
+    with patch("cadastro.bcrypt.hash", return_value="$2b$12$hashed_password"):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            payload = {"username": "testuser", "password": "senha123"}
+            response = await ac.post("/register", json=payload)
 
     assert response.status_code == 400
     assert "já existe" in response.json()["detail"].lower()
@@ -46,7 +49,7 @@ async def test_register_usuario_existente(mock_redis):
 
 async def test_register_username_invalido(mock_redis):
     """Testa registro com username muito curto"""
-    mock_redis.exists.return_value = False
+    mock_redis.set.return_value = True
 
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
         payload = {"username": "ab", "password": "senha123"}  # Muito curto (min_length=3)
@@ -57,10 +60,19 @@ async def test_register_username_invalido(mock_redis):
 
 async def test_register_senha_curta(mock_redis):
     """Testa registro com senha muito curta"""
-    mock_redis.exists.return_value = False
+    mock_redis.set.return_value = True
 
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
         payload = {"username": "testuser", "password": "12345"}  # Muito curta (min_length=6)
         response = await ac.post("/register", json=payload)
 
     assert response.status_code == 422  # Validação do Pydantic
+
+
+async def test_login_e_cadastro_usam_o_mesmo_pool():
+    import login
+    import redis_pool
+    from cadastro import r
+
+    assert r.connection_pool is login.r.connection_pool is redis_pool.pool
+    assert redis_pool.pool.max_connections == redis_pool.REDIS_MAX_CONNECTIONS
@@ -0,0 +1,125 @@
+import asyncio
+import gzip
+import json
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from httpx import ASGITransport, AsyncClient
+
+from compression import CompressionMiddleware, PrecompressedCache, escolher_codificacao
+
+pytestmark = pytest.mark.asyncio
+
+GRANDE = [{"id": i, "nome": f"Produto {i}"} for i in range(500)]
+
+
+def _app_teste() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, min_bytes=1024)
+
+    @app.get("/grande")
+    async def grande():
+        return GRANDE
+
+    @app.get("/pequena")
+    async def pequena():
+        return {"ok": True}
+
+    @app.get("/stream")
+    async def stream():
+        async def partes():
+            for _ in range(3):
+                yield b"x" * 2048
+
+        return StreamingResponse(partes(), media_type="text/plain")
+
+    @app.get("/ja-comprimida")
+    async def ja_comprimida():
+        return PlainTextResponse(gzip.compress(b"a" * 4096), headers={"Content-Encoding": "gzip"})
+
+    return app
+
+
+async def test_escolher_codificacao():
+    assert escolher_codificacao("") is None
+    assert escolher_codificacao("gzip, deflate") == "gzip"
+    assert escolher_codificacao("gzip;q=0, identity") is None
+    assert escolher_codificacao("*") in ("br", "gzip")
+    assert escolher_codificacao("deflate") is None
+
+
+async def test_middleware_comprime_so_acima_do_limite():
+    async with AsyncClient(transport=ASGITransport(app=_app_teste()), base_url="http://t") as ac:
+        grande = await ac.get("/grande", headers={"Accept-Encoding": "gzip"})
+        pequena = await ac.get("/pequena", headers={"Accept-Encoding": "gzip"})
+        sem_aceite = await ac.get("/grande", headers={"Accept-Encoding": "identity"})
+
+    assert grande.headers["content-encoding"] == "gzip"
+    assert grande.headers["vary"] == "Accept-Encoding"
+    assert int(grande.headers["content-length"]) < len(json.dumps(GRANDE))
+    assert grande.json() == GRANDE  # o httpx descomprime
+    assert "content-encoding" not in pequena.headers
+    assert "content-encoding" not in sem_aceite.headers
+
+
+async def test_middleware_nao_mexe_em_streaming_nem_em_corpo_ja_codificado():
+    async with AsyncClient(transport=ASGITransport(app=_app_teste()), base_url="http://t") as ac:
+        stream = await ac.get("/stream", headers={"Accept-Encoding": "gzip"})
+        codificada = await ac.get("/ja-comprimida", headers={"Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in stream.headers
+    assert stream.content == b"x" * 6144
+    assert codificada.text == "a" * 4096
+
+
+async def test_cache_serializa_e_comprime_uma_vez_por_versao():
+    cache = PrecompressedCache(min_bytes=1024)
+    carregar = AsyncMock(return_value=GRANDE)
+
+    primeira = await cache.resposta("produtos", 1, "gzip", carregar)
+    segunda = await cache.resposta("produtos", 1, "gzip", carregar)
+    identidade = await cache.resposta("produtos", 1, "", carregar)
+
+    assert carregar.await_count == 1
+    assert segunda.body is primeira.body
+    assert primeira.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(primeira.body)) == GRANDE
+    assert json.loads(identidade.body) == GRANDE
+    assert (cache.acertos, cache.falhas) == (2, 1)
+
+    await cache.resposta("produtos", 2, "gzip", carregar)
+    assert carregar.await_count == 2
+
+
+async def test_cache_responde_304_com_etag_da_versao():
+    cache = PrecompressedCache()
+    carregar = AsyncMock(return_value=GRANDE)
+
+    resposta = await cache.resposta("produtos", 7, "gzip", carregar)
+    nao_modificada = await cache.resposta(
+        "produtos", 7, "gzip", carregar, if_none_match=resposta.headers["etag"]
+    )
+    outra_versao = await cache.resposta(
+        "produtos", 8, "gzip", carregar, if_none_match=resposta.headers["etag"]
+    )
+
+    assert nao_modificada.status_code == 304
+    assert outra_versao.status_code == 200
+
+
+async def test_cache_serializa_uma_vez_com_requisicoes_simultaneas():
+    cache = PrecompressedCache()
+
+    async def carregar():
+        await asyncio.sleep(0.01)
+        return GRANDE
+
+    carregar_mock = AsyncMock(side_effect=carregar)
+    respostas = await asyncio.gather(
+        *(cache.resposta("produtos", 3, "gzip", carregar_mock) for _ in range(10))
+    )
+
+    assert carregar_mock.await_count == 1
+    assert len({id(r.body) for r in respostas}) == 1
@@ -0,0 +1,77 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import database
+from database import BACKOFF_MAX, Database, backoff_delay
+from main import app
+from repositories import HOT_STATEMENTS
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_backoff_delay_exponencial_com_teto():
+    """O atraso cresce exponencialmente mas nunca passa do teto"""
+    for attempt in range(1, 12):
+        atraso = backoff_delay(attempt)
+        assert 0 <= atraso <= min(BACKOFF_MAX, 0.5 * 2 ** (attempt - 1))
+
+
+async def test_connect_retenta_com_backoff(mocker):
+    """Falhas de conexão são retentadas com sleep de backoff, sem espera fixa"""
+    pool, jobs_pool = MagicMock(), MagicMock()
+    create_pool = mocker.patch(
+        "database.asyncpg.create_pool",
+        AsyncMock(side_effect=[OSError("down"), pool, jobs_pool]),
+    )
+    sleep = mocker.patch("database.asyncio.sleep", AsyncMock())
+
+    banco = Database()
+    await banco.connect()
+
+    assert banco.pool.inner is pool
+    # Os jobs ficam num pool à parte, fora das vagas da admissão
+    assert banco.jobs_pool.inner is jobs_pool
+    assert create_pool.await_args.kwargs["max_size"] == database.JOBS_POOL_MAX_SIZE
+    assert create_pool.await_count == 3
+    sleep.assert_awaited_once()
+    assert sleep.await_args.args[0] <= database.BACKOFF_BASE
+
+
+async def test_warm_up_prepara_conexoes_e_executa_warmers(mock_db_pool):
+    """O warm-up prepara os statements em todas as conexões mínimas e chama os warmers"""
+    _, conn_mock = mock_db_pool
+    pool = MagicMock()
+    pool.get_min_size.return_value = 3
+    pool.acquire = AsyncMock(return_value=conn_mock)
+    pool.release = AsyncMock()
+
+    banco = Database()
+    banco.pool = pool
+    warmer = AsyncMock()
+    banco.add_warmer(warmer)
+
+    await banco.warm_up()
+
+    assert pool.acquire.await_count == 3
+    assert pool.release.await_count == 3
+    assert conn_mock.fetch.await_count == 3 * len(HOT_STATEMENTS)
+    warmer.assert_awaited_once()
+
+
+async def test_health_ready_antes_e_depois_do_warm_up():
+    """/health/live responde sempre; /health/ready só depois do warm-up"""
+    original = database.db.ready
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        database.db.ready = False
+        live = await ac.get("/health/live")
+        nao_pronto = await ac.get("/health/ready")
+        database.db.ready = True
+        pronto = await ac.get("/health/ready")
+    database.db.ready = original
+
+    assert live.status_code == 200
+    assert nao_pronto.status_code == 503
+    assert pronto.status_code == 200
+    assert pronto.json()["status"] == "ready"
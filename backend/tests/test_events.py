@@ -0,0 +1,110 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import asyncpg
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import events
+from events import RECARREGAR, EventBroker, formatar_sse
+from main import app
+
+pytestmark = pytest.mark.asyncio
+
+
+class _BrokerSemBanco(EventBroker):
+    def iniciar(self):
+        pass
+
+
+async def test_notificacao_vai_para_todos_os_assinantes():
+    broker = _BrokerSemBanco()
+    filas = [broker.assinar() for _ in range(3)]
+    payload = {"tipo": "produto", "op": "UPDATE", "delta": {"estoque_baixo": -1}}
+
+    broker._notificacao(None, 1, "eventos", json.dumps(payload))
+
+    mensagens = [f.get_nowait() for f in filas]
+    assert mensagens[0] == formatar_sse("produto", payload)
+    # Formatado uma vez, o mesmo objeto para todos
+    assert all(m is mensagens[0] for m in mensagens)
+
+
+async def test_ouvinte_recebe_payload_decodificado():
+    broker = _BrokerSemBanco()
+    recebidos = []
+    broker.ouvir(lambda _dados: 1 / 0)
+    broker.ouvir(recebidos.append)
+
+    broker._notificacao(None, 1, "eventos", json.dumps({"tipo": "produto", "op": "DELETE"}))
+
+    # Um ouvinte que falha não impede os outros
+    assert recebidos == [{"tipo": "produto", "op": "DELETE"}]
+
+
+async def test_assinante_lento_recebe_recarregar(monkeypatch):
+    monkeypatch.setattr(events, "FILA_MAX", 2)
+    broker = _BrokerSemBanco()
+    fila = broker.assinar()
+
+    for i in range(3):
+        broker.publicar(formatar_sse("produto", {"i": i}))
+
+    assert fila.qsize() == 1
+    assert fila.get_nowait() == RECARREGAR
+
+
+async def test_stream_sse_entrega_eventos_e_encerra(mocker):
+    broker = _BrokerSemBanco()
+    mocker.patch("main.broker", broker)
+
+    async def publicar_quando_assinado():
+        while not broker.assinantes:
+            await asyncio.sleep(0.01)
+        broker.publicar(formatar_sse("produto", {"id": 1}))
+        broker.publicar(None)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        publicador = asyncio.create_task(publicar_quando_assinado())
+        response = await ac.get("/eventos")
+        await publicador
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert 'event: produto\ndata: {"id":1}' in response.text
+    assert not broker.assinantes
+
+
+def _conexao_listen(execute):
+    conn = MagicMock()
+    conn.add_listener = AsyncMock()
+    conn.execute = execute
+    conn.close = AsyncMock()
+    conn.is_closed.return_value = False
+    return conn
+
+
+async def test_health_check_com_interface_error_reconecta(mocker):
+    """Conexão morta no SELECT 1 (InterfaceError): o broker reconecta e avisa os ouvintes"""
+    mocker.patch.object(events, "KEEPALIVE_S", 0.001)
+    mocker.patch("events.backoff_delay", return_value=0)
+    morta = _conexao_listen(AsyncMock(side_effect=asyncpg.InterfaceError("conexão fechada")))
+    nova = _conexao_listen(AsyncMock())
+    connect = mocker.patch("events.asyncpg.connect", AsyncMock(side_effect=[morta, nova]))
+    broker = EventBroker("postgresql://teste")
+    recebidos = []
+    broker.ouvir(recebidos.append)
+
+    broker.iniciar()
+    try:
+        for _ in range(100):
+            if connect.await_count == 2 and broker._conectado.is_set():
+                break
+            await asyncio.sleep(0.01)
+        assert not broker._tarefa.done()
+    finally:
+        await broker.parar()
+
+    assert connect.await_count == 2
+    morta.terminate.assert_called_once()
+    assert recebidos == [{"tipo": "conectado"}, {"tipo": "conectado"}]
@@ -0,0 +1,132 @@
+import csv
+import io
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import exportacao
+from admission import classificar
+from exportacao import stream_produtos
+from main import app
+from repositories import filtro_sql
+from schemas import ProdutoFiltro
+
+pytestmark = pytest.mark.asyncio
+
+
+def _produto(i: int) -> dict:
+    return {
+        "id": i,
+        "nome": f'Produto "{i}", especial',
+        "preco": "9.90",
+        "unidade": "un",
+        "estoque": i,
+        "categoria_id": 1,
+        "categoria_nome": "Bebidas",
+    }
+
+
+class _Conexao:
+    def __init__(self, linhas):
+        self.linhas = linhas
+        self.consultas = []
+
+    def transaction(self, **opcoes):
+        self.opcoes_transacao = opcoes
+        return _Contexto(None)
+
+    def cursor(self, sql, *args, prefetch):
+        self.consultas.append((sql, args, prefetch))
+
+        async def gerar():
+            for linha in self.linhas:
+                yield linha
+
+        return gerar()
+
+
+class _Contexto:
+    def __init__(self, valor):
+        self.valor = valor
+
+    async def __aenter__(self):
+        return self.valor
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def _pool(conn):
+    pool = MagicMock()
+    pool.acquire.return_value = _Contexto(conn)
+    return pool
+
+
+async def _coletar(gerador) -> list[bytes]:
+    return [parte async for parte in gerador]
+
+
+async def test_filtro_sql_parametrizado():
+    where, args = filtro_sql(ProdutoFiltro(categoria_id=2, busca="café", em_estoque=False))
+
+    assert where == (
+        "WHERE p.categoria_id = $1 AND p.nome ILIKE '%' || $2 || '%' AND p.estoque = 0"
+    )
+    assert args == [2, "café"]
+    assert filtro_sql(ProdutoFiltro()) == ("", [])
+    assert ProdutoFiltro().vazio()
+
+
+async def test_csv_com_cabecalho_e_escape():
+    conn = _Conexao([_produto(1), _produto(2)])
+
+    partes = await _coletar(stream_produtos(_pool(conn), "csv"))
+
+    linhas = list(csv.reader(io.StringIO(b"".join(partes).decode())))
+    assert linhas[0] == list(exportacao.COLUNAS)
+    assert linhas[1][1] == 'Produto "1", especial'
+    assert len(linhas) == 3
+    # Snapshot único e somente leitura
+    assert conn.opcoes_transacao == {"isolation": "repeatable_read", "readonly": True}
+
+
+async def test_ndjson_em_blocos_limitados(monkeypatch):
+    monkeypatch.setattr(exportacao, "TAMANHO_CHUNK", 300)
+    conn = _Conexao([_produto(i) for i in range(50)])
+
+    partes = await _coletar(stream_produtos(_pool(conn), "ndjson", ProdutoFiltro(categoria_id=1)))
+
+    # Vários blocos, nenhum muito maior que o limite (uma linha a mais, no máximo)
+    assert len(partes) > 5
+    assert all(len(p) < 300 + 200 for p in partes)
+    registros = [json.loads(linha) for linha in b"".join(partes).decode().splitlines()]
+    assert [r["id"] for r in registros] == list(range(50))
+    sql, args, _ = conn.consultas[0]
+    assert "WHERE p.categoria_id = $1" in sql
+    assert args == (1,)
+
+
+async def test_rota_export_streaming(mocker):
+    from database import db
+
+    original_pool = db.pool
+    db.pool = _pool(_Conexao([_produto(1)]))
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            response = await ac.get("/produtos/export?format=ndjson&categoria_id=1")
+            invalido = await ac.get("/produtos/export?format=xml")
+    finally:
+        db.pool = original_pool
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert 'filename="produtos.ndjson"' in response.headers["content-disposition"]
+    assert json.loads(response.text)["id"] == 1
+    assert invalido.status_code == 422
+
+
+async def test_export_tem_classe_de_admissao_propria():
+    assert classificar("GET", "/produtos/export") == "export"
+    assert classificar("GET", "/produtos/1") == "leitura"
@@ -0,0 +1,45 @@
+import csv
+import io
+
+from gerar_dados import BLOCO, _dividir, lote_clientes, lote_produtos
+
+CATEGORIAS = [(1, 800.0), (2, 60.0), (3, 12.0)]
+
+
+def _linhas(dados: bytes) -> list[list[str]]:
+    return list(csv.reader(io.StringIO(dados.decode())))
+
+
+def test_lotes_nao_dependem_da_divisao():
+    """A mesma seed gera as mesmas linhas com qualquer tamanho de lote"""
+    inteiro = lote_produtos(42, 0, 1, 3 * BLOCO, CATEGORIAS)
+    partes = b"".join(
+        lote_produtos(42, inicio, 1, qtd, CATEGORIAS) for inicio, qtd in _dividir(3 * BLOCO, 1500)
+    )
+
+    assert partes == inteiro
+    assert lote_produtos(43, 0, 1, 3 * BLOCO, CATEGORIAS) != inteiro
+
+
+def test_dividir_arredonda_para_blocos():
+    lotes = list(_dividir(2 * BLOCO + 10, BLOCO + 1))
+
+    assert lotes == [(0, BLOCO), (BLOCO, BLOCO), (2 * BLOCO, 10)]
+
+
+def test_distribuicoes_de_produtos():
+    """Ids sequenciais, categorias mais populares primeiro e parte do estoque zerada"""
+    linhas = _linhas(lote_produtos(7, 0, 100, 5 * BLOCO, CATEGORIAS))
+
+    assert [int(linha[0]) for linha in linhas] == list(range(100, 100 + 5 * BLOCO))
+    por_categoria = [sum(linha[4] == str(cid) for linha in linhas) for cid, _ in CATEGORIAS]
+    assert por_categoria == sorted(por_categoria, reverse=True)
+    assert all(float(linha[2]) > 0 for linha in linhas)
+    assert 0 < sum(linha[5] == "0" for linha in linhas) < len(linhas) // 4
+
+
+def test_clientes_reaproveitam_hashes():
+    linhas = _linhas(lote_clientes(7, 0, 1, 50, ["h0", "h1"]))
+
+    assert {linha[3] for linha in linhas} == {"h0", "h1"}
+    assert len({linha[2] for linha in linhas}) == 50
@@ -106,3 +106,24 @@ async def test_obter_item_por_id_nao_encontrado(db_connection):
     assert "não encontrado" in response.json()["detail"].lower()
 
     app.dependency_overrides = {}
+
+
+async def test_itens_montados_no_app_principal(db_connection):
+    """As rotas de itens respondem pelo main.py, com a mesma dependência de conexão"""
+    from items import get_conn
+    from main import app as app_principal
+
+    row = await db_connection.fetchrow(
+        "INSERT INTO exemplo (nome) VALUES ($1) RETURNING id", "Item Principal"
+    )
+    app_principal.dependency_overrides[get_conn] = lambda: db_connection
+    try:
+        async with AsyncClient(
+            transport=ASGITransport(app=app_principal), base_url="http://test"
+        ) as ac:
+            response = await ac.get(f"/itens/{row['id']}")
+    finally:
+        app_principal.dependency_overrides = {}
+
+    assert response.status_code == 200
+    assert response.json()["nome"] == "Item Principal"
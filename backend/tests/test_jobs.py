@@ -0,0 +1,279 @@
+import asyncio
+from datetime import date
+from unittest.mock import AsyncMock, MagicMock
+
+import asyncpg
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import jobs
+from jobs import JobCancelado, JobContext, JobRunner, job_handler
+from main import app
+
+pytestmark = pytest.mark.asyncio
+
+
+def _pool_mock(conn):
+    pool = MagicMock()
+    acquire = AsyncMock()
+    acquire.__aenter__ = AsyncMock(return_value=conn)
+    acquire.__aexit__ = AsyncMock(return_value=None)
+    pool.acquire.return_value = acquire
+    return pool
+
+
+def _runner(conn) -> JobRunner:
+    runner = JobRunner()
+    runner.pool = _pool_mock(conn)
+    return runner
+
+
+def _sql_final(conn) -> str:
+    return conn.execute.await_args.args[0]
+
+
+@pytest.fixture
+def handler_teste():
+    chamadas = []
+
+    @job_handler("teste")
+    async def executar(ctx, params):
+        chamadas.append(params)
+        if params.get("erro"):
+            raise RuntimeError("quebrou")
+        if params.get("cancelar"):
+            raise JobCancelado()
+        return {"ok": True}
+
+    yield chamadas
+    jobs.HANDLERS.pop("teste", None)
+
+
+async def test_enfileirar_rejeita_tipo_desconhecido():
+    conn = MagicMock()
+    conn.fetchval = AsyncMock()
+
+    with pytest.raises(ValueError):
+        await jobs.enfileirar(conn, "nao_existe", {})
+
+    conn.fetchval.assert_not_awaited()
+
+
+async def test_executar_marca_concluido_com_resultado(handler_teste):
+    conn = MagicMock()
+    conn.execute = AsyncMock()
+    job = {"id": 7, "tipo": "teste", "params": {}, "tentativas": 1, "max_tentativas": 3}
+
+    runner = _runner(conn)
+    await runner._executar(job)
+
+    assert handler_teste == [{}]
+    assert "status = 'concluido'" in _sql_final(conn)
+    assert conn.execute.await_args.args[1:] == (7, runner.trabalhador, '{"ok": true}')
+
+
+async def test_executar_reagenda_com_backoff_enquanto_ha_tentativas(handler_teste):
+    conn = MagicMock()
+    conn.execute = AsyncMock()
+    job = {"id": 7, "tipo": "teste", "params": {"erro": 1}, "tentativas": 2, "max_tentativas": 3}
+
+    await _runner(conn)._executar(job)
+
+    assert "status = 'pendente'" in _sql_final(conn)
+    _, _, _, erro, atraso = conn.execute.await_args.args
+    assert erro == "RuntimeError: quebrou"
+    assert atraso == jobs.RETRY_BASE_S * 2
+
+
+async def test_executar_falha_apos_ultima_tentativa(handler_teste):
+    conn = MagicMock()
+    conn.execute = AsyncMock()
+    job = {"id": 7, "tipo": "teste", "params": {"erro": 1}, "tentativas": 3, "max_tentativas": 3}
+
+    await _runner(conn)._executar(job)
+
+    assert "status = 'falhou'" in _sql_final(conn)
+
+
+async def test_executar_marca_cancelado(handler_teste):
+    conn = MagicMock()
+    conn.execute = AsyncMock()
+    job = {
+        "id": 7,
+        "tipo": "teste",
+        "params": {"cancelar": 1},
+        "tentativas": 1,
+        "max_tentativas": 3,
+    }
+
+    await _runner(conn)._executar(job)
+
+    assert "status = 'cancelado'" in _sql_final(conn)
+
+
+async def test_progresso_levanta_quando_cancelamento_foi_pedido():
+    conn = MagicMock()
+    conn.fetchval = AsyncMock(return_value=True)
+    ctx = JobContext(_pool_mock(conn), 7, {}, "host:1")
+
+    with pytest.raises(JobCancelado):
+        await ctx.progresso(0.5, "metade")
+
+    # Fração fora de [0, 1] é limitada
+    conn.fetchval = AsyncMock(return_value=False)
+    await ctx.progresso(3.0)
+    assert conn.fetchval.await_args.args[2] == 1.0
+
+
+async def test_execucao_que_perdeu_o_job_nao_grava_o_resultado():
+    """Job devolvido à fila e pego por outro: o progresso não acha a linha e a execução para"""
+    chamadas = []
+
+    @job_handler("perdido")
+    async def executar(ctx, params):
+        await ctx.progresso(0.5)
+        chamadas.append("depois do progresso")
+
+    conn = MagicMock()
+    conn.fetchval = AsyncMock(return_value=None)
+    conn.execute = AsyncMock()
+    job = {"id": 7, "tipo": "perdido", "params": {}, "tentativas": 1, "max_tentativas": 3}
+    try:
+        await _runner(conn)._executar(job)
+    finally:
+        jobs.HANDLERS.pop("perdido", None)
+
+    assert chamadas == []
+    conn.execute.assert_not_awaited()
+    assert "AND trabalhador = $4" in conn.fetchval.await_args.args[0]
+
+
+async def test_heartbeat_periodico_durante_passo_longo(mocker):
+    """Um passo sem ctx.progresso continua renovando o heartbeat do job"""
+    mocker.patch.object(jobs, "JOBS_HEARTBEAT_S", 0.01)
+    passo = asyncio.Event()
+
+    @job_handler("longo")
+    async def executar(ctx, params):
+        await passo.wait()
+
+    conn = MagicMock()
+    conn.execute = AsyncMock()
+    runner = _runner(conn)
+    job = {"id": 7, "tipo": "longo", "params": {}, "tentativas": 1, "max_tentativas": 3}
+    try:
+        tarefa = asyncio.create_task(runner._executar(job))
+        await asyncio.sleep(0.05)
+        batimentos = [c.args for c in conn.execute.await_args_list]
+        passo.set()
+        await tarefa
+    finally:
+        jobs.HANDLERS.pop("longo", None)
+
+    assert len(batimentos) >= 2
+    assert all("heartbeat_em = now()" in sql for sql, *_ in batimentos)
+    assert batimentos[0][1:] == (7, runner.trabalhador)
+    assert "status = 'concluido'" in _sql_final(conn)
+    assert "AND trabalhador = $2" in _sql_final(conn)
+
+
+async def test_falha_ao_pegar_job_devolve_a_vaga_e_o_laco_continua(mocker):
+    """Erros transitórios na fila (de qualquer tipo) não consomem vagas nem param o laço"""
+    mocker.patch.object(jobs, "JOBS_BACKOFF_MAX_S", 0.001)
+    conn = MagicMock()
+    conn.execute = AsyncMock()
+    conn.fetchrow = AsyncMock(
+        side_effect=[
+            OSError("caiu"),
+            asyncpg.InterfaceError("conexão fechada"),
+            TimeoutError(),
+            None,
+            None,
+        ]
+    )
+    runner = JobRunner(concorrencia=2, intervalo=0.001)
+    await runner.iniciar(_pool_mock(conn))
+    try:
+        for _ in range(100):
+            if conn.fetchrow.await_count >= 4:
+                break
+            await asyncio.sleep(0.01)
+        assert not runner._loop_task.done()
+    finally:
+        await runner.parar()
+
+    assert conn.fetchrow.await_count >= 4
+    assert runner._vagas._value == 2
+
+
+async def test_rotas_de_job_404_409_e_400(mocker):
+    from database import db
+
+    original_pool = db.pool
+    db.pool = _pool_mock(MagicMock())
+    mocker.patch("main.jobs.obter", AsyncMock(return_value=None))
+    mocker.patch("main.jobs.cancelar", AsyncMock(return_value=None))
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        inexistente = await ac.get("/jobs/99")
+        cancelar_inexistente = await ac.post("/jobs/99/cancelar")
+        jobs.obter.return_value = {"id": 1, "status": "concluido"}
+        cancelar_finalizado = await ac.post("/jobs/1/cancelar")
+        tipo_invalido = await ac.post("/jobs", json={"tipo": "nao_existe"})
+
+    db.pool = original_pool
+
+    assert inexistente.status_code == 404
+    assert cancelar_inexistente.status_code == 404
+    assert cancelar_finalizado.status_code == 409
+    assert tipo_invalido.status_code == 400
+
+
+async def test_compactar_vendas_reconstroi_dias_divergentes(mocker):
+    repo = MagicMock()
+    repo.compactar = AsyncMock(return_value={"linhas_hora_apagadas": 0})
+    repo.conferir = AsyncMock(return_value=[date(2026, 5, 2)])
+    repo.reconstruir = AsyncMock()
+    mocker.patch("jobs.VendasRepository", return_value=repo)
+    conn = MagicMock()
+    conn.fetchval = AsyncMock(return_value=False)
+    ctx = JobContext(_pool_mock(conn), 7, {}, "host:1")
+
+    resultado = await jobs.compactar_vendas(ctx, {"de": "2026-05-01", "ate": "2026-05-03"})
+
+    repo.compactar.assert_awaited_once_with(jobs.RETENCAO_VENDAS_HORA_DIAS)
+    repo.conferir.assert_awaited_once_with(date(2026, 5, 1), date(2026, 5, 3))
+    repo.reconstruir.assert_awaited_once_with(date(2026, 5, 2), date(2026, 5, 2))
+    assert resultado["reconstruidos"] == ["2026-05-02"]
+
+
+async def test_relacionados_incremental_recalcula_so_os_produtos_dos_pedidos_novos(mocker):
+    mocker.patch.object(jobs, "RELACIONADOS_LOTE_PEDIDOS", 10)
+    repo = MagicMock()
+    repo.conn.fetchval = AsyncMock()
+    repo.marcas = AsyncMock(return_value=(100, 125))
+    repo.contar_pedidos = AsyncMock(side_effect=[[3, 1], [1, 2], [5]])
+    repo.atualizar_populares = AsyncMock()
+    repo.recalcular = AsyncMock()
+    repo.zerar = AsyncMock()
+    mocker.patch("jobs.RelacionadosRepository", return_value=repo)
+    conn = MagicMock()
+    conn.fetchval = AsyncMock(side_effect=[True, False, False, False, False])
+    conn.execute = AsyncMock()
+    ctx = JobContext(_pool_mock(conn), 7, {}, "host:1")
+
+    resultado = await jobs.relacionados(ctx, {})
+
+    assert [c.args for c in repo.contar_pedidos.await_args_list] == [
+        (100, 110),
+        (110, 120),
+        (120, 125),
+    ]
+    repo.recalcular.assert_awaited_once_with([1, 2, 3, 5], jobs.RELACIONADOS_K)
+    repo.zerar.assert_not_awaited()
+    assert resultado["ultimo_pedido"] == 125
+    # O lock é liberado no fim
+    assert "pg_advisory_unlock" in conn.execute.await_args.args[0]
+
+    conn.fetchval = AsyncMock(return_value=False)
+    assert "ignorado" in await jobs.relacionados(ctx, {})
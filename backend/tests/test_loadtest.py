@@ -0,0 +1,38 @@
+import pytest
+
+from benchmarks.loadtest import Amostras, comparar_baseline, percentil, resumir
+
+
+def test_percentil_nearest_rank():
+    valores = [float(v) for v in range(1, 101)]
+
+    assert percentil(valores, 50) == 50.0
+    assert percentil(valores, 95) == 95.0
+    assert percentil(valores, 99) == 99.0
+    assert percentil([], 95) == 0.0
+
+
+def test_resumir_conta_erros_e_rejeicoes():
+    amostras = Amostras()
+    amostras.registrar(0.010, 200)
+    amostras.registrar(0.020, 404)
+    amostras.registrar(0.030, 503)
+
+    resumo = resumir(amostras, duracao=1.5)
+
+    assert resumo["requisicoes"] == 3
+    assert resumo["rps"] == 2.0
+    assert resumo["p50_ms"] == pytest.approx(20.0)
+    assert resumo["erros"] == 1
+    assert resumo["rejeitadas"] == 1
+
+
+def test_comparar_baseline_detecta_regressao():
+    baseline = {"cenarios": {"detalhe": {"rps": 600.0, "p95_ms": 20.0}}}
+    dentro = {"cenarios": {"detalhe": {"rps": 560.0, "p95_ms": 23.0}}}
+    fora = {"cenarios": {"detalhe": {"rps": 400.0, "p95_ms": 30.0}}}
+
+    assert comparar_baseline(dentro, baseline, limite=0.2) == []
+    regressoes = comparar_baseline(fora, baseline, limite=0.2)
+    assert len(regressoes) == 2
+    assert all(r.startswith("detalhe") for r in regressoes)
@@ -4,7 +4,7 @@ from unittest.mock import AsyncMock, patch
 import pytest
 from httpx import ASGITransport, AsyncClient
 
-from login import app
+from login import SESSION_COOKIE, SESSION_TTL, app, session_key
 
 pytestmark = pytest.mark.asyncio
 
@@ -30,7 +30,7 @@ async def test_login_sucesso(mock_redis):
     assert response.status_code == 200
     assert response.json()["msg"] == "logado"
     # Verifica se cookie foi setado
-    assert "session_id" in response.cookies
+    assert SESSION_COOKIE in response.cookies
 
 
 async def test_login_credenciais_invalidas_usuario_inexistente(mock_redis):
@@ -69,13 +69,13 @@ async def test_logout_sucesso(mock_redis):
         mock_redis.set = AsyncMock()
 
         login_response = await ac.post("/login", json={"username": "alice", "password": "senha123"})
-        session_id = login_response.cookies.get("session_id")
+        session_id = login_response.cookies.get(SESSION_COOKIE)
 
         # Agora faz logout
         mock_redis.get.return_value = json.dumps(
             {"user_id": 1, "username": "alice", "role": "admin"}
         )
-        response = await ac.post("/logout", cookies={"session_id": session_id})
+        response = await ac.post("/logout", cookies={SESSION_COOKIE: session_id})
 
     assert response.status_code == 200
     assert response.json()["msg"] == "deslogado"
@@ -92,10 +92,10 @@ async def test_profile_nao_autenticado():
 async def test_admin_sem_permissao(mock_redis):
     """Testa acesso à área admin sem ser admin"""
     session_data = {"user_id": 2, "username": "bob", "role": "user"}
-    mock_redis.get.return_value = json.dumps(session_data)
+    mock_redis.getex.return_value = json.dumps(session_data)
 
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
-        response = await ac.get("/admin", cookies={"session_id": "fake_session"})
+        response = await ac.get("/admin", cookies={SESSION_COOKIE: "fake_session"})
 
     assert response.status_code == 403
 
@@ -103,10 +103,56 @@ async def test_admin_sem_permissao(mock_redis):
 async def test_admin_com_permissao(mock_redis):
     """Testa acesso à área admin sendo admin"""
     session_data = {"user_id": 1, "username": "alice", "role": "admin"}
-    mock_redis.get.return_value = json.dumps(session_data)
+    mock_redis.getex.return_value = json.dumps(session_data)
 
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
-        response = await ac.get("/admin", cookies={"session_id": "fake_session"})
+        response = await ac.get("/admin", cookies={SESSION_COOKIE: "fake_session"})
 
     assert response.status_code == 200
     assert "admin" in response.json()["msg"].lower()
+
+
+async def test_profile_renova_sessao_num_comando(mock_redis):
+    """Sessão deslizante: GETEX renova o TTL e o cookie volta com o prazo cheio"""
+    mock_redis.getex.return_value = json.dumps({"user_id": 2, "username": "bob", "role": "user"})
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.get("/profile", cookies={SESSION_COOKIE: "sessao"})
+
+    assert response.status_code == 200
+    mock_redis.getex.assert_awaited_once_with(session_key("sessao"), ex=SESSION_TTL)
+    mock_redis.get.assert_not_called()
+    assert f"Max-Age={SESSION_TTL}" in response.headers["set-cookie"]
+
+
+async def test_cookie_nao_alcanca_outras_chaves(mock_redis):
+    """O cookie só endereça chaves de sessão: ``user:alice`` não lê nem apaga o cadastro"""
+    mock_redis.getex.return_value = None
+    mock_redis.delete = AsyncMock()
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        perfil = await ac.get("/profile", cookies={SESSION_COOKIE: "user:alice"})
+        await ac.post("/logout", cookies={SESSION_COOKIE: "user:alice"})
+
+    assert perfil.status_code == 401
+    mock_redis.getex.assert_awaited_once_with("login_session:user:alice", ex=SESSION_TTL)
+    mock_redis.delete.assert_awaited_once_with("login_session:user:alice")
+
+
+async def test_rotas_de_sessao_montadas_no_app_principal(mock_redis):
+    """No main.py as rotas ficam sob /sessao (o /login de lá é o dos clientes)"""
+    from main import app as app_principal
+
+    mock_redis.getex.return_value = json.dumps({"user_id": 1, "username": "alice", "role": "admin"})
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app_principal), base_url="http://test"
+    ) as ac:
+        sem_cookie = await ac.get("/sessao/profile")
+        # o cookie do cadastro (/contas) não vale para as rotas de /sessao
+        cookie_do_cadastro = await ac.get("/sessao/profile", cookies={"session_id": "sessao"})
+        admin = await ac.get("/sessao/admin", cookies={SESSION_COOKIE: "sessao"})
+
+    assert admin.status_code == 200
+    assert sem_cookie.status_code == 401
+    assert cookie_do_cadastro.status_code == 401
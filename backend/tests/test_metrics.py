@@ -0,0 +1,125 @@
+import os
+from unittest.mock import AsyncMock
+
+import asyncpg
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import metrics
+from main import app
+from metrics import DB_QUERY_ROWS, DB_QUERY_SECONDS, Histogram, InstrumentedConnection
+
+pytestmark = pytest.mark.asyncio
+
+TEST_DB_URL = os.getenv("TEST_DB_URL", "postgresql://user:pass@db:5432/test_db")
+
+
+class _ConexaoFalsa(InstrumentedConnection):
+    """Instância sem socket: os métodos do asyncpg são substituídos por mocks."""
+
+    def __del__(self):
+        pass
+
+
+def _conexao():
+    return object.__new__(_ConexaoFalsa)
+
+
+async def _listar_algo(conn):
+    return await conn.fetch("SELECT id FROM produto")
+
+
+async def test_histograma_formato_prometheus():
+    """Buckets cumulativos, +Inf, _sum e _count por série"""
+    hist = Histogram("teste_segundos", "ajuda", ("rota",), buckets=(0.1, 1.0))
+    hist.observe(0.05, "/a")
+    hist.observe(0.5, "/a")
+    hist.observe(3.0, "/a")
+
+    texto = "\n".join(hist.render())
+
+    assert "# TYPE teste_segundos histogram" in texto
+    assert 'teste_segundos_bucket{rota="/a",le="0.1"} 1' in texto
+    assert 'teste_segundos_bucket{rota="/a",le="1.0"} 2' in texto
+    assert 'teste_segundos_bucket{rota="/a",le="+Inf"} 3' in texto
+    assert 'teste_segundos_count{rota="/a"} 3' in texto
+
+
+async def test_consulta_nomeada_pelo_chamador(mocker):
+    """A consulta é registrada com o nome da função que a executou"""
+    mocker.patch.object(asyncpg.Connection, "fetch", AsyncMock(return_value=[1, 2, 3]))
+    conn = _conexao()
+
+    rows = await _listar_algo(conn)
+
+    assert rows == [1, 2, 3]
+    nomes = [chave[0] for chave in DB_QUERY_SECONDS.series]
+    nome = next(n for n in nomes if n.endswith("._listar_algo"))
+    assert DB_QUERY_ROWS.valores[(nome,)] >= 3
+
+
+async def test_consulta_com_erro_e_nome_explicito(mocker):
+    """Erros são contados por tipo; query_name sobrepõe o nome automático"""
+    mocker.patch.object(
+        asyncpg.Connection, "execute", AsyncMock(side_effect=asyncpg.QueryCanceledError("x"))
+    )
+    conn = _conexao()
+
+    with pytest.raises(asyncpg.QueryCanceledError):
+        await conn.execute("UPDATE produto SET estoque = 0", query_name="zerar_estoque")
+
+    assert metrics.DB_QUERY_ERRORS.valores[("zerar_estoque", "QueryCanceledError")] >= 1
+
+
+async def test_consulta_lenta_vai_para_o_log(mocker, capsys):
+    """Acima do limite, a consulta e seus parâmetros aparecem no log"""
+    mocker.patch.object(asyncpg.Connection, "fetchrow", AsyncMock(return_value=None))
+    mocker.patch("metrics.SLOW_QUERY_MS", 0)
+    conn = _conexao()
+
+    await conn.fetchrow("SELECT * FROM produto WHERE id=$1", 42, query_name="produto_por_id")
+
+    saida = capsys.readouterr().out
+    assert "Consulta lenta" in saida
+    assert "produto_por_id" in saida
+    assert "42" in saida
+
+
+async def test_explain_da_consulta_lenta_nao_repete_escrita(mocker, capsys):
+    """Um WITH com UPDATE amostrado pelo EXPLAIN ANALYZE é aplicado uma vez só"""
+    mocker.patch("metrics.SLOW_QUERY_MS", 0)
+    mocker.patch("metrics.SLOW_QUERY_EXPLAIN_SAMPLE", 1.0)
+    conn = await asyncpg.connect(TEST_DB_URL, connection_class=InstrumentedConnection)
+    tr = conn.transaction()
+    await tr.start()
+    try:
+        await conn.execute("CREATE TEMP TABLE preco_teste (id INT PRIMARY KEY, preco NUMERIC)")
+        await conn.execute("INSERT INTO preco_teste VALUES (1, 100)")
+
+        novo = await conn.fetchval(
+            """
+            WITH alterado AS (
+                UPDATE preco_teste SET preco = preco * $1 WHERE id = 1 RETURNING preco
+            )
+            SELECT preco FROM alterado
+            """,
+            1.1,
+        )
+
+        assert "Update on preco_teste" in capsys.readouterr().out
+        assert novo == await conn.fetchval("SELECT preco FROM preco_teste WHERE id = 1")
+        assert float(novo) == pytest.approx(110)
+    finally:
+        await tr.rollback()
+        await conn.close()
+
+
+async def test_endpoint_metrics_com_latencia_por_rota():
+    """/metrics expõe a latência HTTP pelo template da rota"""
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        await ac.get("/health/live")
+        response = await ac.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'route="/health/live"' in response.text
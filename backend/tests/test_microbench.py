@@ -0,0 +1,51 @@
+from benchmarks.microbench import comparar, resumir_plano
+
+
+def _resultado(p50: float, plano: list[str]) -> dict:
+    return {
+        "tamanhos": {
+            "100000": {
+                "repositorios": {"ProdutoRepository.get_by_id": {"p50_us": p50, "planos": [plano]}}
+            }
+        }
+    }
+
+
+def test_resumir_plano_sem_custos():
+    explain = {
+        "Node Type": "Nested Loop",
+        "Total Cost": 12.5,
+        "Plans": [
+            {"Node Type": "Index Scan", "Index Name": "produto_pkey", "Relation Name": "produto"},
+            {"Node Type": "Seq Scan", "Relation Name": "categoria"},
+        ],
+    }
+
+    assert resumir_plano(explain) == [
+        "Nested Loop",
+        "Index Scan using produto_pkey on produto",
+        "Seq Scan on categoria",
+    ]
+
+
+def test_comparar_aceita_variacao_dentro_do_limite():
+    plano = ["Index Scan using produto_pkey on produto"]
+    assert comparar(_resultado(45.0, plano), _resultado(40.0, plano), limite=0.3) == []
+
+
+def test_comparar_acusa_index_scan_que_virou_seq_scan():
+    baseline = _resultado(40.0, ["Index Scan using produto_pkey on produto"])
+    atual = _resultado(40.0, ["Seq Scan on produto"])
+
+    problemas = comparar(atual, baseline, limite=0.3)
+
+    assert len(problemas) == 1
+    assert "plano mudou" in problemas[0]
+
+
+def test_comparar_acusa_regressao_de_tempo():
+    plano = ["Index Scan using produto_pkey on produto"]
+
+    problemas = comparar(_resultado(80.0, plano), _resultado(40.0, plano), limite=0.3)
+
+    assert problemas == ["[100000] ProdutoRepository.get_by_id: p50 40.0 µs -> 80.0 µs"]
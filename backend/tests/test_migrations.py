@@ -0,0 +1,57 @@
+from unittest.mock import AsyncMock
+
+import asyncpg
+import pytest
+
+from migrations import LATEST_VERSION, MIGRATION_LOCK_ID, current_version, migrate
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_current_version_sem_tabela(mock_db_pool):
+    """Banco novo (sem schema_version) é tratado como versão 0"""
+    _, conn_mock = mock_db_pool
+    conn_mock.fetchval.side_effect = asyncpg.UndefinedTableError("schema_version")
+
+    assert await current_version(conn_mock) == 0
+
+
+async def test_migrate_banco_atualizado_faz_uma_consulta(mock_db_pool):
+    """Com o banco na última versão, o worker só confere a versão e segue"""
+    _, conn_mock = mock_db_pool
+    conn_mock.fetchval.return_value = LATEST_VERSION
+
+    aplicadas = await migrate(conn_mock)
+
+    assert aplicadas == []
+    conn_mock.fetchval.assert_awaited_once()
+    conn_mock.execute.assert_not_called()
+
+
+async def test_migrate_aplica_pendentes_com_lock(mock_db_pool):
+    """Migrações pendentes são aplicadas sob advisory lock, uma transação por versão"""
+    _, conn_mock = mock_db_pool
+    conn_mock.fetchval.return_value = 0
+
+    aplicadas = await migrate(conn_mock)
+
+    assert aplicadas == list(range(1, LATEST_VERSION + 1))
+    chamadas = [c.args for c in conn_mock.execute.await_args_list]
+    assert chamadas[0] == ("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+    assert chamadas[-1] == ("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+    assert conn_mock.transaction.call_count == LATEST_VERSION
+
+
+async def test_migrate_outro_worker_ja_migrou(mock_db_pool):
+    """Se outro processo migrou enquanto esperávamos o lock, nada é reaplicado"""
+    _, conn_mock = mock_db_pool
+    conn_mock.fetchval = AsyncMock(side_effect=[0, LATEST_VERSION])
+
+    aplicadas = await migrate(conn_mock)
+
+    assert aplicadas == []
+    conn_mock.transaction.assert_not_called()
+    assert conn_mock.execute.await_args_list[-1].args == (
+        "SELECT pg_advisory_unlock($1)",
+        MIGRATION_LOCK_ID,
+    )
@@ -1,11 +1,19 @@
 import os
+from datetime import UTC, date, datetime, timedelta, timezone
+from decimal import Decimal
 
 import asyncpg
 import pytest
 import pytest_asyncio
 
-from repositories import CategoriaRepository, ProdutoRepository
-from schemas import CategoriaIn, ProdutoIn, ProdutoUpdate
+from repositories import (
+    CategoriaRepository,
+    DashboardRepository,
+    ProdutoRepository,
+    RelacionadosRepository,
+    VendasRepository,
+)
+from schemas import AjusteProdutosIn, CategoriaIn, ProdutoFiltro, ProdutoIn, ProdutoUpdate
 
 TEST_DB_URL = os.getenv("TEST_DB_URL", "postgresql://user:pass@db:5432/test_db")
 
@@ -181,3 +189,194 @@ async def test_produto_repository_update(db_connection):
 
     assert produto_atualizado["nome"] == "Produto Atualizado"
     assert float(produto_atualizado["preco"]) == 20.0
+
+
+@pytest.mark.asyncio
+async def test_rollups_de_vendas_batem_com_os_pedidos(db_connection):
+    """Os triggers mantêm os rollups iguais às somas dos pedidos (e a conferência acusa desvios)"""
+    conn = db_connection
+    cat_id = await CategoriaRepository(conn).create(CategoriaIn(nome="Cat Vendas"))
+    prod_repo = ProdutoRepository(conn)
+    a = await prod_repo.create(
+        ProdutoIn(nome="Vendido A", preco=10.0, unidade="un", categoria_id=cat_id)
+    )
+    b = await prod_repo.create(
+        ProdutoIn(nome="Vendido B", preco=4.5, unidade="un", categoria_id=cat_id)
+    )
+    cliente = await conn.fetchval(
+        "INSERT INTO cliente (nome, email, senha_hash) VALUES ('V', 'vendas@teste', 'x') "
+        "RETURNING id"
+    )
+
+    # Um dia bem no futuro, para não somar com outros dados do banco de testes
+    loja = timezone(timedelta(hours=-3))
+    vendas = [
+        (datetime(2031, 3, 10, 9, 15, tzinfo=loja), [(a, 2, 10), (b, 1, Decimal("4.5"))]),
+        (datetime(2031, 3, 10, 9, 50, tzinfo=loja), [(a, 1, 10)]),
+        # 02:30 UTC do dia 11, mas ainda dia 10 no fuso da loja
+        (datetime(2031, 3, 10, 23, 30, tzinfo=loja), [(b, 4, Decimal("4.5"))]),
+    ]
+    for criado_em, itens in vendas:
+        subtotal = sum(qtd * preco for _, qtd, preco in itens)
+        pedido_id = await conn.fetchval(
+            "INSERT INTO pedido (cliente_id, subtotal, frete, total, quantidade_itens, criado_em) "
+            "VALUES ($1, $2::numeric, 25, $2::numeric + 25, $3, $4) RETURNING id",
+            cliente,
+            subtotal,
+            sum(qtd for _, qtd, _ in itens),
+            criado_em,
+        )
+        await conn.executemany(
+            "INSERT INTO pedido_item (pedido_id, linha, produto_id, nome, preco_unitario, "
+            "quantidade) VALUES ($1, $2, $3, 'x', $4, $5)",
+            [(pedido_id, i, p, preco, qtd) for i, (p, qtd, preco) in enumerate(itens, 1)],
+        )
+
+    repo = VendasRepository(conn)
+    dia = date(2031, 3, 10)
+    serie = await repo.serie("dia", dia, dia + timedelta(days=1))
+    assert [(r["pedidos"], Decimal(r["receita"])) for r in serie] == [
+        (3, Decimal("127.5")),
+        (0, Decimal(0)),
+    ]
+
+    horas = await repo.serie(
+        "hora", datetime(2031, 3, 10, 12, tzinfo=UTC), datetime(2031, 3, 10, 13, tzinfo=UTC)
+    )
+    assert [r["pedidos"] for r in horas] == [2, 0]
+
+    top = await repo.top_produtos("dia", dia, dia, 5)
+    assert [(r["produto_id"], r["quantidade"], Decimal(r["receita"])) for r in top] == [
+        (a, 3, Decimal(30)),
+        (b, 5, Decimal("22.5")),
+    ]
+    categorias = await repo.por_categoria("dia", dia, dia)
+    assert [(r["categoria_id"], Decimal(r["receita"])) for r in categorias] == [
+        (cat_id, Decimal("52.5"))
+    ]
+
+    assert await repo.conferir(dia, dia) == []
+    await conn.execute("UPDATE venda_dia SET receita = receita + 1 WHERE dia = $1", dia)
+    assert await repo.conferir(dia, dia) == [dia]
+    await repo.reconstruir(dia, dia)
+    assert await repo.conferir(dia, dia) == []
+
+
+@pytest.mark.asyncio
+async def test_relacionados_por_compras_em_comum_e_populares_da_categoria(db_connection):
+    conn = db_connection
+    cat_id = await CategoriaRepository(conn).create(CategoriaIn(nome="Cat Relacionados"))
+    prod_repo = ProdutoRepository(conn)
+    a, b, c, d, novo = [
+        await prod_repo.create(
+            ProdutoIn(nome=f"Relacionado {n}", preco=1.0, unidade="un", categoria_id=cat_id)
+        )
+        for n in "ABCDE"
+    ]
+    cliente = await conn.fetchval(
+        "INSERT INTO cliente (nome, email, senha_hash) VALUES ('R', 'relacionados@teste', 'x') "
+        "RETURNING id"
+    )
+    pedidos = []
+    for itens in [[a, b], [a, b], [a, b], [a, c], [d], [d]]:
+        pedido_id = await conn.fetchval(
+            "INSERT INTO pedido (cliente_id, subtotal, frete, total, quantidade_itens) "
+            "VALUES ($1, 1, 0, 1, 1) RETURNING id",
+            cliente,
+        )
+        await conn.executemany(
+            "INSERT INTO pedido_item (pedido_id, linha, produto_id, nome, preco_unitario, "
+            "quantidade) VALUES ($1, $2, $3, 'x', 1, 1)",
+            [(pedido_id, i, p) for i, p in enumerate(itens, 1)],
+        )
+        pedidos.append(pedido_id)
+
+    repo = RelacionadosRepository(conn)
+    afetados = await repo.contar_pedidos(pedidos[0] - 1, pedidos[-1])
+    assert sorted(afetados) == [a, b, c, d]
+    await repo.atualizar_populares()
+    await repo.recalcular(afetados)
+
+    # b (3 de 3 pedidos junto com a) antes de c (1 pedido); a categoria completa
+    assert [r["id"] for r in await repo.listar(a, 10)] == [b, c, d, novo]
+    assert [r["id"] for r in await repo.listar(b, 1)] == [a]
+    # Sem vizinhos calculados: os mais vendidos da categoria, sem o próprio produto
+    assert [r["id"] for r in await repo.listar(novo, 10)] == [a, b, d, c]
+
+
+@pytest.mark.asyncio
+async def test_ajuste_em_massa_previa_e_lotes(db_connection):
+    conn = db_connection
+    cat_id = await CategoriaRepository(conn).create(CategoriaIn(nome="Cat Ajuste"))
+    prod_repo = ProdutoRepository(conn)
+    ids = [
+        await prod_repo.create(
+            ProdutoIn(nome=f"Ajuste {n}", preco=preco, unidade="un", categoria_id=cat_id, estoque=e)
+        )
+        for n, preco, e in [("A", 10.0, 5), ("B", 20.0, 0), ("C", 100.0, 2)]
+    ]
+    filtro = ProdutoFiltro(categoria_id=cat_id)
+    aumento = AjusteProdutosIn(filtro=filtro, preco_percentual=8, dry_run=True)
+
+    previa = await prod_repo.prever_ajuste(aumento)
+    assert previa["produtos"] == 3
+    assert previa["preco_max_depois"] == Decimal("108.00")
+    # A prévia não altera nada
+    assert (await prod_repo.get_by_id(ids[0]))["preco"] == Decimal("10.0")
+
+    # Lotes de 2: o segundo começa depois do último id do primeiro
+    primeiro = await prod_repo.ajustar_lote(aumento, 0, 2)
+    segundo = await prod_repo.ajustar_lote(aumento, primeiro["ultimo_id"], 2)
+    assert (primeiro["produtos"], segundo["produtos"]) == (2, 1)
+    assert primeiro["preco_soma_antes"] == Decimal("30")
+    assert primeiro["preco_soma_depois"] == Decimal("32.40")
+    assert [(await prod_repo.get_by_id(pid))["preco"] for pid in ids] == [
+        Decimal("10.80"),
+        Decimal("21.60"),
+        Decimal("108.00"),
+    ]
+
+    # Estoque nunca fica negativo; quem já estava em 0 não conta como alterado
+    baixa = AjusteProdutosIn(filtro=filtro, estoque_delta=-3)
+    resumo = await prod_repo.ajustar_lote(baixa, 0, 10)
+    assert (resumo["alterados"], resumo["sem_estoque_depois"]) == (2, 2)
+    assert [(await prod_repo.get_by_id(pid))["estoque"] for pid in ids] == [2, 0, 0]
+
+    # Valor absoluto: o preço não fica negativo
+    desconto = AjusteProdutosIn(filtro=filtro, preco_delta=-10.9)
+    resumo = await prod_repo.ajustar_lote(desconto, 0, 10)
+    assert (resumo["preco_min_depois"], resumo["preco_max_depois"]) == (0, Decimal("97.10"))
+
+
+@pytest.mark.asyncio
+async def test_alertas_de_estoque_pelo_minimo_de_cada_produto(db_connection):
+    conn = db_connection
+    cat_id = await CategoriaRepository(conn).create(CategoriaIn(nome="Cat Alertas"))
+    prod_repo = ProdutoRepository(conn)
+    antes = (await prod_repo.alertas_estoque(1))["total"]
+
+    baixo, folgado, exigente = [
+        await prod_repo.create(
+            ProdutoIn(
+                nome=f"Alerta {n}", preco=1.0, unidade="un", categoria_id=cat_id,
+                estoque=estoque, estoque_minimo=minimo,
+            )
+        )
+        for n, estoque, minimo in [("A", 9, 10), ("B", 5, 3), ("C", 50, 100)]
+    ]  # fmt: skip
+
+    alertas = await prod_repo.alertas_estoque(500)
+    assert alertas["total"] == antes + 2
+    assert (await DashboardRepository(conn).stats())["estoque_baixo"] == antes + 2
+
+    # Mudar o mínimo tira o produto dos alertas
+    atualizado = await prod_repo.update(exigente, ProdutoUpdate(estoque_minimo=40))
+    assert atualizado["estoque_minimo"] == 40
+    assert (await prod_repo.alertas_estoque(1))["total"] == antes + 1
+
+    # Os mais críticos primeiro
+    await prod_repo.update(baixo, ProdutoUpdate(estoque=-1))
+    primeiro = (await prod_repo.alertas_estoque(1))["itens"][0]
+    assert primeiro["id"] == baixo
+    assert (primeiro["estoque_minimo"], primeiro["categoria_nome"]) == (10, "Cat Alertas")
+    assert folgado not in [a["id"] for a in (await prod_repo.alertas_estoque(500))["itens"]]
@@ -1,8 +1,14 @@
+from datetime import UTC, date, datetime, timedelta
+from decimal import Decimal
+
+import asyncpg
 import pytest
 from fastapi import HTTPException
+from pydantic import ValidationError
 
-from schemas import ProdutoIn
-from services import ProdutoService
+import services
+from schemas import AjusteProdutosIn, PedidoIn, ProdutoFiltro, ProdutoIn
+from services import CarrinhoService, PedidoService, ProdutoService, VendasService
 
 pytestmark = pytest.mark.asyncio
 
@@ -43,3 +49,286 @@ async def test_criar_produto_sem_categoria(mock_db_pool):
 
     assert exc.value.status_code == 404
     assert exc.value.detail == "Categoria não encontrada"
+
+
+async def test_alteracoes_intercala_por_versao_e_pagina(mock_db_pool):
+    pool_mock, conn_mock = mock_db_pool
+    service = ProdutoService(pool_mock)
+
+    conn_mock.fetchval.return_value = 0  # sync_minimo
+    conn_mock.fetch.side_effect = [
+        [{"id": 1, "nome": "A", "versao": 11}, {"id": 2, "nome": "B", "versao": 14}],
+        [{"id": 3, "nome": "Bebidas", "versao": 12}],
+        [{"id": 9, "versao": 13}],
+    ]
+
+    resultado = await service.alteracoes(10, 3)
+
+    # As 3 primeiras versões (11, 12, 13); a 14 fica para a próxima página
+    assert resultado == {
+        "versao": 13,
+        "mais": True,
+        "produtos": [{"id": 1, "nome": "A", "versao": 11}],
+        "categorias": [{"id": 3, "nome": "Bebidas", "versao": 12}],
+        "removidos": [9],
+    }
+
+
+async def test_alteracoes_um_tipo_sozinho_enche_a_pagina(mock_db_pool):
+    pool_mock, conn_mock = mock_db_pool
+    service = ProdutoService(pool_mock)
+
+    conn_mock.fetchval.return_value = 0  # sync_minimo
+    conn_mock.fetch.side_effect = [
+        [{"id": i, "nome": f"P{i}", "versao": 10 + i} for i in (1, 2, 3)],
+        [],
+        [],
+    ]
+
+    resultado = await service.alteracoes(10, 2)
+
+    # Cada tipo é lido com limite + 1: a terceira alteração de produto marca ``mais``
+    assert [c.args[1:] for c in conn_mock.fetch.await_args_list] == [(10, 3)] * 3
+    assert resultado["versao"] == 12
+    assert resultado["mais"] is True
+    assert [p["id"] for p in resultado["produtos"]] == [1, 2]
+
+
+async def test_alteracoes_antes_do_truncate_pede_carga_completa(mock_db_pool):
+    pool_mock, conn_mock = mock_db_pool
+    service = ProdutoService(pool_mock)
+
+    conn_mock.fetchval.return_value = 500  # sync_minimo depois de um TRUNCATE
+    conn_mock.fetch.return_value = []
+
+    with pytest.raises(HTTPException) as exc:
+        await service.alteracoes(10, 100)
+    assert exc.value.status_code == 410
+
+    # since=0 é a carga inicial: nunca recebe 410
+    assert (await service.alteracoes(0, 100))["versao"] == 0
+
+
+async def test_carrinho_precificado_e_servido_do_cache_na_mesma_revisao(mock_db_pool):
+    pool_mock, conn_mock = mock_db_pool
+    service = CarrinhoService(pool_mock)
+
+    conn_mock.fetchval.return_value = 3  # revisão do carrinho
+    conn_mock.fetch.return_value = [
+        {"produto_id": 1, "preco": "10.00", "quantidade": 2, "disponivel": True, "total": "35.00"},
+        {"produto_id": 2, "preco": "15.00", "quantidade": 1, "disponivel": False, "total": "35.00"},
+    ]
+
+    carrinho = await service.obter_carrinho(7)
+    de_novo = await service.obter_carrinho(7)
+
+    assert carrinho["subtotal"] == "35.00"
+    assert carrinho["quantidade_total"] == 3
+    assert carrinho["disponivel"] is False
+    assert "total" not in carrinho["itens"][0]
+    assert de_novo == carrinho
+    # Precificação (uma consulta) só na primeira visualização
+    conn_mock.fetch.assert_awaited_once()
+
+
+async def test_relacionados_404_sem_consultar_vizinhos(mock_db_pool):
+    pool_mock, conn_mock = mock_db_pool
+    service = ProdutoService(pool_mock)
+    conn_mock.fetchrow.return_value = None
+
+    with pytest.raises(HTTPException) as exc:
+        await service.relacionados(999, 8)
+
+    assert exc.value.status_code == 404
+    conn_mock.fetch.assert_not_awaited()
+
+    conn_mock.fetchrow.return_value = {"id": 1, "nome": "Café", "preco": "9.90"}
+    conn_mock.fetch.return_value = [{"id": 2, "nome": "Filtro", "preco": "4.50"}]
+
+    assert await service.relacionados(1, 4) == [{"id": 2, "nome": "Filtro", "preco": "4.50"}]
+    assert conn_mock.fetch.await_args.args[1:] == (1, 4)
+
+
+def _resumo_lote(produtos: int, ultimo_id: int) -> dict:
+    resumo = {"produtos": produtos, "ultimo_id": ultimo_id, "alterados": produtos}
+    for m, preco in (("antes", Decimal("10")), ("depois", Decimal("11"))):
+        resumo |= {
+            f"preco_soma_{m}": preco * produtos,
+            f"preco_min_{m}": preco,
+            f"preco_max_{m}": preco,
+            f"estoque_soma_{m}": produtos,
+            f"sem_estoque_{m}": 0,
+        }
+    return resumo
+
+
+async def test_ajuste_em_massa_em_lotes_ate_o_ultimo_incompleto(mock_db_pool, mocker):
+    pool_mock, conn_mock = mock_db_pool
+    mocker.patch.object(services, "AJUSTE_LOTE", 2)
+    invalidar = mocker.patch.object(services.catalogo_cache, "invalidar")
+    conn_mock.fetchrow.side_effect = [_resumo_lote(2, 5), _resumo_lote(1, 9)]
+    ajuste = AjusteProdutosIn(filtro=ProdutoFiltro(categoria_id=1), preco_percentual=10)
+
+    resultado = await ProdutoService(pool_mock).ajustar_em_massa(ajuste)
+
+    # Segundo lote depois do id 5; lote incompleto encerra sem mais uma consulta
+    # Argumentos: categoria, id de partida, percentual, tamanho do lote
+    assert [c.args[1:] for c in conn_mock.fetchrow.await_args_list] == [
+        (1, 0, Decimal("10.0"), 2),
+        (1, 5, Decimal("10.0"), 2),
+    ]
+    assert resultado["produtos"] == 3
+    assert resultado["lotes"] == 2
+    assert resultado["antes"]["preco_medio"] == Decimal("10")
+    assert resultado["depois"]["preco_max"] == Decimal("11")
+    invalidar.assert_awaited_once()
+
+
+async def test_ajuste_em_massa_dry_run_e_validacao(mock_db_pool, mocker):
+    pool_mock, conn_mock = mock_db_pool
+    invalidar = mocker.patch.object(services.catalogo_cache, "invalidar")
+    vazio = _resumo_lote(0, 0) | {k: None for k in _resumo_lote(0, 0) if "_" in k}
+    conn_mock.fetchrow.return_value = vazio
+
+    resultado = await ProdutoService(pool_mock).ajustar_em_massa(
+        AjusteProdutosIn(filtro=ProdutoFiltro(), estoque_delta=5, dry_run=True)
+    )
+
+    assert "UPDATE" not in conn_mock.fetchrow.await_args.args[0]
+    assert resultado["produtos"] == 0
+    assert resultado["depois"]["preco_medio"] is None
+    invalidar.assert_not_awaited()
+    # Exatamente uma operação por ajuste
+    with pytest.raises(ValidationError):
+        AjusteProdutosIn(filtro=ProdutoFiltro(), preco_delta=1, estoque_delta=1)
+    with pytest.raises(ValidationError):
+        AjusteProdutosIn(filtro=ProdutoFiltro())
+
+
+async def test_carrinho_item_de_produto_inexistente(mock_db_pool):
+    pool_mock, conn_mock = mock_db_pool
+    service = CarrinhoService(pool_mock)
+
+    erro = asyncpg.ForeignKeyViolationError("viola FK")
+    erro.constraint_name = "carrinho_item_produto_id_fkey"
+    conn_mock.execute.side_effect = erro
+
+    with pytest.raises(HTTPException) as exc:
+        await service.definir_item(7, 999, 1)
+
+    assert exc.value.status_code == 404
+    assert exc.value.detail == "Produto não encontrado"
+
+
+async def test_historico_pagina_por_cursor_com_itens_em_lote(mock_db_pool):
+    pool_mock, conn_mock = mock_db_pool
+    service = PedidoService(pool_mock)
+
+    data = datetime(2026, 5, 1, 12, 30, tzinfo=UTC)
+    conn_mock.fetch.side_effect = [
+        # limite + 1 linhas: existe uma próxima página
+        [{"id": i, "criado_em": data, "status": "Entregue"} for i in (30, 20, 10)],
+        [
+            {"pedido_id": 30, "linha": 1, "produto_id": 1},
+            {"pedido_id": 20, "linha": 1, "produto_id": 2},
+            {"pedido_id": 30, "linha": 2, "produto_id": 3},
+        ],
+    ]
+
+    pagina = await service.listar(7, 2)
+
+    assert [p["id"] for p in pagina["pedidos"]] == [30, 20]
+    assert [i["linha"] for i in pagina["pedidos"][0]["itens"]] == [1, 2]
+    # Itens da página inteira numa consulta só, sem o pedido da página seguinte
+    assert conn_mock.fetch.await_args.args[1] == [30, 20]
+
+    conn_mock.fetch.side_effect = [[], []]
+    await service.listar(7, 2, pagina["proximo"])
+    assert conn_mock.fetch.await_args.args[1:] == (7, 3, data, 20)
+
+
+async def test_historico_cursor_invalido(mock_db_pool):
+    pool_mock, _ = mock_db_pool
+
+    with pytest.raises(HTTPException) as exc:
+        await PedidoService(pool_mock).listar(7, 20, "nao-e-cursor")
+
+    assert exc.value.status_code == 400
+
+
+async def test_finalizar_sem_estoque_nao_cria_pedido(mock_db_pool):
+    pool_mock, conn_mock = mock_db_pool
+    service = PedidoService(pool_mock)
+
+    conn_mock.fetch.return_value = [
+        {"produto_id": 1, "nome": "A", "preco": Decimal("10.00"), "quantidade": 2, "estoque": 5},
+        {"produto_id": 2, "nome": "B", "preco": Decimal("5.00"), "quantidade": 3, "estoque": 1},
+    ]
+
+    with pytest.raises(HTTPException) as exc:
+        await service.finalizar(7, PedidoIn())
+
+    assert exc.value.status_code == 409
+    assert exc.value.detail["produtos"] == [2]
+    conn_mock.execute.assert_not_awaited()
+    conn_mock.fetchrow.assert_not_awaited()
+
+
+async def test_relatorio_de_vendas_totaliza_a_serie_dos_rollups(mock_db_pool):
+    pool_mock, conn_mock = mock_db_pool
+    service = VendasService(pool_mock)
+
+    conn_mock.fetchval.return_value = date(2026, 10, 19)  # dia atual no fuso da loja
+    conn_mock.fetch.side_effect = [
+        [
+            {
+                "periodo": date(2026, 10, 18),
+                "pedidos": 2,
+                "itens": 5,
+                "receita": "100.00",
+                "frete": "50.00",
+            },
+            {
+                "periodo": date(2026, 10, 19),
+                "pedidos": 1,
+                "itens": 1,
+                "receita": "25.50",
+                "frete": "25.00",
+            },
+        ],
+        [{"produto_id": 1, "nome": "A", "quantidade": 3, "receita": "60.00"}],
+        [{"categoria_id": 2, "nome": "Cat", "quantidade": 6, "receita": "75.50"}],
+    ]
+
+    relatorio = await service.relatorio("dia")
+
+    # Padrão: os últimos 30 dias, terminando hoje
+    assert (relatorio["inicio"], relatorio["fim"]) == (date(2026, 9, 20), date(2026, 10, 19))
+    assert relatorio["totais"] == {
+        "pedidos": 3,
+        "itens": 6,
+        "receita": "125.50",
+        "frete": "75.00",
+        "ticket_medio": "41.83",
+    }
+    assert relatorio["top_produtos"][0]["produto_id"] == 1
+    # Três leituras num único snapshot
+    conn_mock.transaction.assert_called_once_with(isolation="repeatable_read", readonly=True)
+
+
+async def test_relatorio_de_vendas_rejeita_faixas_invalidas(mock_db_pool):
+    pool_mock, conn_mock = mock_db_pool
+    service = VendasService(pool_mock)
+    agora = datetime.now(UTC)
+
+    for granularidade, inicio, fim in [
+        ("dia", datetime(2026, 10, 10), datetime(2026, 10, 1)),
+        ("dia", datetime(2020, 1, 1), datetime(2026, 1, 1)),
+        # Linhas por hora antigas já foram apagadas pelo job de compactação
+        ("hora", agora - timedelta(days=120), agora - timedelta(days=119)),
+    ]:
+        with pytest.raises(HTTPException) as exc:
+            await service.relatorio(granularidade, inicio, fim)
+        assert exc.value.status_code == 400
+
+    conn_mock.fetch.assert_not_awaited()
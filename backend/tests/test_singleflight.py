@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from services import ProdutoService, leituras
+from singleflight import SingleFlight
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_chamadas_simultaneas_compartilham_uma_execucao():
+    sf = SingleFlight()
+    chamadas = 0
+    liberar = asyncio.Event()
+
+    async def consulta():
+        nonlocal chamadas
+        chamadas += 1
+        await liberar.wait()
+        return [1, 2, 3]
+
+    tarefas = [asyncio.create_task(sf.do(("produtos",), consulta)) for _ in range(50)]
+    await asyncio.sleep(0)
+    liberar.set()
+    resultados = await asyncio.gather(*tarefas)
+
+    assert chamadas == 1
+    assert all(r == [1, 2, 3] for r in resultados)
+    assert len(sf) == 0
+    # Depois de terminar, uma nova chamada executa de novo
+    await sf.do(("produtos",), consulta)
+    assert chamadas == 2
+
+
+async def test_erro_propagado_para_todos():
+    sf = SingleFlight()
+
+    async def falha():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("banco fora")
+
+    resultados = await asyncio.gather(
+        *(sf.do(("produto", 1), falha) for _ in range(3)), return_exceptions=True
+    )
+
+    assert all(isinstance(r, RuntimeError) for r in resultados)
+    assert len(sf) == 0
+
+
+async def test_timeout_de_um_chamador_nao_cancela_os_outros():
+    sf = SingleFlight()
+
+    async def lenta():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    apressado = asyncio.create_task(sf.do(("produto", 2), lenta, timeout=0.01))
+    paciente = asyncio.create_task(sf.do(("produto", 2), lenta, timeout=1))
+
+    with pytest.raises(asyncio.TimeoutError):
+        await apressado
+    assert await paciente == "ok"
+
+
+async def test_obter_produto_coalescido_e_404_por_chamador(mock_db_pool):
+    pool_mock, conn_mock = mock_db_pool
+
+    async def buscar(*args):
+        await asyncio.sleep(0.01)
+        return None
+
+    conn_mock.fetchrow.side_effect = buscar
+    service = ProdutoService(pool_mock)
+
+    resultados = await asyncio.gather(
+        *(service.obter_produto(999) for _ in range(5)), return_exceptions=True
+    )
+
+    assert conn_mock.fetchrow.await_count == 1
+    assert all(getattr(r, "status_code", None) == 404 for r in resultados)
+    assert resultados[0] is not resultados[1]
+    assert len(leituras) == 0
@@ -0,0 +1,219 @@
+import asyncio
+import mmap
+import os
+from unittest.mock import AsyncMock, MagicMock
+
+import asyncpg
+import pytest
+
+import snapshot
+from admission import request_deadline
+from repositories import CategoriaRepository, ProdutoRepository
+from schemas import ProdutoFiltro
+from snapshot import Snapshot, SnapshotCatalogo
+
+pytestmark = pytest.mark.asyncio
+
+TEST_DB_URL = os.getenv("TEST_DB_URL", "postgresql://user:pass@db:5432/test_db")
+
+CATEGORIAS = [{"id": 2, "nome": "Bebidas"}, {"id": 1, "nome": "Eletrônicos"}]
+PRODUTOS = [
+    {"id": 3, "nome": "Café Especial", "preco": "29.90", "unidade": "kg", "estoque": 5,
+     "categoria_id": 2, "versao": 11, "estoque_minimo": 10},
+    {"id": 7, "nome": "Notebook Gamer", "preco": "4500.00", "unidade": "un", "estoque": 0,
+     "categoria_id": 1, "versao": 12, "estoque_minimo": 1},
+    {"id": 9, "nome": "CAFETEIRA", "preco": "150", "unidade": "un", "estoque": 2,
+     "categoria_id": None, "versao": 13, "estoque_minimo": 0},
+]  # fmt: skip
+
+
+def _abrir(caminho) -> Snapshot:
+    with open(caminho, "rb") as f:
+        return Snapshot(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _snapshot(tmp_path, versao=5) -> Snapshot:
+    caminho = tmp_path / "catalogo.snap"
+    snapshot.gravar(str(caminho), versao, PRODUTOS, CATEGORIAS)
+    return _abrir(caminho)
+
+
+def _ids(produtos) -> list[int]:
+    return [p["id"] for p in produtos]
+
+
+async def test_listagem_e_produto_com_as_formas_do_banco(tmp_path):
+    snap = _snapshot(tmp_path)
+
+    assert snap.versao == 5
+    assert snap.listar()[0] == {
+        "id": 3,
+        "nome": "Café Especial",
+        "preco": "29.90",
+        "unidade": "kg",
+        "estoque": 5,
+        "categoria_id": 2,
+        "categoria_nome": "Bebidas",
+    }
+    assert snap.listar()[2]["categoria_nome"] is None
+    assert snap.obter(7) == {
+        "id": 7,
+        "nome": "Notebook Gamer",
+        "preco": 4500.0,
+        "unidade": "un",
+        "categoria_id": 1,
+        "estoque": 0,
+        "versao": 12,
+        "estoque_minimo": 1,
+    }
+    assert snap.obter(8) is None
+    assert snap.obter(100) is None
+    assert snap.categorias_por_nome() == CATEGORIAS
+
+
+async def test_filtros_iguais_aos_do_sql(tmp_path):
+    snap = _snapshot(tmp_path)
+
+    assert _ids(snap.filtrar(ProdutoFiltro(busca="caf"))) == [3, 9]
+    assert _ids(snap.filtrar(ProdutoFiltro(busca="É ESP"))) == [3]
+    # O trecho não casa juntando o fim de um nome com o começo do próximo
+    assert snap.filtrar(ProdutoFiltro(busca="gamercafe")) == []
+    assert _ids(snap.filtrar(ProdutoFiltro(categoria_id=1))) == [7]
+    assert _ids(snap.filtrar(ProdutoFiltro(preco_min=29.9, preco_max=150))) == [3, 9]
+    assert _ids(snap.filtrar(ProdutoFiltro(em_estoque=False))) == [7]
+    assert _ids(snap.filtrar(ProdutoFiltro(busca="a", em_estoque=True))) == [3, 9]
+    # Curingas do ILIKE ficam com o banco
+    assert snap.filtrar(ProdutoFiltro(busca="caf%")) is None
+
+
+async def test_arquivo_truncado_ou_de_outro_formato_e_rejeitado(tmp_path):
+    caminho = tmp_path / "catalogo.snap"
+    conteudo = snapshot.serializar(5, PRODUTOS, CATEGORIAS)
+
+    caminho.write_bytes(conteudo[:-16])
+    with pytest.raises(ValueError):
+        _abrir(caminho)
+
+    caminho.write_bytes(b"X" + conteudo[1:])
+    with pytest.raises(ValueError):
+        _abrir(caminho)
+
+
+def _pool(versoes: list[int]):
+    conn = MagicMock()
+    conn.fetchval = AsyncMock(side_effect=versoes)
+    conn.fetch = AsyncMock(side_effect=[PRODUTOS, CATEGORIAS] * len(versoes))
+    transacao = AsyncMock()
+    transacao.__aenter__.return_value = None
+    transacao.__aexit__.return_value = None
+    conn.transaction = MagicMock(return_value=transacao)
+    acquire = AsyncMock()
+    acquire.__aenter__.return_value = conn
+    acquire.__aexit__.return_value = None
+    pool = MagicMock()
+    pool.acquire.return_value = acquire
+    return pool, conn
+
+
+async def test_constroi_na_versao_nova_e_usa_o_banco_enquanto_isso(tmp_path, mocker):
+    mocker.patch("snapshot.CONSTRUCAO_INTERVALO_S", 0)
+    catalogo = SnapshotCatalogo(str(tmp_path), ativo=True)
+    # conferência, construção; depois conferência da versão 6, construção
+    pool, conn = _pool([5, 5, 6, 6])
+
+    await catalogo.aquecer(pool)
+    assert (await catalogo.atual(pool)).versao == 5
+    # Dentro do intervalo de conferência não há consulta
+    assert conn.fetchval.await_count == 2
+
+    catalogo.expirar()
+    assert await catalogo.atual(pool) is None
+    await catalogo._tarefa
+    assert (await catalogo.atual(pool, versao=6)).versao == 6
+
+
+async def test_reconstrucao_espera_o_intervalo(tmp_path, mocker):
+    """Versões novas logo após uma construção esperam o intervalo, numa tarefa só"""
+    mocker.patch("snapshot.CONSTRUCAO_INTERVALO_S", 60)
+    catalogo = SnapshotCatalogo(str(tmp_path), ativo=True)
+    pool, conn = _pool([5, 5])
+    await catalogo.aquecer(pool)
+
+    assert await catalogo.atual(pool, versao=6) is None
+    tarefa = catalogo._tarefa
+    assert await catalogo.atual(pool, versao=7) is None
+    await asyncio.sleep(0)
+
+    assert catalogo._tarefa is tarefa and not tarefa.done()
+    assert conn.fetch.await_count == 2
+    tarefa.cancel()
+
+
+async def test_construcao_nao_herda_o_prazo_da_requisicao(tmp_path):
+    catalogo = SnapshotCatalogo(str(tmp_path), ativo=True)
+    pool, _ = _pool([5])
+    prazos = []
+    acquire = pool.acquire.return_value
+    pool.acquire.side_effect = lambda: prazos.append(request_deadline.get()) or acquire
+
+    token = request_deadline.set(123.0)
+    try:
+        assert await catalogo.atual(pool, versao=5) is None
+    finally:
+        request_deadline.reset(token)
+    await catalogo._tarefa
+
+    assert prazos == [None]
+    assert catalogo.snapshot.versao == 5
+
+
+async def test_outro_worker_mapeia_o_arquivo_sem_construir(tmp_path):
+    snapshot.gravar(str(tmp_path / "catalogo.snap"), 5, PRODUTOS, CATEGORIAS)
+    catalogo = SnapshotCatalogo(str(tmp_path), ativo=True)
+    pool, conn = _pool([])
+
+    atual = await catalogo.atual(pool, versao=5)
+
+    assert atual.versao == 5
+    conn.fetch.assert_not_awaited()
+    assert catalogo.estatisticas()["produtos"] == len(PRODUTOS)
+
+
+async def test_snapshot_responde_como_o_banco():
+    conn = await asyncpg.connect(TEST_DB_URL)
+    tr = conn.transaction()
+    await tr.start()
+    try:
+        # Nomes ASCII: em locale C o ILIKE não ignora maiúsculas acentuadas
+        cid = await conn.fetchval(
+            "INSERT INTO categoria (nome) VALUES ('Snapshot Teste') RETURNING id"
+        )
+        await conn.executemany(
+            "INSERT INTO produto (nome, preco, unidade, categoria_id, estoque) VALUES ($1, $2, 'un', $3, $4)",
+            [
+                ("Acao Snapshot Impar", 10.5, cid, 0),
+                ("acao snapshot par", 99.99, cid, 3),
+                ("Sem Categoria Snapshot", 1, None, 1),
+            ],
+        )
+        versao = await ProdutoRepository(conn).catalog_version()
+        conteudo = snapshot.serializar(
+            versao,
+            await ProdutoRepository(conn).list_snapshot(),
+            await CategoriaRepository(conn).list_all(),
+        )
+        snap = Snapshot(conteudo)
+
+        repo = ProdutoRepository(conn)
+        assert snap.listar() == await repo.list_all()
+        for filtro in (
+            ProdutoFiltro(busca="ACAO SNAP"),
+            ProdutoFiltro(busca="snapshot", em_estoque=True),
+            ProdutoFiltro(categoria_id=cid, preco_max=10.5),
+            ProdutoFiltro(preco_min=99.99, busca="snapshot"),
+        ):
+            assert snap.filtrar(filtro) == await repo.list_all(filtro), filtro
+        assert snap.categorias_por_nome() == await CategoriaRepository(conn).list_all()
+    finally:
+        await tr.rollback()
+        await conn.close()
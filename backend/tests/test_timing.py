@@ -0,0 +1,85 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import metrics
+from compression import PrecompressedCache
+from main import app, get_produto_service
+from timing import TimedPool, _fases, medir, registrar
+
+pytestmark = pytest.mark.asyncio
+
+
+def _fases_do_header(valor: str) -> dict[str, float]:
+    fases = {}
+    for parte in valor.split(","):
+        nome, dur = parte.strip().split(";dur=")
+        fases[nome] = float(dur)
+    return fases
+
+
+async def test_registrar_fora_de_requisicao_nao_faz_nada():
+    """Sem middleware ativa, as medições são descartadas"""
+    registrar("sql", 1.0)
+    with medir("bcrypt"):
+        pass
+    assert _fases.get() is None
+
+
+async def test_header_server_timing_por_fase(mocker):
+    """A resposta traz as fases do endpoint e da serialização, e o total"""
+    mock_service = mocker.Mock()
+
+    async def listar(versao=None):
+        registrar("sql", 0.002)
+        return [{"id": 1, "nome": "Produto"}]
+
+    mock_service.listar_produtos = listar
+    mock_service.versao_catalogo = AsyncMock(return_value=1)
+    mocker.patch("main.catalogo_cache", PrecompressedCache())
+    app.dependency_overrides[get_produto_service] = lambda: mock_service
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.get("/produtos")
+
+    app.dependency_overrides = {}
+
+    fases = _fases_do_header(response.headers["server-timing"])
+    assert fases["sql"] == pytest.approx(2.0)
+    assert {"endpoint", "serializacao", "total"} <= fases.keys()
+    assert fases["total"] >= fases["endpoint"]
+    assert ("/produtos", "sql") in metrics.SERVER_TIMING_SECONDS.series
+
+
+async def test_timed_pool_mede_espera_do_acquire(mock_db_pool):
+    """O acquire pelo TimedPool entrega a conexão e soma a fase db-acquire"""
+    pool_mock, conn_mock = mock_db_pool
+    pool = TimedPool(pool_mock)
+
+    fases: dict[str, float] = {}
+    token = _fases.set(fases)
+    try:
+        async with pool.acquire() as conn:
+            assert conn is conn_mock
+    finally:
+        _fases.reset(token)
+
+    assert "db-acquire" in fases
+    assert pool.get_min_size is pool_mock.get_min_size
+
+
+async def test_timed_pool_await_direto():
+    """``await pool.acquire()`` também passa pela medição"""
+    conexao = MagicMock()
+    inner = MagicMock()
+    inner.acquire.return_value = AsyncMock(return_value=conexao)()
+
+    fases: dict[str, float] = {}
+    token = _fases.set(fases)
+    try:
+        assert await TimedPool(inner).acquire() is conexao
+    finally:
+        _fases.reset(token)
+
+    assert "db-acquire" in fases
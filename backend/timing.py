@@ -0,0 +1,154 @@
+"""
+Cronômetros por requisição para o header ``Server-Timing``.
+
+A ``ServerTimingMiddleware`` abre um dicionário de fases num ContextVar; cada
+camada soma seu tempo nele com ``registrar``/``medir``:
+
+- ``db-acquire``: espera por uma conexão do pool (``TimedPool``)
+- ``sql``: execução das consultas (``metrics.InstrumentedConnection``)
+- ``conversao``: Record -> dict nos repositórios e services
+- ``bcrypt``: hash/verificação de senha
+- ``endpoint`` / ``serializacao``: tempo da função da rota e o que o FastAPI
+  gasta em volta dela (validação e codificação JSON), via ``TimingRoute``
+
+Fora de uma requisição ``registrar`` não faz nada, então o custo é um
+``ContextVar.get`` por medição.
+"""
+
+import asyncio
+import functools
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi.routing import APIRoute
+
+_fases: ContextVar[dict[str, float] | None] = ContextVar("server_timing", default=None)
+
+
+def registrar(fase: str, segundos: float):
+    fases = _fases.get()
+    if fases is not None:
+        fases[fase] = fases.get(fase, 0.0) + segundos
+
+
+@contextmanager
+def medir(fase: str):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar(fase, time.perf_counter() - inicio)
+
+
+def formatar(fases: dict[str, float]) -> str:
+    return ", ".join(f"{fase};dur={segundos * 1000:.2f}" for fase, segundos in fases.items())
+
+
+class ServerTimingMiddleware:
+    """
+    Middleware ASGI pura. ``on_complete(route, fases)`` recebe o template da rota e
+    as fases ao fim de cada requisição (usado para agregar no /metrics).
+    """
+
+    def __init__(self, app, on_complete: Callable[[str, dict[str, float]], None] | None = None):
+        self.app = app
+        self.on_complete = on_complete
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        fases: dict[str, float] = {}
+        token = _fases.set(fases)
+        inicio = time.perf_counter()
+
+        async def send_com_timing(message):
+            if message["type"] == "http.response.start":
+                total = {**fases, "total": time.perf_counter() - inicio}
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", formatar(total).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_com_timing)
+        finally:
+            _fases.reset(token)
+            fases["total"] = time.perf_counter() - inicio
+            if self.on_complete is not None:
+                route = getattr(scope.get("route"), "path", None) or "nao_roteada"
+                self.on_complete(route, fases)
+
+
+def _medir_endpoint(endpoint):
+    if not asyncio.iscoroutinefunction(endpoint):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    async def medido(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            registrar("endpoint", time.perf_counter() - inicio)
+
+    return medido
+
+
+class TimingRoute(APIRoute):
+    """
+    Rota que separa o tempo da função do endpoint do resto do handler do FastAPI
+    (leitura/validação do corpo, jsonable_encoder e render do JSON).
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _medir_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def handler_medido(request):
+            inicio = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                fases = _fases.get()
+                if fases is not None:
+                    total = time.perf_counter() - inicio
+                    fases["serializacao"] = max(0.0, total - fases.get("endpoint", 0.0))
+
+        return handler_medido
+
+
+class _AcquireMedido:
+    def __init__(self, ctx):
+        self._ctx = ctx
+
+    async def __aenter__(self):
+        with medir("db-acquire"):
+            return await self._ctx.__aenter__()
+
+    async def __aexit__(self, *exc):
+        return await self._ctx.__aexit__(*exc)
+
+    async def _aguardar(self):
+        with medir("db-acquire"):
+            return await self._ctx
+
+    def __await__(self):
+        return self._aguardar().__await__()
+
+
+class TimedPool:
+    """Envolve o pool do asyncpg medindo a espera de cada acquire."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def acquire(self, *, timeout: float | None = None):
+        return _AcquireMedido(self.inner.acquire(timeout=timeout))
+
+    def __getattr__(self, nome):
+        return getattr(self.inner, nome)